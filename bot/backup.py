@@ -0,0 +1,158 @@
+"""Scheduled online backups of the main database and the hosted bot tenant files.
+
+Every ``BACKUP_INTERVAL_HOURS`` a worker thread copies the database with
+SQLite's backup API, ``BACKUP_STEP_PAGES`` pages per step with a short pause
+between steps, so the event loop never waits on it. The source connection holds
+one read transaction for the whole copy: in WAL mode that pins a consistent
+snapshot, so writers keep committing and the backup never restarts because of
+them. The copy is optionally checked with ``PRAGMA integrity_check``, gzipped
+to ``BACKUP_DIR/<name>-YYYYmmdd-HHMMSS.db.gz`` and only the newest
+``BACKUP_KEEP`` snapshots are kept.
+
+With ``HOSTED_DB_MODE=tenant`` every ``TENANT_DB_DIR/bot_<id>.db`` is snapshotted
+the same way, one after another, into ``BACKUP_DIR/tenants`` with its own
+rotation; a failed tenant is logged and the rest still run.
+
+``python -m bot.backup`` takes one round of snapshots now.
+"""
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from glob import glob
+from typing import Dict, List, Tuple
+from .config import (logger, DATABASE_PATH, BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP, BACKUP_STEP_PAGES, BACKUP_STEP_SLEEP_MS, BACKUP_VERIFY,
+                     HOSTED_DB_MODE, TENANT_DB_DIR)
+
+
+def _snapshot(source: str, target: str, step_pages: int, pause: float) -> Dict[str, float]:
+    src = sqlite3.connect(source, isolation_level=None)
+    dst = sqlite3.connect(target)
+    stats = {'pages': 0, 'steps': 0}
+
+    def progress(status, remaining, total):
+        stats['pages'], stats['steps'] = total, stats['steps'] + 1
+        if pause:
+            time.sleep(pause)
+    try:
+        src.execute("PRAGMA busy_timeout = 5000")
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=max(1, step_pages), progress=progress)
+        src.execute("COMMIT")
+    finally:
+        dst.close()
+        src.close()
+    return stats
+
+
+def _check(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        return ', '.join(r[0] for r in conn.execute("PRAGMA integrity_check").fetchall())
+    finally:
+        conn.close()
+
+
+def _compress(path: str, target: str):
+    with open(path, 'rb') as raw, gzip.open(target, 'wb', compresslevel=6) as out:
+        shutil.copyfileobj(raw, out, 1 << 20)
+
+
+class Backups:
+    last: Dict[str, object] = {}
+    totals = {'runs': 0, 'failures': 0}
+
+    @staticmethod
+    def snapshots(directory: str = BACKUP_DIR, source: str = DATABASE_PATH) -> List[str]:
+        """Existing snapshots of ``source``, oldest first."""
+        name = os.path.splitext(os.path.basename(source))[0]
+        return sorted(glob(os.path.join(directory, f"{name}-*.db.gz")))
+
+    @staticmethod
+    def sources() -> List[Tuple[str, str]]:
+        """(database file, snapshot directory) for every database that is backed up."""
+        pairs = [(DATABASE_PATH, BACKUP_DIR)]
+        if HOSTED_DB_MODE == 'tenant':
+            pairs += [(path, os.path.join(BACKUP_DIR, 'tenants')) for path in sorted(glob(os.path.join(TENANT_DB_DIR, 'bot_*.db')))]
+        return pairs
+
+    @staticmethod
+    def _run(source: str, directory: str, keep: int, step_pages: int, pause: float, verify: bool) -> Dict[str, object]:
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.splitext(os.path.basename(source))[0]
+        final = os.path.join(directory, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz")
+        raw = final[:-3] + '.partial'
+        start = time.perf_counter()
+        try:
+            stats = _snapshot(source, raw, step_pages, pause)
+            copied = time.perf_counter()
+            integrity = _check(raw) if verify else 'skipped'
+            if verify and integrity != 'ok':
+                raise RuntimeError(f"integrity check failed: {integrity[:200]}")
+            _compress(raw, final + '.partial')
+            os.replace(final + '.partial', final)
+            size = os.path.getsize(raw)
+        finally:
+            for leftover in (raw, final + '.partial'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        removed = 0
+        for old in Backups.snapshots(directory, source)[:-max(1, keep)]:
+            os.remove(old)
+            removed += 1
+        elapsed = time.perf_counter() - start
+        return {'file': final, 'at': datetime.now().isoformat(timespec='seconds'), 'seconds': round(elapsed, 3),
+                'copy_seconds': round(copied - start, 3), 'pages': stats['pages'], 'steps': stats['steps'],
+                'pages_per_step': round(stats['pages'] / max(1, stats['steps']), 1), 'bytes': size,
+                'compressed_bytes': os.path.getsize(final), 'integrity': integrity, 'rotated': removed}
+
+    @staticmethod
+    async def run_once(source: str = DATABASE_PATH, directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                       step_pages: int = BACKUP_STEP_PAGES, pause_ms: float = BACKUP_STEP_SLEEP_MS, verify: bool = BACKUP_VERIFY) -> Dict[str, object]:
+        Backups.totals['runs'] += 1
+        try:
+            result = await asyncio.to_thread(Backups._run, source, directory, keep, step_pages, pause_ms / 1000, verify)
+        except Exception:
+            Backups.totals['failures'] += 1
+            raise
+        if source == DATABASE_PATH:
+            Backups.last = result
+        return result
+
+    @staticmethod
+    async def run_all() -> List[Dict[str, object]]:
+        """Snapshot every database in ``sources``; failures are logged and skipped."""
+        results = []
+        for source, directory in Backups.sources():
+            try:
+                results.append(await Backups.run_once(source, directory))
+            except Exception as e:
+                logger.error(f"Backup of {source} failed: {e}")
+        return results
+
+    @staticmethod
+    def get_stats() -> Dict[str, object]:
+        return {**Backups.totals, **{k: Backups.last.get(k) for k in ('at', 'seconds', 'pages', 'pages_per_step', 'compressed_bytes', 'integrity')}}
+
+    @staticmethod
+    async def run(interval_hours: float = BACKUP_INTERVAL_HOURS):
+        if interval_hours <= 0:
+            return
+        existing = Backups.snapshots()
+        # Restarts don't postpone the schedule: the first run is due one interval after the newest snapshot.
+        due = os.path.getmtime(existing[-1]) + interval_hours * 3600 if existing else time.time() + 60
+        while True:
+            await asyncio.sleep(max(0.0, due - time.time()))
+            due = time.time() + interval_hours * 3600
+            for r in await Backups.run_all():
+                logger.info(f"Backup {os.path.basename(r['file'])}: {r['pages']} pages in {r['steps']} steps ({r['pages_per_step']}/step), "
+                            f"{r['seconds']}s, {r['bytes'] >> 10} KiB -> {r['compressed_bytes'] >> 10} KiB, integrity {r['integrity']}, rotated {r['rotated']}")
+
+
+if __name__ == '__main__':
+    for r in asyncio.run(Backups.run_all()):
+        print(r)
@@ -15,6 +15,73 @@ CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME", "@YourChannel")
 VERIFICATION_SERVER_PORT = int(os.getenv("VERIFICATION_PORT", "8080"))
 FINGERPRINT_WEB_URL = os.getenv("FINGERPRINT_WEB_URL", "https://islamb3.github.io/Test-i7alat/")
 DATABASE_PATH = os.getenv("DATABASE_PATH", "bot_database.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_COMMIT_INTERVAL_MS = float(os.getenv("DB_COMMIT_INTERVAL_MS", "5"))
+DB_MAX_BATCH = int(os.getenv("DB_MAX_BATCH", "256"))
+# Read-only connections reserved for statistics and admin screens.
+ANALYTICS_READERS = int(os.getenv("ANALYTICS_READERS", "2"))
+COUNTERS_RECONCILE_HOURS = float(os.getenv("COUNTERS_RECONCILE_HOURS", "6"))
+LEDGER_LIVE_MONTHS = int(os.getenv("LEDGER_LIVE_MONTHS", "3"))
+LEDGER_ARCHIVE_CHUNK = int(os.getenv("LEDGER_ARCHIVE_CHUNK", "2000"))
+# "shared": hosted bots' tables live in DATABASE_PATH; "tenant": one SQLite file per hosted bot.
+HOSTED_DB_MODE = os.getenv("HOSTED_DB_MODE", "shared")
+TENANT_DB_DIR = os.getenv("TENANT_DB_DIR", os.path.join(os.path.dirname(DATABASE_PATH) or ".", "tenants"))
+TENANT_DB_IDLE_SECONDS = float(os.getenv("TENANT_DB_IDLE_SECONDS", "600"))
+JANITOR_INTERVAL_MINUTES = float(os.getenv("JANITOR_INTERVAL_MINUTES", "30"))
+JANITOR_CHUNK = int(os.getenv("JANITOR_CHUNK", "500"))
+JANITOR_VACUUM_PAGES = int(os.getenv("JANITOR_VACUUM_PAGES", "2000"))
+IP_ATTEMPTS_RETENTION_HOURS = int(os.getenv("IP_ATTEMPTS_RETENTION_HOURS", "24"))
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(DATABASE_PATH) or ".", "backups"))
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "6"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+BACKUP_STEP_SLEEP_MS = float(os.getenv("BACKUP_STEP_SLEEP_MS", "2"))
+BACKUP_VERIFY = os.getenv("BACKUP_VERIFY", "1") == "1"
+# Cached user rows (see bot/usercache.py); a TTL of 0 disables the cache.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+# Updates issuing more queries than this are logged as warnings.
+UPDATE_QUERY_WARN = int(os.getenv("UPDATE_QUERY_WARN", "12"))
+# Leaderboards (see bot/leaderboard.py).
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "100"))
+LEADERBOARD_SAMPLES = int(os.getenv("LEADERBOARD_SAMPLES", "1024"))
+LEADERBOARD_REBUILD_MINUTES = float(os.getenv("LEADERBOARD_REBUILD_MINUTES", "15"))
+# Daily streak reminders (see bot/reminders.py).
+REMINDER_LEAD_HOURS = float(os.getenv("REMINDER_LEAD_HOURS", "4"))
+REMINDER_RATE_PER_SECOND = float(os.getenv("REMINDER_RATE_PER_SECOND", "20"))
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "100"))
+# Public HTTPS address of the verification server; when set, bots receive updates
+# by webhook at WEBHOOK_BASE_URL/webhook/<bot id> instead of polling (see bot/webhooks.py).
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+# Key for the per-bot webhook secret tokens; derived from BOT_TOKEN when unset.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Shared HTTP session of all bots (see bot/sessions.py). TELEGRAM_API_URL points at a local Bot API server.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "0" if not WEBHOOK_BASE_URL else "200"))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "0" if not WEBHOOK_BASE_URL else "100"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_DNS_CACHE_SECONDS = int(os.getenv("HTTP_DNS_CACHE_SECONDS", "300"))
+# Hosted bot lifecycle (see bot/hosting.py). The getUpdates timeout doubles from HOSTED_POLL_TIMEOUT_SECONDS
+# up to HOSTED_POLL_MAX_TIMEOUT_SECONDS while a token gets no updates. A bot is "warm" after
+# HOSTED_WARM_AFTER_MINUTES without updates and stops polling after HOSTED_HIBERNATE_MINUTES; hibernated bots
+# are checked for pending updates every HOSTED_WAKE_CHECK_SECONDS, HOSTED_WAKE_CONCURRENCY at a time.
+# Each check is one instant getUpdates request per hibernated bot, so a wake check shorter than
+# HOSTED_POLL_MAX_TIMEOUT_SECONDS costs more requests and sockets than leaving the bot polling; the price of a
+# longer one is latency, since a sleeping bot's first reply can wait up to that long.
+HOSTED_POLL_TIMEOUT_SECONDS = int(os.getenv("HOSTED_POLL_TIMEOUT_SECONDS", "20"))
+HOSTED_POLL_MAX_TIMEOUT_SECONDS = int(os.getenv("HOSTED_POLL_MAX_TIMEOUT_SECONDS", "50"))
+HOSTED_WARM_AFTER_MINUTES = float(os.getenv("HOSTED_WARM_AFTER_MINUTES", "10"))
+HOSTED_HIBERNATE_MINUTES = float(os.getenv("HOSTED_HIBERNATE_MINUTES", "60"))
+HOSTED_WAKE_CHECK_SECONDS = float(os.getenv("HOSTED_WAKE_CHECK_SECONDS", "60"))
+HOSTED_WAKE_CONCURRENCY = int(os.getenv("HOSTED_WAKE_CONCURRENCY", "20"))
+# Startup of the hosted bots: at most HOSTED_START_CONCURRENCY at once and HOSTED_START_RATE_PER_SECOND per second;
+# a token failing get_me for another reason than being revoked is tried HOSTED_START_RETRIES times.
+HOSTED_START_CONCURRENCY = int(os.getenv("HOSTED_START_CONCURRENCY", "10"))
+HOSTED_START_RATE_PER_SECOND = float(os.getenv("HOSTED_START_RATE_PER_SECOND", "20"))
+HOSTED_START_RETRIES = int(os.getenv("HOSTED_START_RETRIES", "3"))
+# Key for signing verification links; derived from BOT_TOKEN when unset.
+VERIFICATION_SECRET = os.getenv("VERIFICATION_SECRET", "")
 
 if not BOT_TOKEN:
     print("❌ خطأ: لم يتم تعيين BOT_TOKEN في ملف .env")
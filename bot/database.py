@@ -1,10 +1,22 @@
 import sqlite3
 import json
+import os
+import asyncio
+import base64
+import hashlib
+import hmac
 import secrets
 import string
-from datetime import datetime, timedelta
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
 from typing import Dict, Any, Optional, List
-from .config import logger, DATABASE_PATH
+from urllib.parse import parse_qsl, quote
+import aiosqlite
+from .migrations import migrate, COUNTER_QUERIES
+from .usercache import UserCache
+from .config import logger, DATABASE_PATH, DB_READERS, DB_COMMIT_INTERVAL_MS, DB_MAX_BATCH, ANALYTICS_READERS, COUNTERS_RECONCILE_HOURS, BOT_TOKEN, VERIFICATION_SECRET
 
 CAPTCHA_QUESTIONS = [
     {"question": "ما هي العملة المشفرة التي تستخدم العقود الذكية؟", "options": ["Bitcoin", "Ethereum", "Litecoin", "Dogecoin"], "correct": 1},
@@ -14,53 +26,481 @@ CAPTCHA_QUESTIONS = [
 ]
 
 def setup_database():
-    """Initializes the database schema for the main bot and hosted bots."""
+    """Brings the database schema up to date by applying pending migrations."""
     conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER UNIQUE NOT NULL, username TEXT, full_name TEXT, referral_code TEXT UNIQUE, referred_by INTEGER, captcha_passed BOOLEAN DEFAULT 0, subscribed BOOLEAN DEFAULT 0, registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_banned BOOLEAN DEFAULT 0, points INTEGER DEFAULT 0, ton_balance REAL DEFAULT 0, stars_balance INTEGER DEFAULT 0, wallet_address TEXT, last_daily_bonus TIMESTAMP, daily_streak_count INTEGER DEFAULT 0, fingerprint_hash TEXT, fingerprint_components TEXT, fingerprint_verified BOOLEAN DEFAULT 0, fingerprint_verified_at TIMESTAMP, ip_address TEXT, is_admin BOOLEAN DEFAULT 0, total_referrals INTEGER DEFAULT 0, total_tasks_completed INTEGER DEFAULT 0, total_earned_points INTEGER DEFAULT 0)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS referrals (id INTEGER PRIMARY KEY AUTOINCREMENT, referrer_id INTEGER NOT NULL, referred_id INTEGER UNIQUE NOT NULL, is_valid BOOLEAN DEFAULT 0, points INTEGER DEFAULT 0, date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS ip_attempts (id INTEGER PRIMARY KEY AUTOINCREMENT, ip_address TEXT NOT NULL, user_id INTEGER, attempt_type TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip_attempts ON ip_attempts(ip_address, timestamp)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS banned_ips (id INTEGER PRIMARY KEY AUTOINCREMENT, ip_address TEXT UNIQUE NOT NULL, banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, ban_reason TEXT, ban_duration INTEGER DEFAULT 72, banned_by INTEGER, expires_at TIMESTAMP)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS secret_links (id INTEGER PRIMARY KEY AUTOINCREMENT, secret TEXT UNIQUE NOT NULL, user_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, expires_at TIMESTAMP NOT NULL, used BOOLEAN DEFAULT 0, used_at TIMESTAMP)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_secret ON secret_links(secret)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS device_fingerprints (id INTEGER PRIMARY KEY AUTOINCREMENT, fingerprint_hash TEXT NOT NULL, user_id INTEGER NOT NULL, canvas_hash TEXT, webgl_hash TEXT, audio_hash TEXT, device_info TEXT, ip_address TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(telegram_id))')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fingerprint ON device_fingerprints(fingerprint_hash)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS hosted_bots (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_token TEXT UNIQUE NOT NULL, bot_username TEXT UNIQUE NOT NULL, bot_name TEXT, owner_id INTEGER NOT NULL, plan_type TEXT DEFAULT "free", is_active BOOLEAN DEFAULT 1, expires_at TIMESTAMP, max_users INTEGER DEFAULT 2000, current_users INTEGER DEFAULT 0, total_points_given INTEGER DEFAULT 0, config TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_activity TIMESTAMP, FOREIGN KEY (owner_id) REFERENCES users(telegram_id))')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bot_owner ON hosted_bots(owner_id)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS upgrade_requests (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, bot_id INTEGER NOT NULL, requested_plan TEXT NOT NULL, payment_method TEXT, payment_amount REAL, status TEXT DEFAULT "pending", request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed_date TIMESTAMP, processed_by INTEGER, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, link TEXT, points INTEGER NOT NULL, is_active BOOLEAN DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, max_completions INTEGER DEFAULT 0)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS user_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, task_id INTEGER NOT NULL, completion_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(user_id, task_id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, asset_type TEXT NOT NULL, amount REAL NOT NULL, wallet_address TEXT, status TEXT DEFAULT "pending", request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed_date TIMESTAMP, processed_by INTEGER, notes TEXT)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS points_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action_type TEXT NOT NULL, points INTEGER NOT NULL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS user_settings (user_id INTEGER PRIMARY KEY, notifications_enabled BOOLEAN DEFAULT 1, language TEXT DEFAULT "ar", theme TEXT DEFAULT "default")')
-    cursor.execute('CREATE TABLE IF NOT EXISTS hosted_bot_users (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_telegram_id INTEGER NOT NULL, username TEXT, full_name TEXT, referral_code TEXT, referred_by INTEGER, points INTEGER DEFAULT 0, ton_balance REAL DEFAULT 0, stars_balance INTEGER DEFAULT 0, wallet_address TEXT, joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_activity TIMESTAMP, last_daily_bonus TIMESTAMP, daily_streak_count INTEGER DEFAULT 0, total_referrals INTEGER DEFAULT 0, total_tasks_completed INTEGER DEFAULT 0, total_earned_points INTEGER DEFAULT 0, fingerprint_hash TEXT, ip_address TEXT, is_banned BOOLEAN DEFAULT 0, fingerprint_verified BOOLEAN DEFAULT 0, UNIQUE(bot_id, user_telegram_id), FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS hosted_bot_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, name TEXT NOT NULL, description TEXT, link TEXT, points INTEGER NOT NULL, is_active BOOLEAN DEFAULT 1, max_completions INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS hosted_bot_user_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, task_id INTEGER NOT NULL, completion_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(bot_id, user_id, task_id), FOREIGN KEY (bot_id) REFERENCES hosted_bots(id), FOREIGN KEY (task_id) REFERENCES hosted_bot_tasks(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS hosted_bot_points_history (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, action_type TEXT NOT NULL, points INTEGER NOT NULL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS hosted_bot_withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, asset_type TEXT NOT NULL, amount REAL NOT NULL, wallet_address TEXT, status TEXT DEFAULT "pending", request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed_date TIMESTAMP, processed_by INTEGER, notes TEXT, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))')
-    conn.commit()
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        # Only takes effect before the first table is created; lets the janitor hand free pages back.
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    applied = migrate(conn)
     conn.close()
-    print("✅ Database setup complete")
+    print(f"✅ Database setup complete (migrations applied: {applied or 'none'})")
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+async def fetch_one(conn, sql: str, params=()):
+    async with conn.execute(sql, params) as cur:
+        return await cur.fetchone()
+
+async def fetch_all(conn, sql: str, params=()):
+    async with conn.execute(sql, params) as cur:
+        return await cur.fetchall()
+
+# Pool calls made by the current update; set by UserLoaderMiddleware.
+query_count: ContextVar[Optional[List[int]]] = ContextVar("query_count", default=None)
+
+def _count_query():
+    n = query_count.get()
+    if n is not None:
+        n[0] += 1
+
+class _Abandoned(Exception):
+    """Raised inside a batch when a leased ``transaction()`` body failed or was cancelled."""
+
+class _Fetch:
+    async def fetchone(self, sql: str, params=()):
+        async with self.read() as conn:
+            return await fetch_one(conn, sql, params)
+
+    async def fetchall(self, sql: str, params=()):
+        async with self.read() as conn:
+            return await fetch_all(conn, sql, params)
+
+    async def fetchval(self, sql: str, params=(), default=None):
+        row = await self.fetchone(sql, params)
+        return row[0] if row and row[0] is not None else default
+
+class DatabasePool(_Fetch):
+    """Shared aiosqlite connections: a bounded set of readers and a single writer.
+
+    Every query runs on the connection's worker thread, so the event loop never
+    blocks on SQLite. Reads borrow one of ``readers`` connections. Writes are
+    queued to one writer coroutine that groups everything arriving within
+    ``commit_interval`` into a single ``BEGIN IMMEDIATE ... COMMIT``; each request
+    runs in its own savepoint, so one failure does not roll back its neighbours,
+    and each caller is resumed only after the batch has committed.
+
+    Connections are opened on first use, and ``schema`` (if given) is run on a
+    plain sqlite3 connection before that, so a pool can point at a file that does
+    not exist yet. ``close_if_idle`` lets an owner of many pools release unused ones.
+    """
+
+    def __init__(self, path: str, readers: int = 4, commit_interval: float = 0.005, max_batch: int = 256, schema=None):
+        self.path = path
+        self.size = max(1, readers)
+        self.commit_interval = commit_interval
+        self.max_batch = max(1, max_batch)
+        self.schema = schema
+        self.stats = {"batches": 0, "writes": 0, "failed": 0}
+        self.busy = 0
+        self.last_used = time.monotonic()
+        # Writer connection leased to the current task (set inside a write batch).
+        self._lease: ContextVar[Optional[aiosqlite.Connection]] = ContextVar(f"db_lease:{path}", default=None)
+        self._open_lock = asyncio.Lock()
+        self._readers: Optional[asyncio.Queue] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._all: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        # Callbacks registered by the running batch, called once it has committed.
+        self._on_commit: List = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, **kwargs) -> aiosqlite.Connection:
+        # Handlers issue a fixed set of constant SQL strings; keep all of them prepared.
+        conn = await aiosqlite.connect(self.path, cached_statements=256, **kwargs)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def _prepare(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            self.schema(conn)
+        finally:
+            conn.close()
+
+    async def open(self):
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            if self.schema is not None:
+                await asyncio.to_thread(self._prepare)
+            # Autocommit mode: the writer issues BEGIN/COMMIT itself.
+            writer = await self._connect(isolation_level=None)
+            await writer.execute("PRAGMA journal_mode = WAL")
+            await writer.execute("PRAGMA synchronous = NORMAL")
+            conns, readers, queue = [writer], asyncio.Queue(), asyncio.Queue()
+            for _ in range(self.size):
+                conn = await self._connect()
+                conns.append(conn)
+                readers.put_nowait(conn)
+            self._all, self._readers, self._queue = conns, readers, queue
+            self._task = asyncio.create_task(self._writer_loop(queue, writer))
+            self._writer = writer
+            self.last_used = time.monotonic()
+        logger.info(f"Database pool opened: {self.size} readers + 1 writer, WAL, group commit {self.commit_interval * 1000:g} ms ({self.path})")
+
+    async def close(self):
+        # Detach first so callers arriving during shutdown open a fresh set of connections.
+        task, queue, conns = self._task, self._queue, self._all
+        self._all, self._writer, self._readers, self._queue, self._task = [], None, None, None, None
+        if task:
+            queue.put_nowait(None)
+            await task
+        for conn in conns:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    async def close_if_idle(self, idle: float) -> bool:
+        """Close the connections if nothing used the pool for ``idle`` seconds; it reopens on next use."""
+        if self._writer is None or self.busy or time.monotonic() - self.last_used < idle:
+            return False
+        await self.close()
+        return True
+
+    async def _writer_loop(self, queue: asyncio.Queue, conn: aiosqlite.Connection):
+        while True:
+            first = await queue.get()
+            if first is None:
+                return
+            await asyncio.sleep(self.commit_interval)
+            batch, stop = [first], False
+            while len(batch) < self.max_batch and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                await self._run_batch(conn, batch)
+            except Exception as e:
+                logger.error(f"Write batch failed: {e}")
+            if stop:
+                return
+
+    async def _run_batch(self, conn, batch):
+        results = []
+        try:
+            await conn.execute("BEGIN IMMEDIATE")
+            for i, (fn, fut) in enumerate(batch):
+                if fut.done():
+                    continue
+                await conn.execute(f"SAVEPOINT w{i}")
+                token = self._lease.set(conn)
+                try:
+                    res = await fn(conn)
+                except Exception as e:
+                    await conn.execute(f"ROLLBACK TO w{i}")
+                    results.append((fut, e, None))
+                else:
+                    results.append((fut, None, res))
+                finally:
+                    self._lease.reset(token)
+                    await conn.execute(f"RELEASE w{i}")
+            await conn.execute("COMMIT")
+        except Exception as e:
+            self._on_commit = []
+            if conn.in_transaction:
+                await conn.rollback()
+            self.stats["failed"] += len(batch)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            raise
+        callbacks, self._on_commit = self._on_commit, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Commit callback failed: {e}")
+        self.stats["batches"] += 1
+        self.stats["writes"] += len(results)
+        for fut, err, res in results:
+            if fut.done():
+                continue
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+    def after_commit(self, fn):
+        """Call ``fn()`` once the current write batch has committed, or right away outside one."""
+        if self._lease.get() is None:
+            fn()
+        else:
+            self._on_commit.append(fn)
+
+    async def write(self, fn):
+        """Queue ``await fn(conn)`` for the writer and return its result once committed."""
+        _count_query()
+        conn = self._lease.get()
+        if conn is not None:
+            return await fn(conn)
+        self.busy += 1
+        try:
+            if self._writer is None:
+                await self.open()
+            fut = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait((fn, fut))
+            return await fut
+        finally:
+            self.busy -= 1
+            self.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def read(self):
+        """Borrow a reader connection for the duration of the block.
+
+        Inside a write lease the writer itself is used, so the block sees its own
+        uncommitted changes.
+        """
+        _count_query()
+        conn = self._lease.get()
+        if conn is not None:
+            yield conn
+            return
+        self.busy += 1
+        try:
+            if self._readers is None:
+                await self.open()
+            readers = self._readers
+            conn = await readers.get()
+            try:
+                yield conn
+            finally:
+                readers.put_nowait(conn)
+        finally:
+            self.busy -= 1
+            self.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Run the block on the writer inside the next batch; exits once it is committed.
+
+        An exception in the block rolls back only this block's savepoint. Nested
+        calls reuse the enclosing lease.
+        """
+        conn = self._lease.get()
+        if conn is not None:
+            name = f"n{id(object())}"
+            await conn.execute(f"SAVEPOINT {name}")
+            try:
+                yield conn
+            except BaseException:
+                await conn.execute(f"ROLLBACK TO {name}")
+                raise
+            finally:
+                await conn.execute(f"RELEASE {name}")
+            return
+        loop = asyncio.get_running_loop()
+        ready, done = loop.create_future(), loop.create_future()
+
+        async def body(conn):
+            if ready.done():
+                raise _Abandoned()
+            ready.set_result(conn)
+            if await done is not None:
+                raise _Abandoned()
+
+        committed = asyncio.ensure_future(self.write(body))
+        committed.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            await asyncio.wait((ready, committed), return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            ready.cancel()
+            if not done.done():
+                done.set_result(True)
+            raise
+        if not ready.done():
+            ready.cancel()
+            await committed
+            raise RuntimeError("write batch finished without leasing the connection")
+        token = self._lease.set(ready.result())
+        try:
+            yield ready.result()
+        except BaseException as e:
+            self._lease.reset(token)
+            done.set_result(e)
+            try:
+                await committed
+            except Exception:
+                pass
+            raise
+        self._lease.reset(token)
+        done.set_result(None)
+        await committed
+
+    async def execute(self, sql: str, params=()):
+        """Queue a single write statement and return its cursor once committed."""
+        return await self.write(lambda conn: conn.execute(sql, params))
+
+class ReadOnlyPool(_Fetch):
+    """Read-only connections (``mode=ro``, ``query_only``) to the file of ``primary``.
+
+    Statistics and admin screens read here instead of from the primary pool's
+    readers, and at most ``size`` of them run at once, so a burst of reports
+    queues behind itself rather than behind (or in front of) user traffic. In
+    WAL mode these readers never block the writer. ``snapshot()`` holds one read
+    transaction for a block, so every query in it (including repository calls
+    given this pool) sees the same committed state.
+    """
+
+    def __init__(self, primary: DatabasePool, size: int = 2):
+        self.primary = primary
+        self.size = max(1, size)
+        self.busy = 0
+        self.last_used = time.monotonic()
+        self._snapshot: ContextVar[Optional[aiosqlite.Connection]] = ContextVar(f"db_snapshot:{primary.path}", default=None)
+        self._open_lock = asyncio.Lock()
+        self._free: Optional[asyncio.Queue] = None
+        self._all: List[aiosqlite.Connection] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._free is not None
+
+    async def open(self):
+        async with self._open_lock:
+            if self._free is not None:
+                return
+            # The primary creates the file and switches it to WAL; a read-only connection can do neither.
+            if not self.primary.is_open:
+                await self.primary.open()
+            uri = f"file:{quote(os.path.abspath(self.primary.path))}?mode=ro"
+            conns, free = [], asyncio.Queue()
+            for _ in range(self.size):
+                conn = await aiosqlite.connect(uri, uri=True, isolation_level=None, cached_statements=256)
+                conn.row_factory = aiosqlite.Row
+                await conn.execute("PRAGMA busy_timeout = 5000")
+                await conn.execute("PRAGMA query_only = 1")
+                conns.append(conn)
+                free.put_nowait(conn)
+            self._all, self._free = conns, free
+            self.last_used = time.monotonic()
+        logger.info(f"Read-only pool opened: {self.size} connections ({self.primary.path})")
+
+    async def close(self):
+        conns, self._all, self._free = self._all, [], None
+        for conn in conns:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    async def close_if_idle(self, idle: float) -> bool:
+        if self._free is None or self.busy or time.monotonic() - self.last_used < idle:
+            return False
+        await self.close()
+        return True
+
+    @asynccontextmanager
+    async def read(self):
+        _count_query()
+        conn = self._snapshot.get()
+        if conn is not None:
+            yield conn
+            return
+        self.busy += 1
+        try:
+            if self._free is None:
+                await self.open()
+            free = self._free
+            conn = await free.get()
+            try:
+                yield conn
+            finally:
+                free.put_nowait(conn)
+        finally:
+            self.busy -= 1
+            self.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def snapshot(self):
+        """Run the block's reads on one connection inside a single read transaction."""
+        if self._snapshot.get() is not None:
+            yield self._snapshot.get()
+            return
+        async with self.read() as conn:
+            # BEGIN is deferred; the first SELECT fixes the snapshot.
+            await conn.execute("BEGIN")
+            await (await conn.execute("SELECT 1 FROM sqlite_master LIMIT 1")).fetchall()
+            token = self._snapshot.set(conn)
+            try:
+                yield conn
+            finally:
+                self._snapshot.reset(token)
+                await conn.execute("COMMIT")
+
+db = DatabasePool(DATABASE_PATH, DB_READERS, DB_COMMIT_INTERVAL_MS / 1000, DB_MAX_BATCH)
+analytics = ReadOnlyPool(db, ANALYTICS_READERS)
+
+def _as_bool(v):
+    return v == "1"
 
 class SettingsManager:
+    """Settings backed by an in-process cache of `settings` and `plan_settings`.
+
+    Both tables are loaded once; reads never touch SQLite afterwards. Writes go
+    through to the database and bump ``version``, which also drops the typed
+    (int/float/bool) conversions cached for the previous version.
+    """
+    version = 0
+    stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+    _values: Dict[str, str] = {}
+    _plans: Dict[str, Dict[str, bool]] = {}
+    _typed: Dict[tuple, Any] = {}
+    _loaded = False
     @staticmethod
     async def init_settings():
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL, description TEXT, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_by INTEGER)')
-        cursor.execute('CREATE TABLE IF NOT EXISTS plan_settings (plan_id TEXT NOT NULL, setting_key TEXT NOT NULL, setting_value TEXT NOT NULL, PRIMARY KEY (plan_id, setting_key))')
+        async with db.transaction() as conn:
+            await SettingsManager._seed(conn)
+        await SettingsManager.reload()
+    @staticmethod
+    async def reload():
+        rows = await db.fetchall("SELECT key, value FROM settings")
+        plans = {}
+        for r in await db.fetchall("SELECT plan_id, setting_key, setting_value FROM plan_settings"): plans.setdefault(r['plan_id'], {})[r['setting_key']] = r['setting_value'] == "1"
+        SettingsManager._values, SettingsManager._plans = {r['key']: r['value'] for r in rows}, plans
+        SettingsManager._bump()
+        SettingsManager._loaded = True
+        SettingsManager.stats['reloads'] += 1
+    @staticmethod
+    def _bump():
+        SettingsManager.version += 1
+        SettingsManager._typed = {}
+    @staticmethod
+    def get_stats():
+        return {**SettingsManager.stats, 'version': SettingsManager.version, 'keys': len(SettingsManager._values)}
+    @staticmethod
+    def _typed_setting(key, default, cast):
+        ck = (key, cast, default)
+        if ck in SettingsManager._typed:
+            SettingsManager.stats['hits'] += 1
+            return SettingsManager._typed[ck]
+        raw = SettingsManager._values.get(key)
+        SettingsManager.stats['hits' if raw is not None else 'misses'] += 1
+        try: val = cast(raw) if raw is not None else default
+        except: val = default
+        SettingsManager._typed[ck] = val
+        return val
+    @staticmethod
+    async def _seed(conn):
         defs = {
             'IP_BAN_ENABLED': ('1', 'تفعيل حظر IP'),
             'MAX_USERS_PER_IP': ('1', 'أقصى عدد مستخدمين لكل IP'),
             'BAN_DURATION_HOURS': ('72', 'مدة حظر IP (ساعة)'),
             'MAX_ATTEMPTS_PER_HOUR': ('5', 'أقصى محاولات لكل ساعة'),
+            'MAX_USERS_PER_SUBNET24': ('0', 'أقصى مستخدمين لكل شبكة /24 (0 = معطل)'),
+            'MAX_USERS_PER_SUBNET16': ('0', 'أقصى مستخدمين لكل شبكة /16 (0 = معطل)'),
+            'MAX_USERS_PER_SUBNET64': ('0', 'أقصى مستخدمين لكل شبكة IPv6 /64 (0 = معطل)'),
+            'MAX_BANS_PER_SUBNET': ('0', 'أقصى عناوين محظورة في الشبكة قبل حظرها (0 = معطل)'),
             'SECRET_LINK_EXPIRY_MINUTES': ('5', 'صلاحية الرابط السري (دقيقة)'),
+            'REQUIRE_WEBAPP_AUTH': ('1', 'اشتراط فتح صفحة التحقق من داخل تيليجرام'),
             'BLOCK_DUPLICATE_DEVICES': ('1', 'منع تكرار البصمة'),
+            'DEVICE_SIMILARITY_PERCENT': ('0', 'نسبة التشابه لاعتبار الجهاز مكرراً (0 = تطابق تام فقط)'),
             'VPN_DETECTION_ENABLED': ('1', 'كشف VPN/Proxy'),
             'REFERRAL_REWARD': ('10', 'نقاط الإحالة'),
             'DAILY_BONUS_BASE': ('10', 'نقاط المكافأة اليومية الأساسية'),
@@ -93,50 +533,82 @@ class SettingsManager:
             'MAINTENANCE_MODE': ('0', 'وضع الصيانة'),
             'BROADCAST_ENABLED': ('1', 'تفعيل البث')
         }
-        for k, (v, d) in defs.items(): cursor.execute('INSERT OR IGNORE INTO settings (key, value, description) VALUES (?, ?, ?)', (k, v, d))
+        for k, (v, d) in defs.items(): await conn.execute('INSERT OR IGNORE INTO settings (key, value, description) VALUES (?, ?, ?)', (k, v, d))
         feat = {('free', 'referral_system'): '1', ('free', 'daily_bonus'): '1', ('free', 'tasks_system'): '1', ('free', 'fingerprint_protection'): '1', ('free', 'ip_ban_protection'): '1', ('free', 'withdrawals'): '0', ('free', 'customization'): '0', ('free', 'store_access'): '1', ('free', 'conversion'): '1', ('premium', 'referral_system'): '1', ('premium', 'daily_bonus'): '1', ('premium', 'tasks_system'): '1', ('premium', 'fingerprint_protection'): '1', ('premium', 'ip_ban_protection'): '1', ('premium', 'withdrawals'): '0', ('premium', 'customization'): '1', ('premium', 'store_access'): '1', ('premium', 'conversion'): '1', ('enterprise', 'referral_system'): '1', ('enterprise', 'daily_bonus'): '1', ('enterprise', 'tasks_system'): '1', ('enterprise', 'fingerprint_protection'): '1', ('enterprise', 'ip_ban_protection'): '1', ('enterprise', 'withdrawals'): '1', ('enterprise', 'customization'): '1', ('enterprise', 'store_access'): '1', ('enterprise', 'conversion'): '1'}
-        for (pid, f), v in feat.items(): cursor.execute('INSERT OR IGNORE INTO plan_settings (plan_id, setting_key, setting_value) VALUES (?, ?, ?)', (pid, f, v))
-        conn.commit(); conn.close()
+        for (pid, f), v in feat.items(): await conn.execute('INSERT OR IGNORE INTO plan_settings (plan_id, setting_key, setting_value) VALUES (?, ?, ?)', (pid, f, v))
     @staticmethod
     async def get_setting(key, default=None):
-        conn = get_db_connection(); res = conn.cursor().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone(); conn.close()
-        return res['value'] if res else default
+        if not SettingsManager._loaded: await SettingsManager.reload()
+        val = SettingsManager._values.get(key)
+        SettingsManager.stats['hits' if val is not None else 'misses'] += 1
+        return val if val is not None else default
     @staticmethod
     async def get_int_setting(key, default=0):
-        val = await SettingsManager.get_setting(key, str(default))
-        try: return int(val)
-        except: return default
+        if not SettingsManager._loaded: await SettingsManager.reload()
+        return SettingsManager._typed_setting(key, default, int)
     @staticmethod
     async def get_float_setting(key, default=0.0):
-        val = await SettingsManager.get_setting(key, str(default))
-        try: return float(val)
-        except: return default
+        if not SettingsManager._loaded: await SettingsManager.reload()
+        return SettingsManager._typed_setting(key, default, float)
     @staticmethod
     async def get_bool_setting(key, default=False):
-        return await SettingsManager.get_setting(key, "1" if default else "0") == "1"
+        if not SettingsManager._loaded: await SettingsManager.reload()
+        return SettingsManager._typed_setting(key, default, _as_bool)
     @staticmethod
     async def update_setting(key, value, user_id=None):
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute("UPDATE settings SET value = ?, updated_at = CURRENT_TIMESTAMP, updated_by = ? WHERE key = ?", (value, user_id, key))
-        conn.commit(); conn.close()
+        cur = await db.execute("UPDATE settings SET value = ?, updated_at = CURRENT_TIMESTAMP, updated_by = ? WHERE key = ?", (value, user_id, key))
+        if cur.rowcount: SettingsManager._values[key] = str(value)
+        SettingsManager._bump()
     @staticmethod
     async def get_all_settings():
-        conn = get_db_connection(); rows = conn.cursor().execute("SELECT key, value FROM settings").fetchall(); conn.close()
-        return {r['key']: r['value'] for r in rows}
+        if not SettingsManager._loaded: await SettingsManager.reload()
+        SettingsManager.stats['hits'] += 1
+        return dict(SettingsManager._values)
     @staticmethod
     async def get_plan_config(plan_id):
-        conn = get_db_connection()
         max_u = await SettingsManager.get_int_setting(f"{plan_id.upper()}_PLAN_MAX_USERS", 2000)
         p_ton = await SettingsManager.get_float_setting(f"{plan_id.upper()}_PLAN_PRICE_TON", 0)
         p_stars = await SettingsManager.get_int_setting(f"{plan_id.upper()}_PLAN_PRICE_STARS", 0)
         dur = await SettingsManager.get_int_setting(f"{plan_id.upper()}_PLAN_DURATION", 30) if plan_id != "free" else None
-        feat = {r['setting_key']: r['setting_value'] == "1" for r in conn.cursor().execute("SELECT setting_key, setting_value FROM plan_settings WHERE plan_id = ?", (plan_id,)).fetchall()}
-        conn.close()
+        feat = dict(SettingsManager._plans.get(plan_id, {}))
         names = {'free': '🎁 مجاني', 'premium': '💎 بريميوم', 'enterprise': '👑 إنتربرايز'}
         return {'name': names.get(plan_id, plan_id), 'price_ton': p_ton, 'price_stars': p_stars, 'max_users': max_u, 'duration_days': dur, 'features': feat}
     @staticmethod
     async def get_protection_config():
-        return {'IP_BAN_ENABLED': await SettingsManager.get_bool_setting('IP_BAN_ENABLED', True), 'MAX_USERS_PER_IP': await SettingsManager.get_int_setting('MAX_USERS_PER_IP', 1), 'BAN_DURATION_HOURS': await SettingsManager.get_int_setting('BAN_DURATION_HOURS', 72), 'MAX_ATTEMPTS_PER_HOUR': await SettingsManager.get_int_setting('MAX_ATTEMPTS_PER_HOUR', 5), 'SECRET_LINK_EXPIRY_MINUTES': await SettingsManager.get_int_setting('SECRET_LINK_EXPIRY_MINUTES', 5), 'BLOCK_DUPLICATE_DEVICES': await SettingsManager.get_bool_setting('BLOCK_DUPLICATE_DEVICES', True), 'VPN_DETECTION_ENABLED': await SettingsManager.get_bool_setting('VPN_DETECTION_ENABLED', True)}
+        return {'IP_BAN_ENABLED': await SettingsManager.get_bool_setting('IP_BAN_ENABLED', True), 'MAX_USERS_PER_IP': await SettingsManager.get_int_setting('MAX_USERS_PER_IP', 1), 'BAN_DURATION_HOURS': await SettingsManager.get_int_setting('BAN_DURATION_HOURS', 72), 'MAX_ATTEMPTS_PER_HOUR': await SettingsManager.get_int_setting('MAX_ATTEMPTS_PER_HOUR', 5), 'MAX_USERS_PER_SUBNET24': await SettingsManager.get_int_setting('MAX_USERS_PER_SUBNET24', 0), 'MAX_USERS_PER_SUBNET16': await SettingsManager.get_int_setting('MAX_USERS_PER_SUBNET16', 0), 'MAX_USERS_PER_SUBNET64': await SettingsManager.get_int_setting('MAX_USERS_PER_SUBNET64', 0), 'MAX_BANS_PER_SUBNET': await SettingsManager.get_int_setting('MAX_BANS_PER_SUBNET', 0), 'SECRET_LINK_EXPIRY_MINUTES': await SettingsManager.get_int_setting('SECRET_LINK_EXPIRY_MINUTES', 5), 'BLOCK_DUPLICATE_DEVICES': await SettingsManager.get_bool_setting('BLOCK_DUPLICATE_DEVICES', True), 'DEVICE_SIMILARITY_PERCENT': await SettingsManager.get_int_setting('DEVICE_SIMILARITY_PERCENT', 0), 'VPN_DETECTION_ENABLED': await SettingsManager.get_bool_setting('VPN_DETECTION_ENABLED', True)}
+
+class SystemCounters:
+    """Global totals and per-day rollups maintained by triggers (see migrations.py)."""
+    @staticmethod
+    async def get_all(pool=db):
+        return {r['name']: r['value'] for r in await pool.fetchall("SELECT name, value FROM system_counters")}
+    @staticmethod
+    async def get_day(day=None, pool=db):
+        day = day or datetime.now().date().isoformat()
+        return {r['name']: r['value'] for r in await pool.fetchall("SELECT name, value FROM daily_counters WHERE day = ?", (day,))}
+    @staticmethod
+    async def reconcile():
+        """Recompute every counter from the source tables, fix it, and return the drift found."""
+        async def apply(conn):
+            drift = {}
+            for name, sql in COUNTER_QUERIES.items():
+                actual = (await fetch_one(conn, sql))[0]
+                stored = await fetch_one(conn, "SELECT value FROM system_counters WHERE name = ?", (name,))
+                if stored is None or abs((stored['value'] or 0) - actual) > 1e-6:
+                    drift[name] = (stored['value'] if stored else None, actual)
+                    await conn.execute("INSERT OR REPLACE INTO system_counters (name, value) VALUES (?, ?)", (name, actual))
+            return drift
+        return await db.write(apply)
+    @staticmethod
+    async def run_reconciliation(interval_hours=COUNTERS_RECONCILE_HOURS):
+        while True:
+            await asyncio.sleep(interval_hours * 3600)
+            try:
+                drift = await SystemCounters.reconcile()
+                if drift: logger.warning(f"System counters drifted and were corrected: {drift}")
+                else: logger.info("System counters reconciled, no drift")
+            except Exception as e:
+                logger.error(f"Counter reconciliation failed: {e}")
 
 def generate_referral_code(length=8):
     return ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(length))
@@ -145,43 +617,72 @@ def is_valid_ton_address(addr):
     return addr and len(addr) == 48 and addr[0] in ['E', 'U', '0']
 
 class SecretLinkSystem:
+    """Stateless verification links: ``<user>.<expiry>.<nonce>.<sig>`` signed with HMAC-SHA256.
+
+    Issuing a link touches no table; a link is single-use through an in-memory
+    set of spent nonces, each kept only until its link would have expired anyway.
+    """
+    _key = hmac.new(b'verification-link', (VERIFICATION_SECRET or BOT_TOKEN or '').encode(), hashlib.sha256).digest()
+    _used: Dict[str, float] = {}
+    _next_prune = 0.0
+    @staticmethod
+    def _sign(payload):
+        return base64.urlsafe_b64encode(hmac.new(SecretLinkSystem._key, payload.encode(), hashlib.sha256).digest()[:18]).decode()
     @staticmethod
     async def generate_link(u_id):
         exp_m = await SettingsManager.get_int_setting('SECRET_LINK_EXPIRY_MINUTES', 5)
-        sec = secrets.token_urlsafe(32); exp_at = (datetime.now() + timedelta(minutes=exp_m)).isoformat()
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute("UPDATE secret_links SET used = 1, used_at = ? WHERE user_id = ? AND used = 0", (datetime.now().isoformat(), u_id))
-        cursor.execute("INSERT INTO secret_links (secret, user_id, expires_at) VALUES (?, ?, ?)", (sec, u_id, exp_at))
-        conn.commit(); conn.close(); return sec, exp_m
+        payload = f"{int(u_id)}.{int(time.time()) + exp_m * 60}.{secrets.token_urlsafe(9)}"
+        return f"{payload}.{SecretLinkSystem._sign(payload)}", exp_m
     @staticmethod
     async def verify_link(sec, u_id):
-        conn = get_db_connection(); row = conn.cursor().execute("SELECT * FROM secret_links WHERE secret = ? AND user_id = ? AND used = 0", (sec, u_id)).fetchone()
-        if not row: return False, 'رابط غير صالح'
-        if datetime.now() > datetime.fromisoformat(row['expires_at']): return False, 'انتهت الصلاحية'
-        conn.cursor().execute("UPDATE secret_links SET used = 1, used_at = ? WHERE id = ?", (datetime.now().isoformat(), row['id']))
-        conn.commit(); conn.close(); return True, 'تم التحقق'
+        parts = str(sec).split('.')
+        if len(parts) != 4 or not hmac.compare_digest(parts[3], SecretLinkSystem._sign('.'.join(parts[:3]))) or parts[0] != str(u_id): return False, 'رابط غير صالح'
+        now, exp, nonce = time.time(), int(parts[1]), parts[2]
+        if now > exp: return False, 'انتهت الصلاحية'
+        if now >= SecretLinkSystem._next_prune:
+            SecretLinkSystem._used = {n: e for n, e in SecretLinkSystem._used.items() if e >= now}; SecretLinkSystem._next_prune = now + 60
+        if nonce in SecretLinkSystem._used: return False, 'رابط غير صالح'
+        SecretLinkSystem._used[nonce] = exp
+        return True, 'تم التحقق'
+    @staticmethod
+    def verify_init_data(init_data, max_age_seconds, bot_token=BOT_TOKEN):
+        """Telegram user id from a Mini App ``initData`` string, or None if the signature or ``auth_date`` is invalid."""
+        try:
+            fields = dict(parse_qsl(init_data or '', strict_parsing=True))
+        except ValueError: return None
+        received = fields.pop('hash', '')
+        check = '\n'.join(f"{k}={v}" for k, v in sorted(fields.items()))
+        key = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+        if not received or not hmac.compare_digest(received, hmac.new(key, check.encode(), hashlib.sha256).hexdigest()): return None
+        try:
+            if time.time() - int(fields.get('auth_date', 0)) > max_age_seconds: return None
+            return int(json.loads(fields['user'])['id'])
+        except (KeyError, ValueError, TypeError): return None
 
 class SmartIPBan:
     @staticmethod
     async def check_ip(ip, u_id):
+        """Decide from the in-memory IP guard; the attempt (and any new ban) is persisted in the background."""
+        from .ipguard import IPGuard
         conf = await SettingsManager.get_protection_config()
         if not conf['IP_BAN_ENABLED'] or ip == 'unknown': return {'banned': False}
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute("DELETE FROM banned_ips WHERE expires_at IS NOT NULL AND expires_at < datetime('now')")
-        banned = cursor.execute("SELECT * FROM banned_ips WHERE ip_address = ?", (ip,)).fetchone()
-        if banned: return {'banned': True, 'reason': 'IP محظور'}
-        u_count = cursor.execute("SELECT COUNT(DISTINCT telegram_id) as c FROM users WHERE ip_address = ? AND telegram_id != ?", (ip, u_id)).fetchone()['c']
+        await IPGuard.ensure_loaded(conf['MAX_ATTEMPTS_PER_HOUR'])
+        if IPGuard.is_banned(ip): return {'banned': True, 'reason': 'IP محظور'}
+        u_count = IPGuard.users_on(ip, u_id)
         if u_count >= conf['MAX_USERS_PER_IP']:
-            exp = (datetime.now() + timedelta(hours=conf['BAN_DURATION_HOURS'])).isoformat()
-            cursor.execute("INSERT OR IGNORE INTO banned_ips (ip_address, ban_reason, ban_duration, expires_at) VALUES (?, ?, ?, ?)", (ip, f"Auto-ban: {u_count+1} users", conf['BAN_DURATION_HOURS'], exp))
-            conn.commit(); conn.close(); return {'banned': True, 'reason': 'تجاوز الحد المسموح'}
-        att = cursor.execute("SELECT COUNT(*) as c FROM ip_attempts WHERE ip_address = ? AND timestamp > datetime('now', '-1 hour')", (ip,)).fetchone()['c']
-        if att >= conf['MAX_ATTEMPTS_PER_HOUR']:
-            exp = (datetime.now() + timedelta(hours=conf['BAN_DURATION_HOURS'])).isoformat()
-            cursor.execute("INSERT OR IGNORE INTO banned_ips (ip_address, ban_reason, ban_duration, expires_at) VALUES (?, ?, ?, ?)", (ip, "Too many attempts", conf['BAN_DURATION_HOURS'], exp))
-            conn.commit(); conn.close(); return {'banned': True, 'reason': 'محاولات كثيرة'}
-        cursor.execute("INSERT INTO ip_attempts (ip_address, user_id, attempt_type) VALUES (?, ?, ?)", (ip, u_id, 'verification'))
-        conn.commit(); conn.close(); return {'banned': False, 'remaining': conf['MAX_USERS_PER_IP'] - u_count}
+            IPGuard.ban(ip, f"Auto-ban: {u_count+1} users", conf['BAN_DURATION_HOURS'])
+            return {'banned': True, 'reason': 'تجاوز الحد المسموح'}
+        if IPGuard.attempts_exceeded(ip, conf['MAX_ATTEMPTS_PER_HOUR']):
+            IPGuard.ban(ip, "Too many attempts", conf['BAN_DURATION_HOURS'])
+            return {'banned': True, 'reason': 'محاولات كثيرة'}
+        subnet = IPGuard.subnet_verdict(ip, u_id, {(4, 24): conf['MAX_USERS_PER_SUBNET24'], (4, 16): conf['MAX_USERS_PER_SUBNET16'], (6, 64): conf['MAX_USERS_PER_SUBNET64']}, conf['MAX_BANS_PER_SUBNET'])
+        # Rejected without a ban: a subnet verdict banning the IP would count toward
+        # MAX_BANS_PER_SUBNET and let one crowded range (carrier NAT) ban itself address by address.
+        if subnet:
+            logger.info(f"Subnet rejection for {ip}: {subnet}")
+            return {'banned': True, 'reason': 'نشاط مشبوه من نفس الشبكة'}
+        IPGuard.record_attempt(ip, u_id, conf['MAX_ATTEMPTS_PER_HOUR'])
+        return {'banned': False, 'remaining': conf['MAX_USERS_PER_IP'] - u_count}
     @staticmethod
     async def check_vpn(ip):
         try:
@@ -194,44 +695,62 @@ class SmartIPBan:
         return {'is_vpn': False, 'is_hosting': False}
     @staticmethod
     async def ban_ip(ip, reason, hours, admin_id):
-        exp = (datetime.now() + timedelta(hours=hours)).isoformat(); conn = get_db_connection()
-        conn.cursor().execute("INSERT OR REPLACE INTO banned_ips (ip_address, ban_reason, ban_duration, banned_by, expires_at) VALUES (?, ?, ?, ?, ?)", (ip, reason, hours, admin_id, exp))
-        conn.commit(); conn.close()
+        from .ipguard import IPGuard
+        exp = IPGuard.ban(ip, reason, hours, admin_id, persist=False)
+        await db.execute("INSERT OR REPLACE INTO banned_ips (ip_address, ban_reason, ban_duration, banned_by, expires_at) VALUES (?, ?, ?, ?, ?)", (ip, reason, hours, admin_id, exp))
     @staticmethod
     async def unban_ip(ip):
-        conn = get_db_connection(); conn.cursor().execute("DELETE FROM banned_ips WHERE ip_address = ?", (ip,)); conn.commit(); conn.close()
+        from .ipguard import IPGuard
+        IPGuard.unban(ip)
+        await db.execute("DELETE FROM banned_ips WHERE ip_address = ?", (ip,))
     @staticmethod
     async def get_banned_ips():
-        conn = get_db_connection(); res = conn.cursor().execute("SELECT * FROM banned_ips WHERE expires_at IS NULL OR expires_at > datetime('now') ORDER BY banned_at DESC").fetchall(); conn.close(); return res
+        return await db.fetchall("SELECT * FROM banned_ips WHERE expires_at IS NULL OR expires_at > datetime('now') ORDER BY banned_at DESC")
 
 class FingerprintSystem:
     @staticmethod
-    async def check_duplicate(fp, u_id):
-        if not await SettingsManager.get_bool_setting('BLOCK_DUPLICATE_DEVICES', True): return {'duplicate': False}
-        conn = get_db_connection(); res = conn.cursor().execute("SELECT user_id FROM device_fingerprints WHERE fingerprint_hash = ? AND user_id != ? LIMIT 1", (fp, u_id)).fetchone(); conn.close()
-        return {'duplicate': True, 'existing_user': res['user_id']} if res else {'duplicate': False}
+    async def check_duplicate(fp, u_id, comp=None):
+        """Exact match on the fingerprint hash, else the closest registered device with its ``similarity`` (0..1)."""
+        from .devices import DeviceIndex
+        if not await SettingsManager.get_bool_setting('BLOCK_DUPLICATE_DEVICES', True): return {'duplicate': False, 'similarity': 0.0}
+        await DeviceIndex.ensure_loaded()
+        owner = DeviceIndex.exact_owner(fp, u_id)
+        if owner is not None: return {'duplicate': True, 'existing_user': owner, 'similarity': 1.0}
+        similar, score = DeviceIndex.nearest(comp, u_id)
+        return {'duplicate': False, 'similar_user': similar, 'similarity': score}
     @staticmethod
     async def save_fingerprint(u_id, fp, comp, ip):
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute("INSERT INTO device_fingerprints (fingerprint_hash, user_id, canvas_hash, webgl_hash, audio_hash, device_info, ip_address) VALUES (?, ?, ?, ?, ?, ?, ?)", (fp, u_id, comp.get('canvas'), comp.get('webgl'), comp.get('audio'), json.dumps(comp), ip))
-        cursor.execute("UPDATE users SET fingerprint_hash = ?, fingerprint_components = ?, fingerprint_verified = 1, fingerprint_verified_at = ?, ip_address = ? WHERE telegram_id = ?", (fp, json.dumps(comp), datetime.now().isoformat(), ip, u_id))
-        conn.commit(); conn.close(); return True
+        async with db.transaction() as conn:
+            await conn.execute("INSERT INTO device_fingerprints (fingerprint_hash, user_id, canvas_hash, webgl_hash, audio_hash, device_info, ip_address) VALUES (?, ?, ?, ?, ?, ?, ?)", (fp, u_id, comp.get('canvas'), comp.get('webgl'), comp.get('audio'), json.dumps(comp), ip))
+            await conn.execute("UPDATE users SET fingerprint_hash = ?, fingerprint_components = ?, fingerprint_verified = 1, fingerprint_verified_at = ?, ip_address = ? WHERE telegram_id = ?", (fp, json.dumps(comp), datetime.now().isoformat(), ip, u_id))
+        UserCache.invalidate(0, u_id, db)
+        from .ipguard import IPGuard
+        from .devices import DeviceIndex
+        IPGuard.record_user(ip, u_id)
+        if DeviceIndex._loaded: DeviceIndex.add(fp, u_id, comp)
+        return True
 
 class PointsSystem:
     @staticmethod
     async def add_points(u_id, p, act, desc=None):
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute("UPDATE users SET points = points + ?, total_earned_points = total_earned_points + ? WHERE telegram_id = ?", (p, p, u_id))
-        cursor.execute("INSERT INTO points_history (user_id, action_type, points, description) VALUES (?, ?, ?, ?)", (u_id, act, p, desc))
-        conn.commit(); conn.close()
+        from .leaderboard import Leaderboards
+        async def apply(conn):
+            row = await fetch_one(conn, "UPDATE users SET points = points + ?, total_earned_points = total_earned_points + ? WHERE telegram_id = ? RETURNING total_earned_points", (p, p, u_id))
+            await conn.execute("INSERT INTO points_history (user_id, action_type, points, description) VALUES (?, ?, ?, ?)", (u_id, act, p, desc))
+            if row: Leaderboards.record(0, 'earned', u_id, row[0], db)
+        await db.write(apply)
+        UserCache.invalidate(0, u_id, db)
     @staticmethod
     async def subtract_points(u_id, p, act, desc=None):
-        conn = get_db_connection(); cursor = conn.cursor()
-        cursor.execute("UPDATE users SET points = points - ? WHERE telegram_id = ? AND points >= ?", (p, u_id, p))
-        if cursor.rowcount > 0:
-            cursor.execute("INSERT INTO points_history (user_id, action_type, points, description) VALUES (?, ?, ?, ?)", (u_id, act, -p, desc))
-            conn.commit(); conn.close(); return True
-        conn.close(); return False
+        async def apply(conn):
+            cursor = await conn.execute("UPDATE users SET points = points - ? WHERE telegram_id = ? AND points >= ?", (p, u_id, p))
+            if cursor.rowcount == 0: return False
+            await conn.execute("INSERT INTO points_history (user_id, action_type, points, description) VALUES (?, ?, ?, ?)", (u_id, act, -p, desc))
+            return True
+        done = await db.write(apply)
+        UserCache.invalidate(0, u_id, db)
+        return done
     @staticmethod
     async def get_points_history(u_id, limit=20):
-        conn = get_db_connection(); res = conn.cursor().execute("SELECT * FROM points_history WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (u_id, limit)).fetchall(); conn.close(); return res
+        from .ledger import Ledger
+        return await Ledger.get_history(u_id, limit)
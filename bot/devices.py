@@ -0,0 +1,143 @@
+"""In-memory index of registered devices behind ``FingerprintSystem.check_duplicate``.
+
+Every ``device_fingerprints`` row is loaded once: the combined
+``fingerprint_hash`` goes into a hash -> users map for exact O(1) matches, and
+each user's latest component hashes (canvas and WebGL plus screen,
+timezone, memory and cores from ``device_info``) go into a banded
+locality-sensitive index. A band is a tuple of component values; two devices
+that agree on every value of any band share a bucket, so a near-duplicate
+(e.g. same canvas and WebGL, different screen) is found by looking up a handful
+of buckets instead of scanning the table. Candidates are then scored with a
+weighted agreement over the components both devices reported.
+"""
+import asyncio
+import json
+from typing import Dict, Optional, Set, Tuple
+from .config import logger
+from .database import db
+
+# Fixed share of the similarity score carried by each component, set by how
+# distinctive that kind of value usually is (a canvas hash far more than a core count).
+# The page's audio hash is read before the oscillator starts, so it is the same for
+# every client; it is left out until the page produces a real one.
+WEIGHTS = {'canvas': 4.0, 'webgl': 3.0, 'screen': 1.0, 'timezone': 0.5, 'memory': 0.25, 'cores': 0.25}
+BANDS = (('canvas', 'webgl'), ('canvas', 'screen'), ('webgl', 'screen'))
+# Buckets larger than this (very common hardware) are not scanned.
+MAX_BUCKET = 256
+
+Components = Dict[str, str]
+
+
+def normalize(comp) -> Components:
+    """Keep the weighted components that carry information; error and placeholder values are dropped."""
+    if not isinstance(comp, dict):
+        return {}
+    out = {}
+    for key in WEIGHTS:
+        value = comp.get(key)
+        if value is None or value == '' or value == 'unknown':
+            continue
+        value = str(value)
+        if value.endswith(('_error', '_unavailable', '_no_debug')) or '_error_' in value:
+            continue
+        out[key] = value
+    return out
+
+
+def similarity(a: Components, b: Components) -> float:
+    """Weighted share of agreeing components among those both devices reported (0..1)."""
+    total = same = 0.0
+    for key, weight in WEIGHTS.items():
+        if key in a and key in b:
+            total += weight
+            if a[key] == b[key]:
+                same += weight
+    return same / total if total else 0.0
+
+
+class DeviceIndex:
+    exact: Dict[str, Set[int]] = {}
+    devices: Dict[int, Components] = {}
+    buckets: Dict[Tuple, Set[int]] = {}
+    _loaded = False
+    _lock = asyncio.Lock()
+
+    @staticmethod
+    def _band_keys(comp: Components):
+        for i, band in enumerate(BANDS):
+            if all(key in comp for key in band):
+                yield (i, *(comp[key] for key in band))
+
+    @staticmethod
+    async def load():
+        async with DeviceIndex._lock:
+            DeviceIndex.exact, DeviceIndex.devices, DeviceIndex.buckets = {}, {}, {}
+            for r in await db.fetchall("SELECT fingerprint_hash, user_id, canvas_hash, webgl_hash, audio_hash, device_info FROM device_fingerprints ORDER BY id"):
+                try:
+                    comp = json.loads(r['device_info']) if r['device_info'] else {}
+                except ValueError:
+                    comp = {}
+                if not isinstance(comp, dict):
+                    comp = {}
+                comp.setdefault('canvas', r['canvas_hash'])
+                comp.setdefault('webgl', r['webgl_hash'])
+                comp.setdefault('audio', r['audio_hash'])
+                DeviceIndex.add(r['fingerprint_hash'], r['user_id'], comp)
+            DeviceIndex._loaded = True
+        logger.info(f"Device index loaded: {len(DeviceIndex.exact)} fingerprints, {len(DeviceIndex.devices)} devices, {len(DeviceIndex.buckets)} buckets")
+
+    @staticmethod
+    async def ensure_loaded():
+        if not DeviceIndex._loaded:
+            await DeviceIndex.load()
+
+    @staticmethod
+    def add(fp: str, user_id: int, comp):
+        """Register ``user_id``'s device; its previous components are replaced."""
+        if fp:
+            DeviceIndex.exact.setdefault(fp, set()).add(user_id)
+        comp = normalize(comp)
+        if not comp:
+            return
+        old = DeviceIndex.devices.get(user_id)
+        if old is not None:
+            for key in DeviceIndex._band_keys(old):
+                bucket = DeviceIndex.buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(user_id)
+                    if not bucket:
+                        del DeviceIndex.buckets[key]
+        DeviceIndex.devices[user_id] = comp
+        for key in DeviceIndex._band_keys(comp):
+            DeviceIndex.buckets.setdefault(key, set()).add(user_id)
+
+    @staticmethod
+    def exact_owner(fp: str, user_id: int) -> Optional[int]:
+        """Another user registered with exactly this fingerprint, if any."""
+        for other in DeviceIndex.exact.get(fp, ()):
+            if other != user_id:
+                return other
+        return None
+
+    @staticmethod
+    def nearest(comp, user_id: int) -> Tuple[Optional[int], float]:
+        """Most similar other user's device and its score, from the buckets ``comp`` falls into."""
+        comp = normalize(comp)
+        best, score = None, 0.0
+        seen = {user_id}
+        for key in DeviceIndex._band_keys(comp):
+            bucket = DeviceIndex.buckets.get(key)
+            if not bucket or len(bucket) > MAX_BUCKET:
+                continue
+            for other in bucket:
+                if other in seen:
+                    continue
+                seen.add(other)
+                s = similarity(comp, DeviceIndex.devices[other])
+                if s > score:
+                    best, score = other, s
+        return best, score
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        return {'fingerprints': len(DeviceIndex.exact), 'devices': len(DeviceIndex.devices), 'buckets': len(DeviceIndex.buckets)}
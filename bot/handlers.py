@@ -1,4 +1,5 @@
 import os, sys, asyncio, logging, json, sqlite3, secrets, string, hashlib, hmac, random
+from dataclasses import replace
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from aiogram import Bot, Dispatcher, types, F
@@ -8,7 +9,15 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from .config import BOT_TOKEN, ADMIN_ID, CHANNEL_USERNAME, FINGERPRINT_WEB_URL, logger
-from .database import get_db_connection, generate_referral_code, is_valid_ton_address, SettingsManager, PointsSystem, SmartIPBan, SecretLinkSystem, FingerprintSystem, CAPTCHA_QUESTIONS
+from .database import db, analytics, generate_referral_code, is_valid_ton_address, SettingsManager, SystemCounters, PointsSystem, SmartIPBan, SecretLinkSystem, FingerprintSystem, CAPTCHA_QUESTIONS
+from .repository import User, Users, UserSettings, Referrals, Tasks, Withdrawals, HostedBots, HostedTasks, HostedUsers, HostedWithdrawals
+from .tenants import TenantStore
+from .backup import Backups
+from .usercache import UserCache
+from .leaderboard import board_text
+from .reminders import Reminders
+from .sessions import Sessions, new_bot
+from .balances import Balances, INVALID
 from .states import RegistrationStates, AdminStates, BotHostingStates, PaymentStates, SettingsStates, WithdrawalStates, ConversionStates, StoreStates, TaskStates
 from .hosting import HostedBotSystem
 
@@ -28,16 +37,19 @@ async def get_main_menu():
         builder.button(text='🤖 استضافة بوت', callback_data='bot_hosting_menu')
 
     builder.button(text='📈 الإحصائيات', callback_data='statistics')
+    builder.button(text='🏆 المتصدرون', callback_data='leaderboard')
     builder.adjust(2)
     return builder.as_markup()
 
 
-def get_dashboard_menu():
+def get_dashboard_menu(reminders: bool = True):
     """قائمة لوحة التحكم"""
     builder = InlineKeyboardBuilder()
     builder.button(text='🔄 تحويل النقاط', callback_data='convert_points')
     builder.button(text='⚙️ عنوان TON', callback_data='set_wallet_address')
     builder.button(text='📜 سجل النقاط', callback_data='points_history')
+    builder.button(text='🔔 التذكيرات: مفعلة' if reminders else
+        '🔕 التذكيرات: متوقفة', callback_data='toggle_reminders')
     builder.button(text='🔙 رئيسية', callback_data='main_menu')
     builder.adjust(2)
     return builder.as_markup()
@@ -157,7 +169,8 @@ def get_captcha_keyboard(question_index: int):
     return builder.as_markup()
 
 
-async def cmd_start(message: types.Message, state: FSMContext, bot: Bot):
+async def cmd_start(message: types.Message, state: FSMContext, bot: Bot,
+    user: Optional[User] = None):
     """أمر /start - محسن"""
     user_id = message.from_user.id
     maintenance = await SettingsManager.get_bool_setting('MAINTENANCE_MODE',
@@ -165,13 +178,8 @@ async def cmd_start(message: types.Message, state: FSMContext, bot: Bot):
     if maintenance and user_id != ADMIN_ID:
         await message.answer('🔧 البوت في وضع الصيانة. يرجى المحاولة لاحقاً.')
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (
-        user_id,)).fetchone()
     if user and user['is_banned']:
         await message.answer('⛔️ حسابك محظور.')
-        conn.close()
         return
     if not user:
         referral_code = generate_referral_code()
@@ -179,39 +187,19 @@ async def cmd_start(message: types.Message, state: FSMContext, bot: Bot):
         referred_by = None
         if len(args) > 1:
             referral_code_arg = args[1]
-            referrer = cursor.execute(
-                'SELECT telegram_id FROM users WHERE referral_code = ?', (
-                referral_code_arg,)).fetchone()
-            if referrer:
-                referred_by = referrer['telegram_id']
-        cursor.execute(
-            """
-            INSERT INTO users (telegram_id, username, full_name, referral_code, referred_by)
-            VALUES (?, ?, ?, ?, ?)
-        """
-            , (user_id, message.from_user.username, message.from_user.
-            full_name, referral_code, referred_by))
-        conn.commit()
-        if referred_by:
-            referral_reward = await SettingsManager.get_int_setting(
-                'REFERRAL_REWARD', 10)
-            cursor.execute(
-                """
-                INSERT INTO referrals (referrer_id, referred_id, is_valid, points)
-                VALUES (?, ?, 0, ?)
-            """
-                , (referred_by, user_id, referral_reward))
-            conn.commit()
-        user = cursor.execute('SELECT * FROM users WHERE telegram_id = ?',
-            (user_id,)).fetchone()
+            referred_by = await Users.id_by_referral_code(referral_code_arg)
+        referral_reward = await SettingsManager.get_int_setting(
+            'REFERRAL_REWARD', 10)
+        async with db.transaction():
+            await Users.create(user_id, message.from_user.username, message
+                .from_user.full_name, referral_code, referred_by)
+            if referred_by:
+                await Referrals.create(referred_by, user_id, referral_reward)
+        user = await Users.get(user_id)
     if user_id == ADMIN_ID and user and user['is_admin'] == 0:
-        cursor.execute('UPDATE users SET is_admin = 1 WHERE telegram_id = ?',
-            (user_id,))
-        conn.commit()
-        user = cursor.execute('SELECT * FROM users WHERE telegram_id = ?',
-            (user_id,)).fetchone()
+        await Users.set_admin(user_id)
+        user = replace(user, is_admin=1)
     if not user['fingerprint_verified']:
-        conn.close()
         secret, expiry = await SecretLinkSystem.generate_link(user_id)
         bot_info = await bot.get_me()
 
@@ -245,7 +233,6 @@ async def cmd_start(message: types.Message, state: FSMContext, bot: Bot):
         question = CAPTCHA_QUESTIONS[question_idx]
         await message.answer(f"🔒 سؤال التحقق:\n\n{question['question']}",
             reply_markup=get_captcha_keyboard(question_idx))
-        conn.close()
         return
     if not user['subscribed']:
         channels_json = await SettingsManager.get_setting('MANDATORY_CHANNELS', '[]')
@@ -266,25 +253,19 @@ async def cmd_start(message: types.Message, state: FSMContext, bot: Bot):
             builder.button(text='✅ تحقق', callback_data='check_subscription')
             builder.adjust(1)
             await message.answer(text, reply_markup=builder.as_markup())
-            conn.close()
             return
         else:
-            cursor.execute('UPDATE users SET subscribed = 1 WHERE telegram_id = ?', (user_id,))
-            conn.commit()
-            user = cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (user_id,)).fetchone()
-    conn.close()
+            await Users.set_subscribed(user_id)
+            user = replace(user, subscribed=1)
     await show_main_menu(message, user)
 
 
 async def check_fingerprint_verified(callback: types.CallbackQuery, bot:
-    Bot, state: FSMContext):
+    Bot, state: FSMContext, user: Optional[User] = None):
     """التحقق من اكتمال التحقق من البصمة - محسن"""
-    user_id = callback.from_user.id
-    conn = get_db_connection()
-    user = conn.cursor().execute('SELECT * FROM users WHERE telegram_id = ?',
-        (user_id,)).fetchone()
-    conn.close()
-    if user and user['fingerprint_verified'] == 1:
+    if user is None:
+        user = await Users.get(callback.from_user.id)
+    if user and user['fingerprint_verified']:
         await callback.answer('✅ تم التحقق بنجاح!', show_alert=False)
         try:
             await callback.message.delete()
@@ -313,12 +294,7 @@ async def process_captcha(callback: types.CallbackQuery, state: FSMContext,
     question_index, answer_index = int(data[1]), int(data[2])
     user_id = callback.from_user.id
     if answer_index == CAPTCHA_QUESTIONS[question_index]['correct']:
-        conn = get_db_connection()
-        conn.cursor().execute(
-            'UPDATE users SET captcha_passed = 1 WHERE telegram_id = ?', (
-            user_id,))
-        conn.commit()
-        conn.close()
+        await Users.set_captcha_passed(user_id)
         await callback.message.delete()
         await state.set_state(RegistrationStates.subscription)
         await callback.message.answer(
@@ -360,40 +336,24 @@ async def check_subscription(callback: types.CallbackQuery, state:
         except:
             pass
         await callback.answer('✅ تم التحقق من الاشتراك!', show_alert=False)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE users SET subscribed = 1 WHERE telegram_id = ?', (
-            user_id,))
-        user = cursor.execute(
-            'SELECT referred_by FROM users WHERE telegram_id = ?', (
-            user_id,)).fetchone()
-        if user and user['referred_by']:
-            referral = cursor.execute(
-                'SELECT * FROM referrals WHERE referred_id = ? AND is_valid = 0'
-                , (user_id,)).fetchone()
-            if referral:
-                referral_reward = await SettingsManager.get_int_setting(
-                    'REFERRAL_REWARD', 10)
-                cursor.execute(
-                    'UPDATE referrals SET is_valid = 1, points = ? WHERE id = ?'
-                    , (referral_reward, referral['id']))
-                cursor.execute(
-                    'UPDATE users SET points = points + ? WHERE telegram_id = ?'
-                    , (referral_reward, referral['referrer_id']))
-                cursor.execute(
-                    'UPDATE users SET total_referrals = total_referrals + 1 WHERE telegram_id = ?'
-                    , (referral['referrer_id'],))
-                try:
-                    await bot.send_message(referral['referrer_id'],
-                        f'🎉 تم إحالة مستخدم جديد! +{referral_reward} نقطة')
-                except:
-                    pass
-        conn.commit()
-        user_data = cursor.execute(
-            'SELECT * FROM users WHERE telegram_id = ?', (user_id,)
-            ).fetchone()
-        conn.close()
+        referral_reward = await SettingsManager.get_int_setting(
+            'REFERRAL_REWARD', 10)
+        referral = None
+        async with db.transaction():
+            await Users.set_subscribed(user_id)
+            if await Users.referred_by(user_id):
+                referral = await Referrals.pending_for(user_id)
+                if referral:
+                    await Referrals.validate(referral['id'], referral_reward)
+                    await Users.add_referral(referral['referrer_id'],
+                        referral_reward)
+        if referral:
+            try:
+                await bot.send_message(referral['referrer_id'],
+                    f'🎉 تم إحالة مستخدم جديد! +{referral_reward} نقطة')
+            except:
+                pass
+        user_data = await Users.balance(user_id)
         try:
             await callback.message.delete()
         except:
@@ -425,13 +385,10 @@ async def show_main_menu(message_or_callback, user_data):
                 await get_main_menu(), parse_mode=ParseMode.HTML)
 
 
-async def back_to_main_menu_handler(callback: types.CallbackQuery):
+async def back_to_main_menu_handler(callback: types.CallbackQuery, user:
+    Optional[User] = None):
     """العودة للقائمة الرئيسية"""
-    conn = get_db_connection()
-    user_data = conn.cursor().execute(
-        'SELECT * FROM users WHERE telegram_id = ?', (callback.from_user.id,)
-        ).fetchone()
-    conn.close()
+    user_data = user or await Users.get(callback.from_user.id)
     if user_data:
         await show_main_menu(callback, user_data)
     await callback.answer()
@@ -468,25 +425,17 @@ async def cancel_action_handler(callback: types.CallbackQuery, state:
         await callback.answer('تم الإلغاء')
 
 
-async def dashboard_handler(callback: types.CallbackQuery):
+async def dashboard_handler(callback: types.CallbackQuery, user: Optional[
+    User] = None):
     """عرض لوحة التحكم"""
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    user = conn.cursor().execute('SELECT * FROM users WHERE telegram_id = ?',
-        (user_id,)).fetchone()
-    conn.close()
+    if user is None:
+        user = await Users.get(user_id)
     if not user:
         await callback.answer('❌ خطأ في تحميل البيانات', show_alert=True)
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    referrals_count = cursor.execute(
-        'SELECT COUNT(*) as count FROM referrals WHERE referrer_id = ? AND is_valid = 1'
-        , (user_id,)).fetchone()['count']
-    tasks_count = cursor.execute(
-        'SELECT COUNT(*) as count FROM user_tasks WHERE user_id = ?', (
-        user_id,)).fetchone()['count']
-    conn.close()
+    referrals_count = await Referrals.count_valid(user_id)
+    tasks_count = await Tasks.count_completed(user_id)
     text = f"""📊 <b>لوحة التحكم</b>
 
 👤 <b>معلوماتك:</b>
@@ -507,19 +456,25 @@ async def dashboard_handler(callback: types.CallbackQuery):
         text += (
             f"\n💳 <b>عنوان المحفظة:</b>\n<code>{user['wallet_address']}</code>"
             )
+    reminders = await UserSettings.notifications_enabled(user_id)
     await callback.message.edit_text(text, reply_markup=get_dashboard_menu(
-        ), parse_mode=ParseMode.HTML)
+        reminders), parse_mode=ParseMode.HTML)
     await callback.answer()
 
 
+async def toggle_reminders_handler(callback: types.CallbackQuery, user:
+    Optional[User] = None):
+    """تفعيل أو إيقاف تذكيرات المكافأة اليومية"""
+    user_id = callback.from_user.id
+    enabled = not await UserSettings.notifications_enabled(user_id)
+    await UserSettings.set_notifications(user_id, enabled)
+    await dashboard_handler(callback, user)
+
+
 async def referral_link_handler(callback: types.CallbackQuery, bot: Bot):
     """عرض رابط الإحالة"""
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute(
-        'SELECT referral_code, total_referrals FROM users WHERE telegram_id = ?'
-        , (user_id,)).fetchone()
+    user = await Users.referral_info(user_id)
     referral_reward = await SettingsManager.get_int_setting('REFERRAL_REWARD',
         10)
     bot_info = await bot.get_me()
@@ -548,11 +503,6 @@ async def referral_link_handler(callback: types.CallbackQuery, bot: Bot):
 async def daily_bonus_handler(callback: types.CallbackQuery):
     """المكافأة اليومية"""
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute(
-        'SELECT last_daily_bonus, daily_streak_count, points FROM users WHERE telegram_id = ?'
-        , (user_id,)).fetchone()
     base_bonus = await SettingsManager.get_int_setting('DAILY_BONUS_BASE', 10)
     streak_bonus = await SettingsManager.get_int_setting('DAILY_BONUS_STREAK',
         5)
@@ -560,62 +510,35 @@ async def daily_bonus_handler(callback: types.CallbackQuery):
         100)
     max_streak = await SettingsManager.get_int_setting('DAILY_BONUS_MAX_STREAK'
         , 7)
-    can_claim = True
-    streak = user['daily_streak_count'] if user['daily_streak_count'] else 0
-    if user['last_daily_bonus']:
-        last_bonus = datetime.fromisoformat(user['last_daily_bonus'])
-        time_diff = datetime.now() - last_bonus
-        if time_diff < timedelta(hours=20):
-            can_claim = False
-            remaining = timedelta(hours=24) - time_diff
-            hours = int(remaining.total_seconds() // 3600)
-            minutes = int(remaining.total_seconds() % 3600 // 60)
-            wait_text = f'⏳ يمكنك المطالبة بعد: {hours} ساعة و {minutes} دقيقة'
-        elif time_diff > timedelta(hours=48):
-            streak = 0
-    if can_claim:
-        total_bonus = base_bonus + streak * streak_bonus
-        if streak >= max_streak - 1:
-            total_bonus += weekly_bonus
-            streak = 0
+    now = datetime.now()
+    result = await Balances.claim_daily(user_id, base_bonus, streak_bonus,
+        weekly_bonus, max_streak, now)
+    streak = result.streak
+    if result.ok:
+        Reminders.schedule(0, user_id, now, streak)
+        if result.bonus:
             bonus_message = (
                 f'🎉 مبروك! حصلت على مكافأة الأسبوع الكامل +{weekly_bonus}!')
         else:
-            streak += 1
             bonus_message = f'🔥 تتابع يومي: {streak} أيام'
-        cursor.execute(
-            """
-            UPDATE users SET
-                points = points + ?,
-                last_daily_bonus = ?,
-                daily_streak_count = ?,
-                total_earned_points = total_earned_points + ?
-            WHERE telegram_id = ?
-        """
-            , (total_bonus, datetime.now().isoformat(), streak, total_bonus,
-            user_id))
-        cursor.execute(
-            """
-            INSERT INTO points_history (user_id, action_type, points, description)
-            VALUES (?, 'daily_bonus', ?, ?)
-        """
-            , (user_id, total_bonus, f'مكافأة يومية - تتابع {streak} أيام'))
-        conn.commit()
         text = f"""🎁 <b>المكافأة اليومية</b>
 
-✅ حصلت على: <code>{total_bonus}</code> نقطة
+✅ حصلت على: <code>{result.points}</code> نقطة
 {bonus_message}
-💰 رصيدك الحالي: <code>{user['points'] + total_bonus}</code> نقطة
+💰 رصيدك الحالي: <code>{result.balance}</code> نقطة
 
 📅 عد غداً للحصول على المزيد!"""
     else:
+        remaining = result.wait or timedelta(hours=24)
+        hours = int(remaining.total_seconds() // 3600)
+        minutes = int(remaining.total_seconds() % 3600 // 60)
+        wait_text = f'⏳ يمكنك المطالبة بعد: {hours} ساعة و {minutes} دقيقة'
         text = f"""🎁 <b>المكافأة اليومية</b>
 
 {wait_text}
 
 🔥 تتابعك الحالي: <code>{streak}</code> أيام
 💡 عد غداً للحفاظ على تتابعك!"""
-    conn.close()
     builder = InlineKeyboardBuilder()
     builder.button(text='🔙 رجوع', callback_data='main_menu')
     await callback.message.edit_text(text, reply_markup=builder.as_markup(),
@@ -631,20 +554,8 @@ async def tasks_list_handler(callback: types.CallbackQuery):
     if not tasks_enabled:
         await callback.answer('🚫 نظام المهام معطل حالياً', show_alert=True)
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    tasks = cursor.execute(
-        """
-        SELECT * FROM tasks WHERE is_active = 1 ORDER BY points DESC
-    """
-        ).fetchall()
-    completed_tasks = cursor.execute(
-        """
-        SELECT task_id FROM user_tasks WHERE user_id = ?
-    """,
-        (user_id,)).fetchall()
-    completed_ids = {t['task_id'] for t in completed_tasks}
-    conn.close()
+    tasks = await Tasks.active()
+    completed_ids = await Tasks.completed_ids(user_id)
     if not tasks:
         await callback.message.edit_text(
             '🎯 <b>المهام</b>\n\nلا توجد مهام متاحة حالياً.', reply_markup=
@@ -684,13 +595,9 @@ async def complete_task_handler(callback: types.CallbackQuery, bot: Bot):
     """إكمال مهمة"""
     user_id = callback.from_user.id
     task_id = int(callback.data.split('_')[2])
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    task = cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,)
-        ).fetchone()
+    task = await Tasks.get(task_id)
     if not task:
         await callback.answer('❌ المهمة غير موجودة', show_alert=True)
-        conn.close()
         return
     if task['link']:
         chat_id = task['link']
@@ -705,94 +612,39 @@ async def complete_task_handler(callback: types.CallbackQuery, bot: Bot):
                     await callback.answer(
                         '⚠️ يجب الانضمام أولاً للقناة لإتمام المهمة.',
                         show_alert=True)
-                    conn.close()
                     return
             except:
                 pass
-    existing = cursor.execute(
-        'SELECT * FROM user_tasks WHERE user_id = ? AND task_id = ?', (
-        user_id, task_id)).fetchone()
-    if existing:
+    task_bonus = await SettingsManager.get_int_setting('TASK_BONUS_POINTS', 50)
+    result = await Balances.complete_task(user_id, task_id, task['points'],
+        task['name'], task_bonus)
+    if not result.ok:
         await callback.answer('✅ لقد أكملت هذه المهمة مسبقاً', show_alert=True)
-        conn.close()
         return
-    cursor.execute(
-        """
-        INSERT INTO user_tasks (user_id, task_id) VALUES (?, ?)
-    """
-        , (user_id, task_id))
-    cursor.execute(
-        """
-        UPDATE users SET
-            points = points + ?,
-            total_tasks_completed = total_tasks_completed + 1,
-            total_earned_points = total_earned_points + ?
-        WHERE telegram_id = ?
-    """
-        , (task['points'], task['points'], user_id))
-    cursor.execute(
-        """
-        INSERT INTO points_history (user_id, action_type, points, description)
-        VALUES (?, 'task_completion', ?, ?)
-    """
-        , (user_id, task['points'], f"إكمال مهمة: {task['name']}"))
-    all_tasks = cursor.execute(
-        'SELECT COUNT(*) as count FROM tasks WHERE is_active = 1').fetchone()[
-        'count']
-    completed = cursor.execute(
-        'SELECT COUNT(*) as count FROM user_tasks WHERE user_id = ?', (
-        user_id,)).fetchone()['count']
     bonus_message = ''
-    if completed == all_tasks:
-        task_bonus = await SettingsManager.get_int_setting('TASK_BONUS_POINTS',
-            50)
-        cursor.execute(
-            """
-            UPDATE users SET points = points + ? WHERE telegram_id = ?
-        """
-            , (task_bonus, user_id))
-        cursor.execute(
-            """
-            INSERT INTO points_history (user_id, action_type, points, description)
-            VALUES (?, 'tasks_bonus', ?, 'مكافأة إكمال جميع المهام')
-        """
-            , (user_id, task_bonus))
+    if result.bonus:
         bonus_message = (
             f'\n🎉 مبروك! حصلت على مكافأة إكمال جميع المهام: +{task_bonus} نقطة!'
             )
-    conn.commit()
-    conn.close()
     await callback.answer(
         f"✅ تم إكمال المهمة! +{task['points']} نقطة{bonus_message}",
         show_alert=True)
     await tasks_list_handler(callback)
 
 
-async def statistics_handler(callback: types.CallbackQuery):
+async def statistics_handler(callback: types.CallbackQuery, user: Optional[
+    User] = None):
     """عرض الإحصائيات"""
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (
-        user_id,)).fetchone()
-    referrals_count = cursor.execute(
-        """
-        SELECT COUNT(*) as count FROM referrals WHERE referrer_id = ? AND is_valid = 1
-    """
-        , (user_id,)).fetchone()['count']
-    tasks_count = cursor.execute(
-        """
-        SELECT COUNT(*) as count FROM user_tasks WHERE user_id = ?
-    """
-        , (user_id,)).fetchone()['count']
-    total_users = cursor.execute('SELECT COUNT(*) as count FROM users'
-        ).fetchone()['count']
-    total_referrals = cursor.execute(
-        'SELECT COUNT(*) as count FROM referrals WHERE is_valid = 1').fetchone(
-        )['count']
-    total_tasks = cursor.execute('SELECT COUNT(*) as count FROM user_tasks'
-        ).fetchone()['count']
-    conn.close()
+    if user is None:
+        user = await Users.get(user_id)
+    async with analytics.snapshot():
+        referrals_count = await Referrals.count_valid(user_id, analytics)
+        tasks_count = await Tasks.count_completed(user_id, analytics)
+        counters = await SystemCounters.get_all(analytics)
+        total_tasks = await Tasks.count_completions(analytics)
+    total_users = int(counters.get('users', 0))
+    total_referrals = int(counters.get('valid_referrals', 0))
     text = f"""📈 <b>إحصائياتك</b>
 
 👤 <b>معلوماتك:</b>
@@ -813,6 +665,24 @@ async def statistics_handler(callback: types.CallbackQuery):
     await callback.answer()
 
 
+async def leaderboard_handler(callback: types.CallbackQuery, user: Optional[
+    User] = None):
+    """لوحة المتصدرين"""
+    metric = 'referrals' if callback.data == 'leaderboard_referrals' else 'earned'
+    text = await board_text(0, metric, callback.from_user.id, user, Users.get)
+    builder = InlineKeyboardBuilder()
+    builder.button(text='💰 النقاط', callback_data='leaderboard')
+    builder.button(text='👥 الإحالات', callback_data='leaderboard_referrals')
+    builder.button(text='🔙 رجوع', callback_data='main_menu')
+    builder.adjust(2)
+    try:
+        await callback.message.edit_text(text, reply_markup=builder.as_markup(),
+            parse_mode=ParseMode.HTML)
+    except TelegramBadRequest:
+        pass
+    await callback.answer()
+
+
 async def request_withdrawal_handler(callback: types.CallbackQuery):
     """طلب سحب"""
     withdrawal_enabled = await SettingsManager.get_bool_setting(
@@ -825,17 +695,13 @@ async def request_withdrawal_handler(callback: types.CallbackQuery):
     await callback.answer()
 
 
-async def withdraw_ton_handler(callback: types.CallbackQuery, state: FSMContext
-    ):
+async def withdraw_ton_handler(callback: types.CallbackQuery, state: FSMContext,
+    user: Optional[User] = None):
     """سحب TON"""
     if not await SettingsManager.get_bool_setting('WITHDRAWAL_TON_ENABLED', True):
         return await callback.answer('🚫 سحب TON معطل حالياً', show_alert=True)
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    user = conn.cursor().execute(
-        'SELECT ton_balance, wallet_address FROM users WHERE telegram_id = ?',
-        (user_id,)).fetchone()
-    conn.close()
+    user = user or await Users.get(user_id)
     min_withdrawal = await SettingsManager.get_float_setting(
         'MIN_WITHDRAWAL_TON', 0.5)
     if user['ton_balance'] < min_withdrawal:
@@ -881,29 +747,11 @@ async def process_ton_withdrawal(message: types.Message, state: FSMContext):
     if amount < min_withdrawal:
         await message.answer(f'❌ الحد الأدنى للسحب هو {min_withdrawal} TON')
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute(
-        'SELECT ton_balance, wallet_address FROM users WHERE telegram_id = ?',
-        (user_id,)).fetchone()
-    if user['ton_balance'] < amount:
+    result = await Balances.withdraw(user_id, 'TON', amount)
+    if not result.ok:
         await message.answer('❌ رصيدك غير كافٍ')
-        conn.close()
         return
-    cursor.execute(
-        """
-        UPDATE users SET ton_balance = ton_balance - ? WHERE telegram_id = ?
-    """
-        , (amount, user_id))
-    cursor.execute(
-        """
-        INSERT INTO withdrawals (user_id, asset_type, amount, wallet_address, status)
-        VALUES (?, 'TON', ?, ?, 'pending')
-    """
-        , (user_id, amount, user['wallet_address']))
-    withdrawal_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    withdrawal_id = result.withdrawal_id
     await state.clear()
     try:
         builder = InlineKeyboardBuilder()
@@ -917,7 +765,7 @@ async def process_ton_withdrawal(message: types.Message, state: FSMContext):
 🆔 طلب رقم: <code>#{withdrawal_id}</code>
 👤 المستخدم: <code>{user_id}</code>
 🪙 المبلغ: <code>{amount}</code> TON
-💳 العنوان: <code>{user['wallet_address']}</code>"""
+💳 العنوان: <code>{result.wallet_address}</code>"""
             , reply_markup=builder.as_markup(), parse_mode=ParseMode.HTML)
     except:
         pass
@@ -925,23 +773,19 @@ async def process_ton_withdrawal(message: types.Message, state: FSMContext):
         f"""✅ <b>تم تقديم طلب السحب بنجاح!</b>
 
 🪙 المبلغ: <code>{amount}</code> TON
-💳 العنوان: <code>{user['wallet_address']}</code>
+💳 العنوان: <code>{result.wallet_address}</code>
 
 ⏳ سيتم معالجة طلبك قريباً."""
         , reply_markup=get_back_button('dashboard'), parse_mode=ParseMode.HTML)
 
 
 async def withdraw_stars_handler(callback: types.CallbackQuery, state:
-    FSMContext):
+    FSMContext, user: Optional[User] = None):
     """سحب Stars"""
     if not await SettingsManager.get_bool_setting('WITHDRAWAL_STARS_ENABLED', True):
         return await callback.answer('🚫 سحب Stars معطل حالياً', show_alert=True)
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    user = conn.cursor().execute(
-        'SELECT stars_balance FROM users WHERE telegram_id = ?', (user_id,)
-        ).fetchone()
-    conn.close()
+    user = user or await Users.get(user_id)
     min_withdrawal = await SettingsManager.get_int_setting(
         'MIN_WITHDRAWAL_STARS', 100)
     if user['stars_balance'] < min_withdrawal:
@@ -975,29 +819,11 @@ async def process_stars_withdrawal(message: types.Message, state: FSMContext):
     if amount < min_withdrawal:
         await message.answer(f'❌ الحد الأدنى للسحب هو {min_withdrawal} Stars')
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute(
-        'SELECT stars_balance FROM users WHERE telegram_id = ?', (user_id,)
-        ).fetchone()
-    if user['stars_balance'] < amount:
+    result = await Balances.withdraw(user_id, 'STARS', amount)
+    if not result.ok:
         await message.answer('❌ رصيدك غير كافٍ')
-        conn.close()
         return
-    cursor.execute(
-        """
-        UPDATE users SET stars_balance = stars_balance - ? WHERE telegram_id = ?
-    """
-        , (amount, user_id))
-    cursor.execute(
-        """
-        INSERT INTO withdrawals (user_id, asset_type, amount, status)
-        VALUES (?, 'STARS', ?, 'pending')
-    """
-        , (user_id, amount))
-    withdrawal_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    withdrawal_id = result.withdrawal_id
     await state.clear()
     try:
         builder = InlineKeyboardBuilder()
@@ -1049,19 +875,15 @@ async def process_wallet_address(message: types.Message, state: FSMContext):
 • يبدأ بـ E أو U أو 0"""
             )
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET wallet_address = ? WHERE telegram_id = ?',
-        (address, message.from_user.id))
-    conn.commit()
-    conn.close()
+    await Users.set_wallet(message.from_user.id, address)
     await state.clear()
     await message.answer(
         f'✅ <b>تم تحديد العنوان بنجاح!</b>\n\n💳 العنوان: <code>{address}</code>'
         , reply_markup=get_back_button('dashboard'), parse_mode=ParseMode.HTML)
 
 
-async def convert_points_handler(callback: types.CallbackQuery):
+async def convert_points_handler(callback: types.CallbackQuery, user:
+    Optional[User] = None):
     """تحويل النقاط - المتجر الجديد"""
     conversion_enabled = await SettingsManager.get_bool_setting(
         'CONVERSION_ENABLED', True)
@@ -1069,11 +891,7 @@ async def convert_points_handler(callback: types.CallbackQuery):
         await callback.answer('🚫 التحويل معطل حالياً', show_alert=True)
         return
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    user = conn.cursor().execute(
-        'SELECT points FROM users WHERE telegram_id = ?', (user_id,)).fetchone(
-        )
-    conn.close()
+    user = user or await Users.get(user_id)
     points_ton = await SettingsManager.get_int_setting('CONVERSION_POINTS_TON',
         1000)
     points_stars = await SettingsManager.get_int_setting(
@@ -1093,16 +911,12 @@ async def convert_points_handler(callback: types.CallbackQuery):
 
 
 async def convert_to_ton_handler(callback: types.CallbackQuery, state:
-    FSMContext):
+    FSMContext, user: Optional[User] = None):
     """تحويل إلى TON"""
     if not await SettingsManager.get_bool_setting('WITHDRAWAL_TON_ENABLED', True):
         return await callback.answer('🚫 تحويل TON معطل حالياً', show_alert=True)
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    user = conn.cursor().execute(
-        'SELECT points FROM users WHERE telegram_id = ?', (user_id,)).fetchone(
-        )
-    conn.close()
+    user = user or await Users.get(user_id)
     conversion_rate = await SettingsManager.get_int_setting(
         'CONVERSION_POINTS_TON', 1000)
     await state.set_state(ConversionStates.enter_points_for_ton)
@@ -1132,30 +946,11 @@ async def process_convert_to_ton(message: types.Message, state: FSMContext):
     conversion_rate = await SettingsManager.get_int_setting(
         'CONVERSION_POINTS_TON', 1000)
     ton_amount = points / conversion_rate
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute('SELECT points FROM users WHERE telegram_id = ?',
-        (user_id,)).fetchone()
-    if user['points'] < points:
+    result = await Balances.convert(user_id, points, ton=ton_amount,
+        description=f'تحويل إلى TON: {ton_amount:.4f}')
+    if not result.ok:
         await message.answer('❌ رصيدك غير كافٍ')
-        conn.close()
         return
-    cursor.execute(
-        """
-        UPDATE users SET
-            points = points - ?,
-            ton_balance = ton_balance + ?
-        WHERE telegram_id = ?
-    """
-        , (points, ton_amount, user_id))
-    cursor.execute(
-        """
-        INSERT INTO points_history (user_id, action_type, points, description)
-        VALUES (?, 'conversion', -?, ?)
-    """
-        , (user_id, points, f'تحويل إلى TON: {ton_amount:.4f}'))
-    conn.commit()
-    conn.close()
     await state.clear()
     await message.answer(
         f"""✅ <b>تم التحويل بنجاح!</b>
@@ -1166,16 +961,12 @@ async def process_convert_to_ton(message: types.Message, state: FSMContext):
 
 
 async def convert_to_stars_handler(callback: types.CallbackQuery, state:
-    FSMContext):
+    FSMContext, user: Optional[User] = None):
     """تحويل إلى Stars"""
     if not await SettingsManager.get_bool_setting('WITHDRAWAL_STARS_ENABLED', True):
         return await callback.answer('🚫 تحويل Stars معطل حالياً', show_alert=True)
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    user = conn.cursor().execute(
-        'SELECT points FROM users WHERE telegram_id = ?', (user_id,)).fetchone(
-        )
-    conn.close()
+    user = user or await Users.get(user_id)
     conversion_rate = await SettingsManager.get_int_setting(
         'CONVERSION_POINTS_STARS', 150)
     await state.set_state(ConversionStates.enter_points_for_stars)
@@ -1206,30 +997,14 @@ async def process_convert_to_stars(message: types.Message, state: FSMContext):
         'CONVERSION_POINTS_STARS', 150)
     stars_amount = points // conversion_rate * 10
     actual_points = stars_amount // 10 * conversion_rate
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    user = cursor.execute('SELECT points FROM users WHERE telegram_id = ?',
-        (user_id,)).fetchone()
-    if user['points'] < actual_points:
+    result = await Balances.convert(user_id, actual_points, stars=
+        stars_amount, description=f'تحويل إلى Stars: {stars_amount}')
+    if result.error == INVALID:
+        await message.answer(f'❌ الحد الأدنى للتحويل هو {conversion_rate} نقطة')
+        return
+    if not result.ok:
         await message.answer('❌ رصيدك غير كافٍ')
-        conn.close()
         return
-    cursor.execute(
-        """
-        UPDATE users SET
-            points = points - ?,
-            stars_balance = stars_balance + ?
-        WHERE telegram_id = ?
-    """
-        , (actual_points, stars_amount, user_id))
-    cursor.execute(
-        """
-        INSERT INTO points_history (user_id, action_type, points, description)
-        VALUES (?, 'conversion', -?, ?)
-    """
-        , (user_id, actual_points, f'تحويل إلى Stars: {stars_amount}'))
-    conn.commit()
-    conn.close()
     await state.clear()
     await message.answer(
         f"""✅ <b>تم التحويل بنجاح!</b>
@@ -1330,7 +1105,7 @@ async def process_bot_token(message: types.Message, state: FSMContext, bot: Bot
     bot_id = data.get('bot_id')
     status_msg = await message.answer('🔄 جاري التحقق من التوكن...')
     try:
-        temp_bot = Bot(token=token)
+        temp_bot = new_bot(token)
         me = await temp_bot.get_me()
         bot_username = me.username
         bot_name = me.full_name
@@ -1346,27 +1121,14 @@ async def process_bot_token(message: types.Message, state: FSMContext, bot: Bot
 • عدم وجود مسافات في التوكن"""
             , parse_mode=ParseMode.HTML)
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
     if is_update and bot_id:
-        existing = cursor.execute(
-            'SELECT * FROM hosted_bots WHERE id = ? AND owner_id = ?', (
-            bot_id, user_id)).fetchone()
+        existing = await HostedBots.get_owned(bot_id, user_id)
         if not existing:
             await status_msg.delete()
             await message.answer('❌ البوت غير موجود أو ليس لديك صلاحية!')
-            conn.close()
             return
         await HostedBotSystem.stop_bot(bot_id)
-        cursor.execute(
-            """
-            UPDATE hosted_bots
-            SET bot_token = ?, bot_username = ?, bot_name = ?, is_active = 1
-            WHERE id = ?
-        """
-            , (token, bot_username, bot_name, bot_id))
-        conn.commit()
-        conn.close()
+        await HostedBots.update_token(bot_id, token, bot_username, bot_name)
         await status_msg.delete()
         await state.clear()
         success = await HostedBotSystem.start_bot(bot_id, token,
@@ -1388,24 +1150,14 @@ async def process_bot_token(message: types.Message, state: FSMContext, bot: Bot
                 , parse_mode=ParseMode.HTML)
         await show_bot_dashboard(message, user_id, bot_id)
         return
-    existing = cursor.execute(
-        'SELECT * FROM hosted_bots WHERE bot_token = ? OR bot_username = ?',
-        (token, bot_username)).fetchone()
-    if existing:
+    if await HostedBots.exists(token, bot_username):
         await status_msg.delete()
         await message.answer('❌ هذا البوت مستضاف مسبقاً!')
-        conn.close()
         return
     free_max_users = await SettingsManager.get_int_setting(
         'FREE_PLAN_MAX_USERS', 2000)
-    cursor.execute(
-        """
-        INSERT INTO hosted_bots
-        (bot_token, bot_username, bot_name, owner_id, plan_type, max_users, config)
-        VALUES (?, ?, ?, ?, 'free', ?, ?)
-    """
-        , (token, bot_username, bot_name, user_id, free_max_users, json.
-        dumps({
+    bot_id = await HostedBots.create(token, bot_username, bot_name, user_id,
+        free_max_users, json.dumps({
             'referral_reward': 10,
             'channel_username': None,
             'min_withdrawal_ton': 0.5,
@@ -1415,10 +1167,7 @@ async def process_bot_token(message: types.Message, state: FSMContext, bot: Bot
             'mandatory_channels': [],
             'custom_welcome': None,
             'created_at': datetime.now().isoformat()
-        })))
-    bot_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        }))
     await status_msg.delete()
     await state.clear()
     await message.answer(
@@ -1437,13 +1186,7 @@ async def process_bot_token(message: types.Message, state: FSMContext, bot: Bot
 async def my_bots_handler(callback: types.CallbackQuery):
     """عرض قائمة بوتات المستخدم - مُحسَّن"""
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    bots = conn.cursor().execute(
-        """
-        SELECT * FROM hosted_bots WHERE owner_id = ? ORDER BY created_at DESC
-    """
-        , (user_id,)).fetchall()
-    conn.close()
+    bots = await HostedBots.by_owner(user_id)
     if not bots:
         await callback.message.edit_text(
             """📋 <b>ليس لديك أي بوتات مستضافة</b>
@@ -1480,13 +1223,7 @@ async def my_bots_handler(callback: types.CallbackQuery):
 
 async def show_bot_dashboard(message_or_callback, user_id: int, bot_id: int):
     """عرض لوحة تحكم البوت - مُحسَّنة مع جميع الأزرار"""
-    conn = get_db_connection()
-    try:
-        bot_data = conn.cursor().execute(
-            'SELECT * FROM hosted_bots WHERE id = ? AND owner_id = ?', (
-            bot_id, user_id)).fetchone()
-    finally:
-        conn.close()
+    bot_data = await HostedBots.get_owned(bot_id, user_id)
     if not bot_data:
         if isinstance(message_or_callback, types.CallbackQuery):
             await message_or_callback.answer('❌ البوت غير موجود',
@@ -1570,19 +1307,12 @@ async def bot_delete_handler(callback: types.CallbackQuery):
     """حذف بوت - مُحسَّن"""
     bot_id = int(callback.data.split('_')[2])
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    bot_data = cursor.execute(
-        'SELECT * FROM hosted_bots WHERE id = ? AND owner_id = ?', (bot_id,
-        user_id)).fetchone()
+    bot_data = await HostedBots.get_owned(bot_id, user_id)
     if not bot_data:
         await callback.answer('❌ البوت غير موجود', show_alert=True)
-        conn.close()
         return
     await HostedBotSystem.stop_bot(bot_id)
-    cursor.execute('DELETE FROM hosted_bots WHERE id = ?', (bot_id,))
-    conn.commit()
-    conn.close()
+    await HostedBots.delete(bot_id)
     await callback.answer('✅ تم حذف البوت بنجاح', show_alert=True)
     await my_bots_handler(callback)
 
@@ -1593,14 +1323,9 @@ async def bot_toggle_handler(callback: types.CallbackQuery):
     action = data[1]
     bot_id = int(data[2])
     user_id = callback.from_user.id
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    bot_data = cursor.execute(
-        'SELECT * FROM hosted_bots WHERE id = ? AND owner_id = ?', (bot_id,
-        user_id)).fetchone()
+    bot_data = await HostedBots.get_owned(bot_id, user_id)
     if not bot_data:
         await callback.answer('❌ البوت غير موجود', show_alert=True)
-        conn.close()
         return
     if action == 'start':
         success = await HostedBotSystem.start_bot(bot_id, bot_data[
@@ -1612,13 +1337,10 @@ async def bot_toggle_handler(callback: types.CallbackQuery):
     else:
         success = await HostedBotSystem.stop_bot(bot_id)
         if success:
-            cursor.execute('UPDATE hosted_bots SET is_active = 0 WHERE id = ?',
-                (bot_id,))
-            conn.commit()
+            await HostedBots.mark_stopped(bot_id)
             await callback.answer('✅ تم إيقاف البوت', show_alert=True)
         else:
             await callback.answer('❌ فشل إيقاف البوت', show_alert=True)
-    conn.close()
     await show_bot_dashboard(callback.message, user_id, bot_id)
 
 
@@ -1667,13 +1389,9 @@ async def admin_add_task_process(message: types.Message, state: FSMContext, bot:
         try:
             target_bot = bot
             if bot_type == 'hosted':
-                conn = get_db_connection()
-                b_info = conn.cursor().execute(
-                    'SELECT bot_token FROM hosted_bots WHERE id = ?', (bot_id,)
-                    ).fetchone()
-                conn.close()
-                if b_info:
-                    target_bot = Bot(token=b_info['bot_token'])
+                b_token = await HostedBots.token(bot_id)
+                if b_token:
+                    target_bot = new_bot(b_token)
             me = await target_bot.get_me()
             try:
                 member = await target_bot.get_chat_member(chat_id=chat_id,
@@ -1695,19 +1413,12 @@ async def admin_add_task_process(message: types.Message, state: FSMContext, bot:
                 return
             if bot_type == 'hosted' and target_bot != bot:
                 await target_bot.session.close()
-            conn = get_db_connection()
-            cursor = conn.cursor()
             if bot_type == 'main':
-                cursor.execute(
-                    'INSERT INTO tasks (name, points, link, max_completions, is_active) VALUES (?, ?, ?, ?, 1)'
-                    , (data['name'], data['points'], link, data['max_users']))
+                await Tasks.create(data['name'], data['points'], link, data[
+                    'max_users'])
             else:
-                cursor.execute(
-                    'INSERT INTO hosted_bot_tasks (bot_id, name, points, link, max_completions, is_active) VALUES (?, ?, ?, ?, ?, 1)'
-                    , (bot_id, data['name'], data['points'], link, data[
-                    'max_users']))
-            conn.commit()
-            conn.close()
+                await HostedTasks.create(bot_id, data['name'], data['points'],
+                    link, data['max_users'])
             await state.clear()
             await message.answer('✅ تم تأكيد نشر المهمة بنجاح!',
                 reply_markup=get_back_button(back_dest))
@@ -1735,27 +1446,22 @@ async def task_next_step_handler(callback: types.CallbackQuery, state: FSMContex
 
 async def cmd_admin(message: types.Message):
     """أمر /admin"""
-    if not is_admin(message.from_user.id):
+    if not await is_admin(message.from_user.id):
         return await message.answer('⛔️ هذا الأمر للمشرفين فقط')
     await message.answer('👑 <b>لوحة تحكم المشرف</b>', reply_markup=
         get_admin_menu(), parse_mode=ParseMode.HTML)
 
 
-def is_admin(user_id: int) ->bool:
+async def is_admin(user_id: int) ->bool:
     """التحقق من صلاحية المشرف"""
     if user_id == ADMIN_ID:
         return True
-    conn = get_db_connection()
-    user = conn.cursor().execute(
-        'SELECT is_admin FROM users WHERE telegram_id = ?', (user_id,)
-        ).fetchone()
-    conn.close()
-    return user and user['is_admin'] == 1
+    return await Users.is_admin(user_id)
 
 
 async def admin_panel_handler(callback: types.CallbackQuery):
     """عرض لوحة المشرف"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     await callback.message.edit_text('👑 <b>لوحة تحكم المشرف</b>',
         reply_markup=get_admin_menu(), parse_mode=ParseMode.HTML)
@@ -1764,34 +1470,25 @@ async def admin_panel_handler(callback: types.CallbackQuery):
 
 async def admin_stats_handler(callback: types.CallbackQuery):
     """إحصائيات المشرف"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    total_users = cursor.execute('SELECT COUNT(*) as count FROM users'
-        ).fetchone()['count']
-    total_bots = cursor.execute('SELECT COUNT(*) as count FROM hosted_bots'
-        ).fetchone()['count']
-    active_bots = cursor.execute(
-        'SELECT COUNT(*) as count FROM hosted_bots WHERE is_active = 1'
-        ).fetchone()['count']
-    total_referrals = cursor.execute(
-        'SELECT COUNT(*) as count FROM referrals WHERE is_valid = 1').fetchone(
-        )['count']
-    total_points = cursor.execute('SELECT SUM(points) as sum FROM users'
-        ).fetchone()['sum'] or 0
-    total_ton = cursor.execute('SELECT SUM(ton_balance) as sum FROM users'
-        ).fetchone()['sum'] or 0
-    total_stars = cursor.execute('SELECT SUM(stars_balance) as sum FROM users'
-        ).fetchone()['sum'] or 0
-    pending_withdrawals = cursor.execute(
-        "SELECT COUNT(*) as count FROM withdrawals WHERE status = 'pending'"
-        ).fetchone()['count']
-    today = datetime.now().strftime('%Y-%m-%d')
-    new_today = cursor.execute(
-        'SELECT COUNT(*) as count FROM users WHERE date(registration_date) = ?'
-        , (today,)).fetchone()['count']
-    conn.close()
+    async with analytics.snapshot():
+        counters = await SystemCounters.get_all(analytics)
+        today = await SystemCounters.get_day(pool=analytics)
+    total_users = int(counters.get('users', 0))
+    total_bots = int(counters.get('hosted_bots', 0))
+    active_bots = int(counters.get('active_bots', 0))
+    total_referrals = int(counters.get('valid_referrals', 0))
+    total_points = int(counters.get('total_points', 0))
+    total_ton = counters.get('total_ton', 0)
+    total_stars = int(counters.get('total_stars', 0))
+    pending_withdrawals = int(counters.get('pending_withdrawals', 0))
+    new_today = int(today.get('new_users', 0))
+    cache = SettingsManager.get_stats()
+    backup = Backups.get_stats()
+    users_cache = UserCache.get_stats()
+    http = Sessions.get_stats()
+    hosted = HostedBotSystem.get_stats()
     text = f"""📊 <b>إحصائيات النظام</b>
 
 👥 <b>المستخدمين:</b>
@@ -1801,6 +1498,7 @@ async def admin_stats_handler(callback: types.CallbackQuery):
 🤖 <b>البوتات:</b>
 • البوتات المستضافة: {total_bots}
 • البوتات النشطة: {active_bots}
+• قيد التشغيل: {hosted['hot']} نشطة • {hosted['warm']} هادئة • {hosted['hibernated']} في سبات (إيقاظ {hosted['wakes']})
 
 🔗 <b>الإحالات:</b>
 • الإحالات الناجحة: {total_referrals}
@@ -1810,7 +1508,12 @@ async def admin_stats_handler(callback: types.CallbackQuery):
 • إجمالي TON: {total_ton:.4f}
 • إجمالي Stars: {total_stars}
 
-💸 <b>طلبات السحب المعلقة:</b> {pending_withdrawals}"""
+💸 <b>طلبات السحب المعلقة:</b> {pending_withdrawals}
+
+⚙️ <b>كاش الإعدادات:</b> v{cache['version']} • إصابات {cache['hits']} • إخفاقات {cache['misses']} • إعادة تحميل {cache['reloads']}
+👤 <b>كاش المستخدمين:</b> {users_cache['size']} مستخدم • إصابات {users_cache['hit_rate']}% • إبطال {users_cache['invalidations']}
+🌐 <b>اتصالات Telegram:</b> {http['in_use']} نشطة • {http['idle']} خاملة • {http['requests']} طلب بمتوسط {http['avg_ms']} ms • أخطاء {http['errors']}{f" • أبطأ بوت {http['slowest_bot']} ({http['slowest_ms']} ms)" if http['slowest_bot'] else ''}
+💾 <b>النسخ الاحتياطي:</b> {f"آخر نسخة {backup['at']} • {backup['seconds']} ث • {backup['pages']} صفحة ({backup['pages_per_step']}/خطوة) • {backup['integrity']}" if backup['at'] else 'لا توجد نسخة منذ التشغيل'} • فشل {backup['failures']}"""
     builder = InlineKeyboardBuilder()
     builder.button(text='🔄 تحديث', callback_data='admin_stats')
     builder.button(text='🔙 رجوع', callback_data='admin_panel')
@@ -1822,7 +1525,7 @@ async def admin_stats_handler(callback: types.CallbackQuery):
 
 async def admin_users_menu_handler(callback: types.CallbackQuery):
     """قائمة إدارة المستخدمين"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     text = f'👥 <b>إدارة المستخدمين</b>\n\nاختر الإجراء:'
     builder = InlineKeyboardBuilder()
@@ -1841,7 +1544,7 @@ async def admin_users_menu_handler(callback: types.CallbackQuery):
 async def admin_find_user_start(callback: types.CallbackQuery, state:
     FSMContext):
     """بدء البحث عن مستخدم"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     await state.set_state(AdminStates.find_user)
     await callback.message.edit_text(
@@ -1856,31 +1559,19 @@ async def admin_find_user_start(callback: types.CallbackQuery, state:
 async def admin_find_user_process(message: types.Message, state: FSMContext):
     """معالجة البحث عن مستخدم - ✅ تم إضافة التحقق"""
     search = message.text.strip()
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        user_id = int(search)
-        user = cursor.execute('SELECT * FROM users WHERE telegram_id = ?',
-            (user_id,)).fetchone()
-    except ValueError:
-        user = cursor.execute(
-            'SELECT * FROM users WHERE username LIKE ? OR full_name LIKE ?',
-            (f'%{search}%', f'%{search}%')).fetchone()
-    conn.close()
+    async with analytics.snapshot():
+        try:
+            user = await Users.get(int(search), analytics)
+        except ValueError:
+            user = await Users.search(search, analytics)
+        if user:
+            referrals = await Referrals.count_valid(user['telegram_id'], analytics)
+            tasks = await Tasks.count_completed(user['telegram_id'], analytics)
     if not user:
         await message.answer('❌ لم يتم العثور على المستخدم', reply_markup=
             get_back_button('admin_users_menu'))
         await state.clear()
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    referrals = cursor.execute(
-        'SELECT COUNT(*) as count FROM referrals WHERE referrer_id = ? AND is_valid = 1'
-        , (user['telegram_id'],)).fetchone()['count']
-    tasks = cursor.execute(
-        'SELECT COUNT(*) as count FROM user_tasks WHERE user_id = ?', (user
-        ['telegram_id'],)).fetchone()['count']
-    conn.close()
     text = f"""👤 <b>معلومات المستخدم</b>
 
 🆔 المعرف: <code>{user['telegram_id']}</code>
@@ -1923,7 +1614,7 @@ async def admin_find_user_process(message: types.Message, state: FSMContext):
 async def admin_broadcast_start(callback: types.CallbackQuery, state:
     FSMContext):
     """بدء البث"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     broadcast_enabled = await SettingsManager.get_bool_setting(
         'BROADCAST_ENABLED', True)
@@ -1945,16 +1636,13 @@ async def admin_broadcast_process(message: types.Message, state: FSMContext,
     bot: Bot):
     """معالجة البث"""
     broadcast_text = message.text
-    conn = get_db_connection()
-    users = conn.cursor().execute(
-        'SELECT telegram_id FROM users WHERE is_banned = 0').fetchall()
-    conn.close()
+    user_ids = await Users.active_ids()
     status_msg = await message.answer('🔄 جاري الإرسال...')
     sent = 0
     failed = 0
-    for user in users:
+    for target_id in user_ids:
         try:
-            await bot.send_message(user['telegram_id'],
+            await bot.send_message(target_id,
                 f"""📢 <b>إشعار من الإدارة</b>
 
 {broadcast_text}""",
@@ -1970,7 +1658,7 @@ async def admin_broadcast_process(message: types.Message, state: FSMContext,
 
 async def admin_security_settings_handler(callback: types.CallbackQuery):
     """عرض إعدادات الحماية"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     ip_ban = await SettingsManager.get_bool_setting('IP_BAN_ENABLED', True)
     max_users_ip = await SettingsManager.get_int_setting('MAX_USERS_PER_IP', 1)
@@ -1978,10 +1666,18 @@ async def admin_security_settings_handler(callback: types.CallbackQuery):
         72)
     max_attempts = await SettingsManager.get_int_setting(
         'MAX_ATTEMPTS_PER_HOUR', 5)
+    subnet24 = await SettingsManager.get_int_setting('MAX_USERS_PER_SUBNET24', 0)
+    subnet16 = await SettingsManager.get_int_setting('MAX_USERS_PER_SUBNET16', 0)
+    subnet64 = await SettingsManager.get_int_setting('MAX_USERS_PER_SUBNET64', 0)
+    subnet_bans = await SettingsManager.get_int_setting('MAX_BANS_PER_SUBNET', 0)
     secret_expiry = await SettingsManager.get_int_setting(
         'SECRET_LINK_EXPIRY_MINUTES', 5)
+    webapp_auth = await SettingsManager.get_bool_setting(
+        'REQUIRE_WEBAPP_AUTH', True)
     block_duplicate = await SettingsManager.get_bool_setting(
         'BLOCK_DUPLICATE_DEVICES', True)
+    device_similarity = await SettingsManager.get_int_setting(
+        'DEVICE_SIMILARITY_PERCENT', 0)
     vpn_detection = await SettingsManager.get_bool_setting(
         'VPN_DETECTION_ENABLED', True)
     text = f"""🔧 <b>إعدادات الحماية</b>
@@ -1990,8 +1686,12 @@ async def admin_security_settings_handler(callback: types.CallbackQuery):
 👥 <b>أقصى مستخدمين لكل IP</b>: <code>{max_users_ip}</code>
 ⏱️ <b>مدة حظر IP</b>: <code>{ban_duration}</code> ساعة
 🔄 <b>أقصى محاولات/ساعة</b>: <code>{max_attempts}</code>
+🌐 <b>أقصى مستخدمين لكل شبكة</b>: /24 <code>{subnet24}</code> · /16 <code>{subnet16}</code> · IPv6 /64 <code>{subnet64}</code>
+⛔️ <b>أقصى عناوين محظورة في الشبكة</b>: <code>{subnet_bans}</code>
 🔗 <b>صلاحية الرابط السري</b>: <code>{secret_expiry}</code> دقيقة
+📱 <b>التحقق من داخل تيليجرام فقط</b>: {'✅ مفعل' if webapp_auth else '❌ معطل'}
 🛡️ <b>منع تكرار البصمة</b>: {'✅ مفعل' if block_duplicate else '❌ معطل'}
+🧬 <b>نسبة تشابه الأجهزة</b>: <code>{device_similarity}%</code>
 🔒 <b>كشف VPN</b>: {'✅ مفعل' if vpn_detection else '❌ معطل'}
 
 📌 لتغيير أي إعداد، اختر من القائمة:"""
@@ -2004,10 +1704,22 @@ async def admin_security_settings_handler(callback: types.CallbackQuery):
         'admin_set_ban_duration')
     builder.button(text='🔄 تغيير أقصى محاولات', callback_data=
         'admin_set_max_attempts')
+    builder.button(text='🌐 أقصى مستخدمين/شبكة /24', callback_data=
+        'admin_set_max_users_subnet24')
+    builder.button(text='🌐 أقصى مستخدمين/شبكة /16', callback_data=
+        'admin_set_max_users_subnet16')
+    builder.button(text='🌐 أقصى مستخدمين/شبكة IPv6 /64', callback_data=
+        'admin_set_max_users_subnet64')
+    builder.button(text='⛔️ أقصى عناوين محظورة/شبكة', callback_data=
+        'admin_set_max_bans_subnet')
     builder.button(text='🔗 تغيير صلاحية الرابط', callback_data=
         'admin_set_secret_expiry')
+    builder.button(text='📱 تفعيل/تعطيل التحقق من تيليجرام', callback_data=
+        'admin_toggle_webapp_auth')
     builder.button(text='🛡️ تفعيل/تعطيل منع التكرار', callback_data=
         'admin_toggle_duplicate')
+    builder.button(text='🧬 تغيير نسبة تشابه الأجهزة', callback_data=
+        'admin_set_device_similarity')
     builder.button(text='🔒 تفعيل/تعطيل كشف VPN', callback_data=
         'admin_toggle_vpn')
     builder.button(text='🔙 رجوع', callback_data='admin_panel')
@@ -2019,11 +1731,12 @@ async def admin_security_settings_handler(callback: types.CallbackQuery):
 
 async def admin_toggle_setting_handler(callback: types.CallbackQuery):
     """تبديل إعداد منطقي"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     setting_map = {'admin_toggle_ip_ban': 'IP_BAN_ENABLED',
         'admin_toggle_duplicate': 'BLOCK_DUPLICATE_DEVICES',
-        'admin_toggle_vpn': 'VPN_DETECTION_ENABLED'}
+        'admin_toggle_vpn': 'VPN_DETECTION_ENABLED',
+        'admin_toggle_webapp_auth': 'REQUIRE_WEBAPP_AUTH'}
     setting_key = setting_map.get(callback.data)
     if not setting_key:
         return await callback.answer('❌ إعداد غير معروف', show_alert=True)
@@ -2038,12 +1751,17 @@ async def admin_toggle_setting_handler(callback: types.CallbackQuery):
 
 async def admin_set_value_start(callback: types.CallbackQuery, state: FSMContext):
     """بدء تغيير قيمة"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     setting_map = {
         'admin_set_max_users_ip': ('MAX_USERS_PER_IP', 'أقصى مستخدمين لكل IP', SettingsStates.set_max_users_per_ip, 'admin_security_settings'),
         'admin_set_ban_duration': ('BAN_DURATION_HOURS', 'مدة حظر IP (ساعات)', SettingsStates.set_ban_duration, 'admin_security_settings'),
         'admin_set_max_attempts': ('MAX_ATTEMPTS_PER_HOUR', 'أقصى محاولات في الساعة', SettingsStates.set_max_attempts, 'admin_security_settings'),
+        'admin_set_max_users_subnet24': ('MAX_USERS_PER_SUBNET24', 'أقصى مستخدمين لكل شبكة /24', SettingsStates.set_max_users_subnet24, 'admin_security_settings'),
+        'admin_set_max_users_subnet16': ('MAX_USERS_PER_SUBNET16', 'أقصى مستخدمين لكل شبكة /16', SettingsStates.set_max_users_subnet16, 'admin_security_settings'),
+        'admin_set_max_users_subnet64': ('MAX_USERS_PER_SUBNET64', 'أقصى مستخدمين لكل شبكة IPv6 /64', SettingsStates.set_max_users_subnet64, 'admin_security_settings'),
+        'admin_set_max_bans_subnet': ('MAX_BANS_PER_SUBNET', 'أقصى عناوين محظورة في الشبكة', SettingsStates.set_max_bans_subnet, 'admin_security_settings'),
+        'admin_set_device_similarity': ('DEVICE_SIMILARITY_PERCENT', 'نسبة تشابه الأجهزة (%)', SettingsStates.set_device_similarity, 'admin_security_settings'),
         'admin_set_secret_expiry': ('SECRET_LINK_EXPIRY_MINUTES', 'صلاحية الرابط السري (دقائق)', SettingsStates.set_secret_expiry, 'admin_security_settings'),
         'admin_set_referral_reward': ('REFERRAL_REWARD', 'نقاط الإحالة', SettingsStates.set_referral_reward, 'admin_points_settings'),
         'admin_set_daily_bonus_base': ('DAILY_BONUS_BASE', 'المكافأة اليومية الأساسية', SettingsStates.set_daily_bonus_base, 'admin_points_settings'),
@@ -2109,7 +1827,7 @@ async def admin_set_value_process(message: types.Message, state: FSMContext):
 
 async def admin_plan_settings_handler(callback: types.CallbackQuery):
     """عرض إعدادات الباقات"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     free_max = await SettingsManager.get_int_setting('FREE_PLAN_MAX_USERS',
         2000)
@@ -2173,7 +1891,7 @@ async def admin_plan_settings_handler(callback: types.CallbackQuery):
 
 async def admin_points_settings_handler(callback: types.CallbackQuery):
     """إعدادات النقاط"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     referral_reward = await SettingsManager.get_int_setting('REFERRAL_REWARD',
         10)
@@ -2213,7 +1931,7 @@ async def admin_points_settings_handler(callback: types.CallbackQuery):
 
 async def admin_conversion_settings_handler(callback: types.CallbackQuery):
     """إعدادات التحويل - يمكن تعديل الأسعار من هنا"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     conversion_enabled = await SettingsManager.get_bool_setting(
         'CONVERSION_ENABLED', True)
@@ -2248,21 +1966,9 @@ async def admin_conversion_settings_handler(callback: types.CallbackQuery):
 
 async def admin_withdrawals_pending_handler(callback: types.CallbackQuery):
     """عرض طلبات السحب المعلقة"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    withdrawals = cursor.execute(
-        """
-        SELECT w.*, u.username, u.full_name
-        FROM withdrawals w
-        JOIN users u ON w.user_id = u.telegram_id
-        WHERE w.status = 'pending'
-        ORDER BY w.request_date DESC
-        LIMIT 10
-    """
-        ).fetchall()
-    conn.close()
+    withdrawals = await Withdrawals.pending(10)
     if not withdrawals:
         await callback.message.edit_text(
             '💸 <b>طلبات السحب</b>\n\nلا توجد طلبات معلقة.', reply_markup=
@@ -2294,7 +2000,7 @@ async def admin_withdrawals_pending_handler(callback: types.CallbackQuery):
 async def admin_process_withdrawal_handler(callback: types.CallbackQuery,
     bot: Bot, state: FSMContext):
     """معالجة طلب السحب"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     data = callback.data.split('_')
     action = data[1]
@@ -2305,23 +2011,12 @@ async def admin_process_withdrawal_handler(callback: types.CallbackQuery,
         await callback.message.answer('📝 يرجى إدخال سبب الرفض:')
         await callback.answer()
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    withdrawal = cursor.execute('SELECT * FROM withdrawals WHERE id = ?', (
-        withdrawal_id,)).fetchone()
+    withdrawal = await Withdrawals.get(withdrawal_id)
     if not withdrawal:
         await callback.answer('❌ الطلب غير موجود', show_alert=True)
-        conn.close()
         return
-    cursor.execute(
-        """
-        UPDATE withdrawals
-        SET status = 'approved', processed_date = ?, processed_by = ?
-        WHERE id = ?
-    """
-        , (datetime.now().isoformat(), callback.from_user.id, withdrawal_id))
-    conn.commit()
-    conn.close()
+    await Withdrawals.approve(withdrawal_id, datetime.now().isoformat(),
+        callback.from_user.id)
     try:
         await bot.send_message(withdrawal['user_id'],
             f"""✅ تم قبول طلب السحب الخاص بك.
@@ -2341,63 +2036,33 @@ async def admin_reject_withdrawal_reason_process(message: types.Message,
     wd_id = data.get('wd_id')
     bot_type = data.get('bot_type')
     reason = message.text.strip()
-    conn = get_db_connection()
-    cursor = conn.cursor()
     if bot_type == 'main':
-        withdrawal = cursor.execute('SELECT * FROM withdrawals WHERE id = ?',
-            (wd_id,)).fetchone()
+        withdrawal = await Withdrawals.get(wd_id)
         if not withdrawal:
             await message.answer('❌ الطلب غير موجود')
-            conn.close()
             await state.clear()
             return
-        cursor.execute(
-            """
-            UPDATE withdrawals SET status = 'rejected', notes = ?, processed_date = ?, processed_by = ?
-            WHERE id = ?
-        """
-            , (reason, datetime.now().isoformat(), message.from_user.id, wd_id)
-            )
-        if withdrawal['asset_type'] == 'TON':
-            cursor.execute(
-                'UPDATE users SET ton_balance = ton_balance + ? WHERE telegram_id = ?'
-                , (withdrawal['amount'], withdrawal['user_id']))
-        else:
-            cursor.execute(
-                'UPDATE users SET stars_balance = stars_balance + ? WHERE telegram_id = ?'
-                , (int(withdrawal['amount']), withdrawal['user_id']))
+        async with db.transaction():
+            await Withdrawals.reject(wd_id, reason, datetime.now().isoformat(),
+                message.from_user.id)
+            await Users.credit(withdrawal['user_id'], withdrawal['asset_type'],
+                withdrawal['amount'])
         target_user_id = withdrawal['user_id']
         amount_text = f"{withdrawal['amount']} {withdrawal['asset_type']}"
     else:
-        withdrawal = cursor.execute(
-            'SELECT * FROM hosted_bot_withdrawals WHERE id = ?', (wd_id,)
-            ).fetchone()
+        bot_id = data.get('bot_id')
+        withdrawal = await HostedWithdrawals.get(bot_id, wd_id)
         if not withdrawal:
             await message.answer('❌ الطلب غير موجود')
-            conn.close()
             await state.clear()
             return
-        cursor.execute(
-            """
-            UPDATE hosted_bot_withdrawals SET status = 'rejected', notes = ?, processed_date = ?, processed_by = ?
-            WHERE id = ?
-        """
-            , (reason, datetime.now().isoformat(), message.from_user.id, wd_id)
-            )
-        if withdrawal['asset_type'] == 'TON':
-            cursor.execute(
-                'UPDATE hosted_bot_users SET ton_balance = ton_balance + ? WHERE bot_id = ? AND user_telegram_id = ?'
-                , (withdrawal['amount'], withdrawal['bot_id'], withdrawal[
-                'user_id']))
-        else:
-            cursor.execute(
-                'UPDATE hosted_bot_users SET stars_balance = stars_balance + ? WHERE bot_id = ? AND user_telegram_id = ?'
-                , (int(withdrawal['amount']), withdrawal['bot_id'],
-                withdrawal['user_id']))
+        async with TenantStore.pool(bot_id).transaction():
+            await HostedWithdrawals.reject(bot_id, wd_id, reason, datetime.
+                now().isoformat(), message.from_user.id)
+            await HostedUsers.credit(bot_id, withdrawal['user_id'],
+                withdrawal['asset_type'], withdrawal['amount'])
         target_user_id = withdrawal['user_id']
         amount_text = f"{withdrawal['amount']} {withdrawal['asset_type']}"
-    conn.commit()
-    conn.close()
     try:
         await bot.send_message(target_user_id,
             f"""❌ تم رفض طلب السحب الخاص بك.
@@ -2412,18 +2077,15 @@ async def admin_reject_withdrawal_reason_process(message: types.Message,
 
 async def admin_tasks_menu_handler(callback: types.CallbackQuery):
     """قائمة إدارة المهام"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     tasks_enabled = await SettingsManager.get_bool_setting('TASKS_ENABLED',
         True)
-    conn = get_db_connection()
-    tasks = conn.cursor().execute('SELECT * FROM tasks WHERE is_active = 1'
-        ).fetchall()
-    conn.close()
+    active_tasks = await Tasks.count_active()
     text = f"""🎯 <b>إدارة المهام</b>
 
 📊 <b>الحالة</b>: {'✅ مفعل' if tasks_enabled else '❌ معطل'}
-📋 <b>المهام النشطة</b>: {len(tasks)}
+📋 <b>المهام النشطة</b>: {active_tasks}
 
 اختر الإجراء:"""
     builder = InlineKeyboardBuilder()
@@ -2440,7 +2102,7 @@ async def admin_tasks_menu_handler(callback: types.CallbackQuery):
 async def admin_add_task_start(callback: types.CallbackQuery, state: FSMContext
     ):
     """بدء إضافة مهمة - البوت الرئيسي"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     await state.set_state(AdminStates.add_task)
     await state.update_data(step='name', bot_type='main')
@@ -2452,13 +2114,9 @@ async def admin_add_task_start(callback: types.CallbackQuery, state: FSMContext
 
 async def admin_list_tasks_handler(callback: types.CallbackQuery):
     """عرض قائمة المهام"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    tasks = cursor.execute(
-        'SELECT * FROM tasks ORDER BY is_active DESC, points DESC').fetchall()
-    conn.close()
+    tasks = await Tasks.all()
     if not tasks:
         await callback.message.edit_text('🎯 <b>لا توجد مهام</b>',
             reply_markup=get_back_button('admin_tasks_menu'), parse_mode=
@@ -2491,40 +2149,29 @@ async def admin_list_tasks_handler(callback: types.CallbackQuery):
 
 async def admin_toggle_task_handler(callback: types.CallbackQuery):
     """تفعيل/تعطيل مهمة"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     task_id = int(callback.data.split('_')[3])
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    task = cursor.execute('SELECT is_active FROM tasks WHERE id = ?', (
-        task_id,)).fetchone()
+    task = await Tasks.get(task_id)
     if task:
-        new_status = 0 if task['is_active'] else 1
-        cursor.execute('UPDATE tasks SET is_active = ? WHERE id = ?', (
-            new_status, task_id))
-        conn.commit()
-    conn.close()
+        await Tasks.set_active(task_id, not task['is_active'])
     await callback.answer('✅ تم التحديث', show_alert=True)
     await admin_list_tasks_handler(callback)
 
 
 async def admin_delete_task_handler(callback: types.CallbackQuery):
     """حذف مهمة"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     task_id = int(callback.data.split('_')[3])
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-    conn.commit()
-    conn.close()
+    await Tasks.delete(task_id)
     await callback.answer('✅ تم الحذف', show_alert=True)
     await admin_list_tasks_handler(callback)
 
 
 async def admin_toggle_tasks_handler(callback: types.CallbackQuery):
     """تفعيل/تعطيل نظام المهام"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     current = await SettingsManager.get_bool_setting('TASKS_ENABLED', True)
     new_value = not current
@@ -2538,7 +2185,7 @@ async def admin_toggle_tasks_handler(callback: types.CallbackQuery):
 
 async def admin_ban_ip_start(callback: types.CallbackQuery, state: FSMContext):
     """بدء حظر IP"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     await state.set_state(AdminStates.ban_ip)
     await callback.message.edit_text('🚫 <b>حظر IP</b>\n\nأدخل عنوان IP للحظر:',
@@ -2583,7 +2230,7 @@ async def admin_ban_ip_duration(message: types.Message, state: FSMContext):
 async def admin_unban_ip_start(callback: types.CallbackQuery, state: FSMContext
     ):
     """بدء فك حظر IP"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     banned_ips = await SmartIPBan.get_banned_ips()
     if not banned_ips:
@@ -2616,20 +2263,9 @@ async def admin_unban_ip_process(message: types.Message, state: FSMContext):
 
 async def admin_all_bots_handler(callback: types.CallbackQuery):
     """عرض جميع البوتات المستضافة"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    bots = cursor.execute(
-        """
-        SELECT hb.*, u.username as owner_username, u.full_name as owner_name
-        FROM hosted_bots hb
-        JOIN users u ON hb.owner_id = u.telegram_id
-        ORDER BY hb.created_at DESC
-        LIMIT 10
-    """
-        ).fetchall()
-    conn.close()
+    bots = await HostedBots.latest(10, analytics)
     if not bots:
         await callback.message.edit_text('🤖 <b>لا توجد بوتات مستضافة</b>',
             reply_markup=get_back_button('admin_panel'), parse_mode=
@@ -2656,13 +2292,15 @@ async def admin_all_bots_handler(callback: types.CallbackQuery):
 
 async def admin_all_settings_handler(callback: types.CallbackQuery):
     """عرض جميع الإعدادات"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     settings = await SettingsManager.get_all_settings()
     text = '⚙️ <b>جميع الإعدادات</b>:\n\n'
     categories = {'🔧 الحماية': ['IP_BAN_ENABLED', 'MAX_USERS_PER_IP',
         'BAN_DURATION_HOURS', 'MAX_ATTEMPTS_PER_HOUR',
-        'SECRET_LINK_EXPIRY_MINUTES', 'BLOCK_DUPLICATE_DEVICES',
+        'MAX_USERS_PER_SUBNET24', 'MAX_USERS_PER_SUBNET16',
+        'MAX_USERS_PER_SUBNET64', 'MAX_BANS_PER_SUBNET',
+        'SECRET_LINK_EXPIRY_MINUTES', 'REQUIRE_WEBAPP_AUTH', 'BLOCK_DUPLICATE_DEVICES', 'DEVICE_SIMILARITY_PERCENT',
         'VPN_DETECTION_ENABLED'], '💰 النقاط': ['REFERRAL_REWARD',
         'DAILY_BONUS_BASE', 'DAILY_BONUS_STREAK', 'DAILY_BONUS_WEEKLY',
         'WELCOME_BONUS'], '💸 السحب': ['MIN_WITHDRAWAL_TON',
@@ -2692,7 +2330,7 @@ async def admin_all_settings_handler(callback: types.CallbackQuery):
 async def admin_add_points_start(callback: types.CallbackQuery, state:
     FSMContext):
     """بدء إضافة نقاط"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     await state.set_state(AdminStates.add_points)
     await state.update_data(step='user_id')
@@ -2710,11 +2348,7 @@ async def admin_add_points_process(message: types.Message, state:
     if step == 'user_id':
         try:
             user_id = int(message.text.strip())
-            conn = get_db_connection()
-            user = conn.cursor().execute(
-                'SELECT * FROM users WHERE telegram_id = ?', (user_id,)
-                ).fetchone()
-            conn.close()
+            user = await Users.balance(user_id)
             if not user:
                 await message.answer('❌ المستخدم غير موجود')
                 return
@@ -2771,7 +2405,7 @@ async def admin_add_points_process(message: types.Message, state:
 async def admin_subtract_points_start(callback: types.CallbackQuery, state:
     FSMContext):
     """بدء خصم نقاط"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     await state.set_state(AdminStates.subtract_points)
     await state.update_data(step='user_id')
@@ -2789,11 +2423,7 @@ async def admin_subtract_points_process(message: types.Message, state:
     if step == 'user_id':
         try:
             user_id = int(message.text.strip())
-            conn = get_db_connection()
-            user = conn.cursor().execute(
-                'SELECT * FROM users WHERE telegram_id = ?', (user_id,)
-                ).fetchone()
-            conn.close()
+            user = await Users.balance(user_id)
             if not user:
                 await message.answer('❌ المستخدم غير موجود')
                 return
@@ -2858,42 +2488,28 @@ async def admin_subtract_points_process(message: types.Message, state:
 
 async def admin_ban_user_handler(callback: types.CallbackQuery):
     """حظر مستخدم"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     user_id = int(callback.data.split('_')[3])
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_banned = 1 WHERE telegram_id = ?',
-        (user_id,))
-    conn.commit()
-    conn.close()
+    await Users.set_banned(user_id, True)
+    Reminders.cancel(0, user_id)
     await callback.answer('✅ تم حظر المستخدم', show_alert=True)
 
 
 async def admin_unban_user_handler(callback: types.CallbackQuery):
     """فك حظر مستخدم"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     user_id = int(callback.data.split('_')[3])
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_banned = 0 WHERE telegram_id = ?',
-        (user_id,))
-    conn.commit()
-    conn.close()
+    await Users.set_banned(user_id, False)
     await callback.answer('✅ تم فك حظر المستخدم', show_alert=True)
 
 
 async def admin_banned_users_handler(callback: types.CallbackQuery):
     """عرض المستخدمين المحظورين"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    banned_users = cursor.execute(
-        'SELECT * FROM users WHERE is_banned = 1 ORDER BY registration_date DESC LIMIT 20'
-        ).fetchall()
-    conn.close()
+    banned_users = await Users.banned(20)
     if not banned_users:
         await callback.message.edit_text('✅ <b>لا يوجد مستخدمين محظورين</b>',
             reply_markup=get_back_button('admin_users_menu'), parse_mode=
@@ -2916,7 +2532,7 @@ async def admin_banned_users_handler(callback: types.CallbackQuery):
 
 async def admin_toggle_conversion_handler(callback: types.CallbackQuery):
     """تفعيل/تعطيل التحويل"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     current = await SettingsManager.get_bool_setting('CONVERSION_ENABLED', True
         )
@@ -2931,7 +2547,7 @@ async def admin_toggle_conversion_handler(callback: types.CallbackQuery):
 async def admin_set_conversion_ton_start(callback: types.CallbackQuery,
     state: FSMContext):
     """تغيير سعر تحويل TON"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     current = await SettingsManager.get_int_setting('CONVERSION_POINTS_TON',
         1000)
@@ -2972,7 +2588,7 @@ async def admin_set_conversion_ton_process(message: types.Message, state:
 async def admin_set_conversion_stars_start(callback: types.CallbackQuery,
     state: FSMContext):
     """تغيير سعر تحويل Stars"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     current = await SettingsManager.get_int_setting('CONVERSION_POINTS_STARS',
         150)
@@ -3015,7 +2631,7 @@ async def admin_set_conversion_stars_process(message: types.Message, state:
 async def admin_set_plan_value_start(callback: types.CallbackQuery, state:
     FSMContext):
     """بدء تغيير قيمة باقة"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
     setting_map = {'admin_set_free_max': ('FREE_PLAN_MAX_USERS',
         'حد المستخدمين للباقة المجانية', SettingsStates.set_free_max_users),
@@ -3095,7 +2711,7 @@ async def bot_dashboard_handler(callback: types.CallbackQuery):
 
 async def admin_withdrawal_types_handler(callback: types.CallbackQuery):
     """إعدادات السحب - البوت الرئيسي"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
 
     ton_enabled = await SettingsManager.get_bool_setting('WITHDRAWAL_TON_ENABLED', True)
@@ -3122,7 +2738,7 @@ async def admin_withdrawal_types_handler(callback: types.CallbackQuery):
 
 async def admin_toggle_wd_type_handler(callback: types.CallbackQuery):
     """تبديل حالة نوع السحب"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
 
     wd_type = callback.data.split('_')[3] # TON or STARS
@@ -3136,7 +2752,7 @@ async def admin_toggle_wd_type_handler(callback: types.CallbackQuery):
 
 async def admin_hosting_button_toggle_handler(callback: types.CallbackQuery):
     """تبديل حالة زر استضافة البوت"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
 
     current = await SettingsManager.get_bool_setting('HOSTING_BUTTON_ENABLED', True)
@@ -3148,7 +2764,7 @@ async def admin_hosting_button_toggle_handler(callback: types.CallbackQuery):
 
 async def admin_mandatory_sub_menu_handler(callback: types.CallbackQuery):
     """إدارة الاشتراك الإجباري - البوت الرئيسي"""
-    if not is_admin(callback.from_user.id):
+    if not await is_admin(callback.from_user.id):
         return await callback.answer('⛔️ غير مصرح', show_alert=True)
 
     channels_json = await SettingsManager.get_setting('MANDATORY_CHANNELS', '[]')
@@ -3173,13 +2789,13 @@ async def admin_mandatory_sub_menu_handler(callback: types.CallbackQuery):
     await callback.answer()
 
 async def admin_add_mandatory_channel_start(callback: types.CallbackQuery, state: FSMContext):
-    if not is_admin(callback.from_user.id): return
+    if not await is_admin(callback.from_user.id): return
     await state.set_state(AdminStates.add_mandatory_channel)
     await callback.message.edit_text("أرسل يوزر القناة مع @ (مثال: @channel):", reply_markup=get_cancel_button('admin_mandatory_sub_menu'))
     await callback.answer()
 
 async def admin_add_mandatory_channel_process(message: types.Message, state: FSMContext, bot: Bot):
-    if not is_admin(message.from_user.id): return
+    if not await is_admin(message.from_user.id): return
     channel = message.text.strip()
     if not (channel.startswith('@') or channel.startswith('-100')):
         return await message.answer("❌ يجب أن يبدأ اليوزر بـ @ أو معرف المجموعة بـ -100")
@@ -3208,7 +2824,7 @@ async def admin_add_mandatory_channel_process(message: types.Message, state: FSM
     await state.clear()
 
 async def admin_remove_mandatory_channel_menu(callback: types.CallbackQuery):
-    if not is_admin(callback.from_user.id): return
+    if not await is_admin(callback.from_user.id): return
     channels_json = await SettingsManager.get_setting('MANDATORY_CHANNELS', '[]')
     channels = json.loads(channels_json)
 
@@ -3221,7 +2837,7 @@ async def admin_remove_mandatory_channel_menu(callback: types.CallbackQuery):
     await callback.message.edit_text("اختر القناة لحذفها:", reply_markup=builder.as_markup())
 
 async def admin_remove_mandatory_channel_process(callback: types.CallbackQuery):
-    if not is_admin(callback.from_user.id): return
+    if not await is_admin(callback.from_user.id): return
     channel_to_rm = callback.data.replace('admin_rm_ch_', '')
 
     channels_json = await SettingsManager.get_setting('MANDATORY_CHANNELS', '[]')
@@ -0,0 +1,128 @@
+"""Background cleanup of the security tables.
+
+Every ``JANITOR_INTERVAL_MINUTES`` the janitor deletes expired IP bans,
+``ip_attempts`` older than ``IP_ATTEMPTS_RETENTION_HOURS``, expired secret links
+(used links expire a few minutes after issue, so they go with them) and older
+copies of a device fingerprint the same user has re-submitted. Each table is
+cleared ``JANITOR_CHUNK`` rows per write so verification requests interleave
+with the cleanup, and freed pages are returned with ``PRAGMA
+incremental_vacuum`` when the database uses incremental auto-vacuum.
+
+New databases are created with ``auto_vacuum = INCREMENTAL``. An existing file
+can be converted once, offline, with ``python -m bot.janitor --enable-incremental-vacuum``;
+``python -m bot.janitor`` alone runs a single pass.
+"""
+import argparse
+import asyncio
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict
+from .config import logger, DATABASE_PATH, JANITOR_INTERVAL_MINUTES, JANITOR_CHUNK, JANITOR_VACUUM_PAGES, IP_ATTEMPTS_RETENTION_HOURS
+from .database import db
+from .ipguard import IPGuard
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class Janitor:
+    # Highest device_fingerprints id already checked for older copies.
+    fingerprint_mark = 0
+
+    @staticmethod
+    async def _purge(sql: str, params: tuple, chunk: int) -> int:
+        """Run a ``... LIMIT ?`` delete one chunk per write until it removes fewer than ``chunk`` rows."""
+        total = 0
+        while True:
+            cur = await db.execute(sql, (*params, chunk))
+            total += cur.rowcount
+            if cur.rowcount < chunk:
+                return total
+            await asyncio.sleep(0)
+
+    @staticmethod
+    async def _dedupe_fingerprints(chunk: int) -> int:
+        top = await db.fetchval("SELECT MAX(id) FROM device_fingerprints", default=0)
+        total, low = 0, min(Janitor.fingerprint_mark, top)
+        while low < top:
+            cur = await db.execute(
+                "DELETE FROM device_fingerprints WHERE id IN (SELECT o.id FROM device_fingerprints n JOIN device_fingerprints o ON o.fingerprint_hash = n.fingerprint_hash AND o.user_id = n.user_id AND o.id < n.id WHERE n.id > ? AND n.id <= ?)",
+                (low, low + chunk))
+            total += cur.rowcount
+            low += chunk
+            await asyncio.sleep(0)
+        Janitor.fingerprint_mark = top
+        return total
+
+    @staticmethod
+    async def vacuum(pages: int = JANITOR_VACUUM_PAGES) -> int:
+        """Release up to ``pages`` free pages to the filesystem; 0 unless auto-vacuum is incremental."""
+        if await db.fetchval("PRAGMA auto_vacuum") != AUTO_VACUUM_INCREMENTAL:
+            return 0
+        return await asyncio.to_thread(_incremental_vacuum, db.path, pages)
+
+    @staticmethod
+    async def run_once(chunk: int = JANITOR_CHUNK, retention_hours: int = IP_ATTEMPTS_RETENTION_HOURS) -> Dict[str, int]:
+        now = datetime.now().isoformat()
+        removed = {
+            'banned_ips': await Janitor._purge("DELETE FROM banned_ips WHERE id IN (SELECT id FROM banned_ips WHERE expires_at < ? LIMIT ?)", (now,), chunk),
+            'ip_attempts': await Janitor._purge("DELETE FROM ip_attempts WHERE id IN (SELECT id FROM ip_attempts WHERE timestamp < datetime('now', ?) LIMIT ?)", (f'-{int(retention_hours)} hours',), chunk),
+            'secret_links': await Janitor._purge("DELETE FROM secret_links WHERE id IN (SELECT id FROM secret_links WHERE expires_at < ? LIMIT ?)", (now,), chunk),
+            'device_fingerprints': await Janitor._dedupe_fingerprints(chunk),
+        }
+        removed['idle_ip_windows'] = IPGuard.prune()
+        removed['vacuumed_pages'] = await Janitor.vacuum()
+        return removed
+
+    @staticmethod
+    async def run(interval_minutes=JANITOR_INTERVAL_MINUTES):
+        while True:
+            start = time.perf_counter()
+            try:
+                removed = await Janitor.run_once()
+                logger.info(f"Janitor removed {removed} in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                logger.error(f"Janitor failed: {e}")
+            await asyncio.sleep(interval_minutes * 60)
+
+
+def _incremental_vacuum(path: str, pages: int) -> int:
+    # The pragma frees one page per step and the sqlite3 cursor API steps it only
+    # once, so it goes through executescript on a short-lived connection instead
+    # of the pool's writer; busy_timeout makes it queue behind a running batch.
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout = 5000")
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def enable_incremental_vacuum(path: str = DATABASE_PATH) -> bool:
+    """Switch an existing file to incremental auto-vacuum (rewrites the file; stop the bot first)."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="python -m bot.janitor", description="Prune expired security rows")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="convert the database file once (stop the bot first)")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        print("auto_vacuum set to INCREMENTAL" if enable_incremental_vacuum() else "auto_vacuum already INCREMENTAL")
+    else:
+        async def _once():
+            start = time.perf_counter()
+            removed = await Janitor.run_once()
+            await db.close()
+            print(f"removed {removed} in {time.perf_counter() - start:.2f}s")
+        asyncio.run(_once())
@@ -0,0 +1,219 @@
+"""Top earners and top referrers, for the main bot (scope 0) and each hosted bot.
+
+A board keeps the ``LEADERBOARD_SIZE`` best (score, user) pairs of one scope
+and metric in a sorted list, so showing it never sorts the users table. It is
+built from SQLite the first time it is viewed, reading the top rows and an
+evenly spaced sample of every score straight off the ``(is_banned, score)``
+indexes inside one read-only snapshot, and rebuilt every
+``LEADERBOARD_REBUILD_MINUTES`` while it is being viewed. Between rebuilds the
+write paths that raise ``total_earned_points`` or ``total_referrals`` pass the
+new value to ``record`` once their batch has committed; both columns only
+grow, so a user can only enter the top by pushing the last one out.
+
+A rank inside the board is exact. Below it, the rank is estimated from the
+sample: every ``step``-th score, so ``LEADERBOARD_SAMPLES`` values per board
+whatever the number of users, and the estimate is off by at most one step
+plus the movement since the last rebuild.
+"""
+import asyncio
+import html
+import time
+from array import array
+from bisect import bisect_left, insort
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from .config import logger, LEADERBOARD_SIZE, LEADERBOARD_SAMPLES, LEADERBOARD_REBUILD_MINUTES
+from .database import analytics
+from .tenants import TenantStore
+
+METRICS = ('earned', 'referrals')
+COLUMNS = {'earned': 'total_earned_points', 'referrals': 'total_referrals'}
+TITLES = {'earned': '💰 أكثر النقاط المكتسبة', 'referrals': '👥 أكثر الإحالات'}
+MEDALS = ('🥇', '🥈', '🥉')
+SHOWN = 10
+
+# (hosted, metric) -> top rows, score sample, number of ranked users.
+_TOP = {
+    (False, 'earned'): 'SELECT telegram_id, full_name, total_earned_points FROM users WHERE is_banned = 0 ORDER BY total_earned_points DESC LIMIT ?',
+    (False, 'referrals'): 'SELECT telegram_id, full_name, total_referrals FROM users WHERE is_banned = 0 ORDER BY total_referrals DESC LIMIT ?',
+    (True, 'earned'): 'SELECT user_telegram_id, full_name, total_earned_points FROM hosted_bot_users WHERE bot_id = ? AND is_banned = 0 ORDER BY total_earned_points DESC LIMIT ?',
+    (True, 'referrals'): 'SELECT user_telegram_id, full_name, total_referrals FROM hosted_bot_users WHERE bot_id = ? AND is_banned = 0 ORDER BY total_referrals DESC LIMIT ?',
+}
+_SAMPLE = {
+    (False, 'earned'): 'SELECT v FROM (SELECT total_earned_points AS v, ROW_NUMBER() OVER (ORDER BY total_earned_points DESC) AS n FROM users WHERE is_banned = 0) WHERE n % ? = 1',
+    (False, 'referrals'): 'SELECT v FROM (SELECT total_referrals AS v, ROW_NUMBER() OVER (ORDER BY total_referrals DESC) AS n FROM users WHERE is_banned = 0) WHERE n % ? = 1',
+    (True, 'earned'): 'SELECT v FROM (SELECT total_earned_points AS v, ROW_NUMBER() OVER (ORDER BY total_earned_points DESC) AS n FROM hosted_bot_users WHERE bot_id = ? AND is_banned = 0) WHERE n % ? = 1',
+    (True, 'referrals'): 'SELECT v FROM (SELECT total_referrals AS v, ROW_NUMBER() OVER (ORDER BY total_referrals DESC) AS n FROM hosted_bot_users WHERE bot_id = ? AND is_banned = 0) WHERE n % ? = 1',
+}
+_COUNT = {
+    False: 'SELECT COUNT(*) FROM users WHERE is_banned = 0',
+    True: 'SELECT COUNT(*) FROM hosted_bot_users WHERE bot_id = ? AND is_banned = 0',
+}
+
+
+class Board:
+    """Best ``size`` scores of one scope and metric, plus a sample of all scores for rank estimates."""
+    __slots__ = ('size', 'order', 'scores', 'names', 'sample', 'step', 'total', 'built_at')
+
+    def __init__(self, size: int):
+        self.size = size
+        # (-score, user_id) ascending, i.e. best first.
+        self.order: List[Tuple[int, int]] = []
+        self.scores: Dict[int, int] = {}
+        self.names: Dict[int, Optional[str]] = {}
+        # Every step-th score of the last rebuild, negated so it ascends.
+        self.sample = array('q')
+        self.step = 1
+        self.total = 0
+        self.built_at = 0.0
+
+    def record(self, user_id: int, score: int):
+        old = self.scores.get(user_id)
+        if old is not None:
+            if old == score:
+                return
+            del self.order[bisect_left(self.order, (-old, user_id))]
+        elif len(self.order) >= self.size and (-score, user_id) >= self.order[-1]:
+            return
+        insort(self.order, (-score, user_id))
+        self.scores[user_id] = score
+        if len(self.order) > self.size:
+            _, dropped = self.order.pop()
+            del self.scores[dropped]
+            self.names.pop(dropped, None)
+
+    def forget(self, user_id: int):
+        score = self.scores.pop(user_id, None)
+        if score is not None:
+            del self.order[bisect_left(self.order, (-score, user_id))]
+            self.names.pop(user_id, None)
+
+    def top(self, n: int) -> List[Tuple[int, int]]:
+        """(user_id, score) of the best ``n``."""
+        return [(user_id, -neg) for neg, user_id in self.order[:n]]
+
+    def rank(self, user_id: int, score: int) -> Tuple[int, bool]:
+        """1-based rank of ``user_id`` with ``score`` and whether it is exact."""
+        if user_id in self.scores:
+            return bisect_left(self.order, (-self.scores[user_id], user_id)) + 1, True
+        above = bisect_left(self.sample, -score) * self.step
+        return max(len(self.order) + 1, above + 1), False
+
+
+class Leaderboards:
+    boards: Dict[Tuple[int, str], Board] = {}
+    # Scope -> monotonic time it was last viewed.
+    viewed: Dict[int, float] = {}
+    # Scores recorded while a board is being rebuilt, replayed onto the new board.
+    _pending: Dict[Tuple[int, str], List[Tuple[int, int]]] = {}
+    _locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+    stats = {'rebuilds': 0, 'records': 0}
+
+    @staticmethod
+    async def rebuild(scope: int, metric: str, size: int = LEADERBOARD_SIZE, samples: int = LEADERBOARD_SAMPLES) -> Board:
+        key, hosted = (scope, metric), scope != 0
+        pool = TenantStore.analytics(scope) if hosted else analytics
+        args = (scope,) if hosted else ()
+        Leaderboards._pending[key] = []
+        try:
+            async with pool.snapshot():
+                total = await pool.fetchval(_COUNT[hosted], args, 0)
+                step = max(1, -(-total // max(1, samples)))
+                top = await pool.fetchall(_TOP[hosted, metric], args + (size,))
+                sample = await pool.fetchall(_SAMPLE[hosted, metric], args + (step,))
+            board = Board(size)
+            for user_id, name, score in top:
+                board.record(user_id, score or 0)
+                board.names[user_id] = name
+            board.sample = array('q', (-(r[0] or 0) for r in sample))
+            board.step, board.total, board.built_at = step, total, time.monotonic()
+            for user_id, score in Leaderboards._pending[key]:
+                board.record(user_id, score)
+        finally:
+            Leaderboards._pending.pop(key, None)
+        Leaderboards.boards[key] = board
+        Leaderboards.stats['rebuilds'] += 1
+        return board
+
+    @staticmethod
+    async def board(scope: int, metric: str) -> Board:
+        """The board, built on first use."""
+        Leaderboards.viewed[scope] = time.monotonic()
+        key = (scope, metric)
+        board = Leaderboards.boards.get(key)
+        if board is not None:
+            return board
+        lock = Leaderboards._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            board = Leaderboards.boards.get(key)
+            return board if board is not None else await Leaderboards.rebuild(scope, metric)
+
+    @staticmethod
+    def record(scope: int, metric: str, user_id: int, score: int, pool=None):
+        """Report ``user_id``'s new total; with ``pool``, applied once its current write batch commits."""
+        if pool is not None:
+            pool.after_commit(lambda: Leaderboards.record(scope, metric, user_id, score))
+            return
+        key = (scope, metric)
+        pending = Leaderboards._pending.get(key)
+        if pending is not None:
+            pending.append((user_id, score))
+        board = Leaderboards.boards.get(key)
+        if board is not None:
+            board.record(user_id, score)
+            Leaderboards.stats['records'] += 1
+
+    @staticmethod
+    def forget(scope: int, user_id: int):
+        """Take a banned user off the scope's boards."""
+        for metric in METRICS:
+            board = Leaderboards.boards.get((scope, metric))
+            if board is not None:
+                board.forget(user_id)
+
+    @staticmethod
+    def drop_scope(scope: int):
+        for metric in METRICS:
+            Leaderboards.boards.pop((scope, metric), None)
+        Leaderboards.viewed.pop(scope, None)
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        return {**Leaderboards.stats, 'boards': len(Leaderboards.boards), 'scopes': len(Leaderboards.viewed)}
+
+    @staticmethod
+    async def run(interval_minutes: float = LEADERBOARD_REBUILD_MINUTES):
+        """Rebuild the boards viewed recently; drop those nobody opened for four intervals."""
+        interval = interval_minutes * 60
+        while True:
+            await asyncio.sleep(interval)
+            now, start = time.monotonic(), time.perf_counter()
+            for scope, metric in list(Leaderboards.boards):
+                if now - Leaderboards.viewed.get(scope, 0) > 4 * interval:
+                    Leaderboards.drop_scope(scope)
+                    continue
+                try:
+                    await Leaderboards.rebuild(scope, metric)
+                except Exception as e:
+                    logger.error(f"Leaderboard rebuild failed for scope {scope} ({metric}): {e}")
+            if Leaderboards.boards:
+                logger.info(f"Leaderboards rebuilt: {len(Leaderboards.boards)} boards in {time.perf_counter() - start:.2f}s")
+
+
+async def board_text(scope: int, metric: str, user_id: int, user, name_of: Callable[[int], Awaitable]) -> str:
+    """Leaderboard screen: the best ``SHOWN`` users and the viewer's rank (``user`` is their row, if any)."""
+    board = await Leaderboards.board(scope, metric)
+    lines = [f"🏆 <b>المتصدرون - {TITLES[metric]}</b>\n"]
+    top = board.top(SHOWN)
+    for i, (uid, score) in enumerate(top):
+        if uid not in board.names:
+            row = await name_of(uid)
+            board.names[uid] = row['full_name'] if row else None
+        place = MEDALS[i] if i < len(MEDALS) else f"{i + 1}."
+        lines.append(f"{place} {html.escape(board.names[uid] or 'مستخدم')} — <code>{score}</code>")
+    if not top:
+        lines.append("لا يوجد مستخدمون بعد.")
+    if user is not None:
+        score = user[COLUMNS[metric]]
+        rank, exact = board.rank(user_id, score)
+        lines.append(f"\n📍 ترتيبك: <b>#{rank}</b>{'' if exact else ' (تقريبي)'} من {max(board.total, rank)} • رصيدك: <code>{score}</code>")
+    return "\n".join(lines)
@@ -0,0 +1,122 @@
+"""Month-partitioned points ledger.
+
+``points_history`` and ``hosted_bot_points_history`` keep only the last
+``LEDGER_LIVE_MONTHS`` months. Older rows are moved, a chunk at a time, into
+per-month archive tables (``points_history_202601``...) registered in
+``ledger_partitions``, and each moved row is folded into a per-user monthly
+snapshot in ``ledger_snapshots``. History and balance audits read the live
+table plus snapshots and only open an archive partition when asked for rows
+that are no longer live.
+
+Partitions and snapshots live in the same file as the live rows they came
+from: the main database for the main bot (and for hosted bots in ``shared``
+mode), each tenant's own file with ``HOSTED_DB_MODE=tenant``.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, List
+from .config import logger, LEDGER_LIVE_MONTHS, LEDGER_ARCHIVE_CHUNK, HOSTED_DB_MODE
+from .database import db, fetch_all
+from .repository import HostedBots
+from .tenants import TenantStore
+
+# Live ledger table -> whether rows carry a bot_id (hosted bots) or belong to the main bot (bot_id 0).
+SOURCES = {'points_history': False, 'hosted_bot_points_history': True}
+
+
+def partition_name(source: str, month: str) -> str:
+    return f"{source}_{month.replace('-', '')}"
+
+
+def live_cutoff(now=None, live_months=LEDGER_LIVE_MONTHS) -> str:
+    """First instant that is still live, as a 'YYYY-MM-01' string."""
+    now = now or datetime.utcnow()
+    total = now.year * 12 + now.month - 1 - max(1, live_months) + 1
+    return f"{total // 12:04d}-{total % 12 + 1:02d}-01"
+
+
+class Ledger:
+    @staticmethod
+    async def _move_chunk(conn, source: str, cutoff: str, chunk: int) -> int:
+        hosted = SOURCES[source]
+        rows = await fetch_all(conn, f"SELECT * FROM {source} WHERE created_at < ? ORDER BY created_at, id LIMIT ?", (cutoff, chunk))
+        if not rows:
+            return 0
+        by_month: Dict[str, List] = {}
+        snaps: Dict[tuple, List[int]] = {}
+        for r in rows:
+            month = str(r['created_at'])[:7]
+            by_month.setdefault(month, []).append(tuple(r))
+            s = snaps.setdefault((r['bot_id'] if hosted else 0, r['user_id'], month), [0, 0, 0])
+            s[0 if r['points'] >= 0 else 1] += r['points']
+            s[2] += 1
+        cols = rows[0].keys()
+        for month, items in by_month.items():
+            table = partition_name(source, month)
+            await conn.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM {source} WHERE 0")
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table}({'bot_id, ' if hosted else ''}user_id, created_at)")
+            await conn.executemany(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", items)
+            await conn.execute("INSERT INTO ledger_partitions (table_name, source, month, rows) VALUES (?, ?, ?, ?) ON CONFLICT(table_name) DO UPDATE SET rows = rows + excluded.rows, archived_at = CURRENT_TIMESTAMP", (table, source, month, len(items)))
+        await conn.executemany(
+            "INSERT INTO ledger_snapshots (bot_id, user_id, month, earned, spent, entries) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(bot_id, user_id, month) DO UPDATE SET earned = earned + excluded.earned, spent = spent + excluded.spent, entries = entries + excluded.entries",
+            [(b, u, m, e, s, n) for (b, u, m), (e, s, n) in snaps.items()])
+        await conn.executemany(f"DELETE FROM {source} WHERE id = ?", [(r['id'],) for r in rows])
+        return len(rows)
+
+    @staticmethod
+    async def archive_cold_months(live_months=LEDGER_LIVE_MONTHS, chunk=LEDGER_ARCHIVE_CHUNK) -> Dict[str, int]:
+        """Move every row older than the live window into its month partition.
+
+        Each chunk is its own short write, so regular writes interleave with the
+        archiver instead of waiting behind one long transaction.
+        """
+        cutoff, moved = live_cutoff(live_months=live_months), {}
+        for source, hosted in SOURCES.items():
+            pools = [TenantStore.pool(bot_id) for bot_id in await HostedBots.ids()] if hosted and HOSTED_DB_MODE == 'tenant' else [db]
+            total = 0
+            for pool in pools:
+                while True:
+                    n = await pool.write(lambda conn, s=source: Ledger._move_chunk(conn, s, cutoff, chunk))
+                    total += n
+                    if n < chunk:
+                        break
+                    await asyncio.sleep(0)
+            moved[source] = total
+        return moved
+
+    @staticmethod
+    async def run_archiver(interval_hours=24):
+        while True:
+            try:
+                moved = await Ledger.archive_cold_months()
+                if any(moved.values()): logger.info(f"Ledger archiver moved {moved}")
+            except Exception as e:
+                logger.error(f"Ledger archiver failed: {e}")
+            await asyncio.sleep(interval_hours * 3600)
+
+    @staticmethod
+    async def get_history(user_id: int, limit: int = 20, bot_id: int = 0):
+        """Newest-first entries, reaching into archive partitions only if the live table runs short."""
+        source = 'hosted_bot_points_history' if bot_id else 'points_history'
+        where, params = ("bot_id = ? AND user_id = ?", (bot_id, user_id)) if bot_id else ("user_id = ?", (user_id,))
+        pool = TenantStore.pool(bot_id) if bot_id else db
+        rows = list(await pool.fetchall(f"SELECT * FROM {source} WHERE {where} ORDER BY created_at DESC LIMIT ?", (*params, limit)))
+        if len(rows) < limit:
+            months = await pool.fetchall("SELECT month FROM ledger_snapshots WHERE bot_id = ? AND user_id = ? ORDER BY month DESC", (bot_id, user_id))
+            for m in months:
+                rows += await pool.fetchall(f"SELECT * FROM {partition_name(source, m['month'])} WHERE {where} ORDER BY created_at DESC LIMIT ?", (*params, limit - len(rows)))
+                if len(rows) >= limit:
+                    break
+        return rows
+
+    @staticmethod
+    async def audit(user_id: int, bot_id: int = 0) -> Dict[str, int]:
+        """Ledger totals for one user from snapshots plus live rows; never opens an archive."""
+        source = 'hosted_bot_points_history' if bot_id else 'points_history'
+        where, params = ("bot_id = ? AND user_id = ?", (bot_id, user_id)) if bot_id else ("user_id = ?", (user_id,))
+        pool = TenantStore.pool(bot_id) if bot_id else db
+        snap = await pool.fetchone("SELECT IFNULL(SUM(earned), 0) AS earned, IFNULL(SUM(spent), 0) AS spent, IFNULL(SUM(entries), 0) AS entries FROM ledger_snapshots WHERE bot_id = ? AND user_id = ?", (bot_id, user_id))
+        live = await pool.fetchone(f"SELECT IFNULL(SUM(CASE WHEN points >= 0 THEN points END), 0) AS earned, IFNULL(SUM(CASE WHEN points < 0 THEN points END), 0) AS spent, COUNT(*) AS entries FROM {source} WHERE {where}", params)
+        earned, spent = snap['earned'] + live['earned'], snap['spent'] + live['spent']
+        return {'earned': earned, 'spent': spent, 'net': earned + spent, 'entries': snap['entries'] + live['entries']}
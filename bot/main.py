@@ -1,24 +1,42 @@
+import time
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram import F
 from aiogram.filters import CommandStart, Command, StateFilter
 from .config import BOT_TOKEN, ADMIN_ID, logger
-from .database import setup_database, SettingsManager, get_db_connection
+from .database import setup_database, SettingsManager, SystemCounters, db, analytics
 from .hosting import HostedBotSystem
+from .ledger import Ledger
+from .tenants import TenantStore
+from .janitor import Janitor
+from .ipguard import IPGuard
+from .devices import DeviceIndex
+from .backup import Backups
+from .leaderboard import Leaderboards
+from .reminders import Reminders
+from .webhooks import Webhooks
+from .sessions import Sessions, new_bot
 from .web_server import start_verification_server
 from .states import *
 from .handlers import *
-from .middlewares import MandatorySubMiddleware
+from .middlewares import FirstUpdateMiddleware, MandatorySubMiddleware, UserLoaderMiddleware
 
 
 async def main():
+    started = time.monotonic()
     setup_database()
+    await db.open()
     await SettingsManager.init_settings()
-    bot, dp = Bot(token=BOT_TOKEN), Dispatcher(storage=MemoryStorage())
+    await IPGuard.load((await SettingsManager.get_protection_config())['MAX_ATTEMPTS_PER_HOUR'])
+    await DeviceIndex.load()
+    bot, dp = new_bot(BOT_TOKEN), Dispatcher(storage=MemoryStorage())
 
     # Register Middleware
+    dp.update.outer_middleware(FirstUpdateMiddleware(started))
+    dp.message.outer_middleware(UserLoaderMiddleware())
+    dp.callback_query.outer_middleware(UserLoaderMiddleware())
     dp.message.middleware(MandatorySubMiddleware())
     dp.callback_query.middleware(MandatorySubMiddleware())
 
@@ -44,6 +62,8 @@ async def main():
     dp.callback_query.register(add_new_bot_handler, F.data == 'add_new_bot')
     dp.message.register(process_bot_token, BotHostingStates.enter_token)
     dp.callback_query.register(dashboard_handler, F.data == 'dashboard')
+    dp.callback_query.register(toggle_reminders_handler, F.data ==
+        'toggle_reminders')
     dp.callback_query.register(referral_link_handler, F.data == 'referral_link'
         )
     dp.callback_query.register(daily_bonus_handler, F.data == 'daily_bonus')
@@ -61,6 +81,8 @@ async def main():
     dp.message.register(process_convert_to_stars, ConversionStates.
         enter_points_for_stars)
     dp.callback_query.register(statistics_handler, F.data == 'statistics')
+    dp.callback_query.register(leaderboard_handler, F.data.in_([
+        'leaderboard', 'leaderboard_referrals']))
     dp.callback_query.register(request_withdrawal_handler, F.data ==
         'request_withdrawal')
     dp.callback_query.register(withdraw_ton_handler, F.data == 'withdraw_ton')
@@ -109,10 +131,14 @@ async def main():
     dp.callback_query.register(admin_security_settings_handler, F.data ==
         'admin_security_settings')
     dp.callback_query.register(admin_toggle_setting_handler, F.data.in_([
-        'admin_toggle_ip_ban', 'admin_toggle_duplicate', 'admin_toggle_vpn']))
+        'admin_toggle_ip_ban', 'admin_toggle_duplicate', 'admin_toggle_vpn',
+        'admin_toggle_webapp_auth']))
     dp.callback_query.register(admin_set_value_start, F.data.in_([
         'admin_set_max_users_ip', 'admin_set_ban_duration',
         'admin_set_max_attempts', 'admin_set_secret_expiry',
+        'admin_set_max_users_subnet24', 'admin_set_max_users_subnet16',
+        'admin_set_max_users_subnet64', 'admin_set_max_bans_subnet',
+        'admin_set_device_similarity',
         'admin_set_referral_reward', 'admin_set_daily_bonus_base',
         'admin_set_daily_bonus_streak', 'admin_set_daily_bonus_weekly',
         'admin_set_welcome_bonus',
@@ -120,6 +146,9 @@ async def main():
     dp.message.register(admin_set_value_process, StateFilter(
         SettingsStates.set_max_users_per_ip, SettingsStates.set_ban_duration,
         SettingsStates.set_max_attempts, SettingsStates.set_secret_expiry,
+        SettingsStates.set_max_users_subnet24, SettingsStates.set_max_users_subnet16,
+        SettingsStates.set_max_users_subnet64, SettingsStates.set_max_bans_subnet,
+        SettingsStates.set_device_similarity,
         SettingsStates.set_referral_reward, SettingsStates.set_daily_bonus_base,
         SettingsStates.set_daily_bonus_streak, SettingsStates.set_daily_bonus_weekly,
         SettingsStates.set_welcome_bonus,
@@ -204,17 +233,29 @@ async def main():
     dp.callback_query.register(cancel_action_handler, F.data.startswith(
         'cancel_action_'))
     asyncio.create_task(start_verification_server())
-    conn = get_db_connection()
-    active_bots = conn.cursor().execute(
-        'SELECT * FROM hosted_bots WHERE is_active = 1').fetchall()
-    conn.close()
-    for bot_data in active_bots:
-        await HostedBotSystem.start_bot(bot_data['id'], bot_data[
-            'bot_token'], bot_data['bot_username'], bot_data['owner_id'])
-        await asyncio.sleep(1)
+    asyncio.create_task(SystemCounters.run_reconciliation())
+    asyncio.create_task(Ledger.run_archiver())
+    asyncio.create_task(TenantStore.run_idle_closer())
+    asyncio.create_task(Janitor.run())
+    asyncio.create_task(Backups.run())
+    asyncio.create_task(Leaderboards.run())
+    asyncio.create_task(Reminders.run(bot))
     me = await bot.get_me()
     print(f'🤖 Bot @{me.username} is running...')
-    await dp.start_polling(bot)
+    # The hosted bots start in the background, so the main bot polls without waiting for them.
+    asyncio.create_task(HostedBotSystem.start_all())
+    asyncio.create_task(HostedBotSystem.run_lifecycle())
+    try:
+        if await Webhooks.attach(0, bot, dp):
+            await asyncio.Event().wait()
+        else:
+            await Webhooks.poll(bot, dp)
+    finally:
+        await Sessions.shutdown()
+        await IPGuard.flush()
+        await TenantStore.close_all()
+        await analytics.close()
+        await db.close()
 
 
 if __name__ == '__main__':
@@ -1,11 +1,93 @@
 import json
-from typing import Callable, Dict, Any, Awaitable
+import time
+from typing import Callable, Dict, Any, Awaitable, Optional, Tuple
 from aiogram import BaseMiddleware, Bot, types
 from aiogram.types import TelegramObject
-from .database import SettingsManager, get_db_connection
-from .config import ADMIN_ID, CHANNEL_USERNAME, logger
+from .database import SettingsManager, db, query_count
+from .repository import Users, HostedUsers
+from .config import ADMIN_ID, CHANNEL_USERNAME, UPDATE_QUERY_WARN, logger
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+
+class HostedContextMiddleware(BaseMiddleware):
+    """Outer middleware on the updates of the shared hosted Dispatcher.
+
+    Puts the hosted bot's ``bot_id`` and ``owner_id`` into ``data`` from
+    ``resolve(bot)``; updates of a bot it does not know are dropped.
+    """
+
+    def __init__(self, resolve: Callable[[Bot], Optional[Tuple[int, int]]]):
+        self.resolve = resolve
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        context = self.resolve(data['bot'])
+        if context is None:
+            return None
+        data['bot_id'], data['owner_id'] = context
+        return await handler(event, data)
+
+
+class FirstUpdateMiddleware(BaseMiddleware):
+    """Logs the cold start: seconds from ``started`` (``time.monotonic()``) to the first update handled."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.seconds: Optional[float] = None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if self.seconds is None:
+            self.seconds = time.monotonic() - self.started
+            logger.info(f"Cold start: first update {self.seconds:.2f}s after launch")
+        return await handler(event, data)
+
+
+class UserLoaderMiddleware(BaseMiddleware):
+    """Outer middleware: loads the sender's row (main or hosted) once into ``data['user']``.
+
+    Handlers declare a ``user`` argument instead of querying it again. The pool
+    calls made while handling the update are counted and logged, as a warning
+    above ``UPDATE_QUERY_WARN``.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = getattr(event, 'from_user', None)
+        if from_user is None:
+            return await handler(event, data)
+        queries = [0]
+        token = query_count.set(queries)
+        start = time.perf_counter()
+        try:
+            if 'bot_id' in data:
+                data['user'] = await HostedUsers.get(data['bot_id'], from_user.id)
+            else:
+                data['user'] = await Users.get(from_user.id)
+            return await handler(event, data)
+        finally:
+            query_count.reset(token)
+            elapsed = (time.perf_counter() - start) * 1000
+            where = f"bot {data['bot_id']}" if 'bot_id' in data else 'main'
+            message = f"{type(event).__name__} from {from_user.id} ({where}): {queries[0]} queries, {elapsed:.1f} ms"
+            if queries[0] > UPDATE_QUERY_WARN:
+                logger.warning(message)
+            else:
+                logger.debug(message)
+
+
 class MandatorySubMiddleware(BaseMiddleware):
     async def __call__(
         self,
@@ -52,9 +134,7 @@ class MandatorySubMiddleware(BaseMiddleware):
             if isinstance(event, types.CallbackQuery) and event.data == 'h_check_sub':
                 return await handler(event, data)
 
-            conn = get_db_connection()
-            r = conn.cursor().execute("SELECT config FROM hosted_bots WHERE id = ?", (bot_id,)).fetchone()
-            conn.close()
+            r = await db.fetchone("SELECT config FROM hosted_bots WHERE id = ?", (bot_id,))
             conf = json.loads(r["config"]) if r and r["config"] else {}
             channels = conf.get('mandatory_channels', [])
             if not channels and conf.get('channel_username'):
@@ -0,0 +1,377 @@
+"""Forward-only schema migrations.
+
+Each entry in ``MIGRATIONS`` is applied once, in order, inside its own
+transaction, and recorded in ``schema_version``. Never edit or reorder an
+applied migration; append a new one instead.
+
+``check_query_plans`` runs ``EXPLAIN QUERY PLAN`` over every query in the bot
+package against a freshly migrated schema and reports each one that reads a
+large table in full; ``tests/test_query_plans.py`` fails on any report.
+``python -m bot.migrations`` upgrades the database at ``DATABASE_PATH`` and runs
+the same check on an in-memory copy of the schema.
+"""
+import ast
+import re
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Callable, List, Tuple, Union
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+BASELINE = [
+    'CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER UNIQUE NOT NULL, username TEXT, full_name TEXT, referral_code TEXT UNIQUE, referred_by INTEGER, captcha_passed BOOLEAN DEFAULT 0, subscribed BOOLEAN DEFAULT 0, registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_banned BOOLEAN DEFAULT 0, points INTEGER DEFAULT 0, ton_balance REAL DEFAULT 0, stars_balance INTEGER DEFAULT 0, wallet_address TEXT, last_daily_bonus TIMESTAMP, daily_streak_count INTEGER DEFAULT 0, fingerprint_hash TEXT, fingerprint_components TEXT, fingerprint_verified BOOLEAN DEFAULT 0, fingerprint_verified_at TIMESTAMP, ip_address TEXT, is_admin BOOLEAN DEFAULT 0, total_referrals INTEGER DEFAULT 0, total_tasks_completed INTEGER DEFAULT 0, total_earned_points INTEGER DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS referrals (id INTEGER PRIMARY KEY AUTOINCREMENT, referrer_id INTEGER NOT NULL, referred_id INTEGER UNIQUE NOT NULL, is_valid BOOLEAN DEFAULT 0, points INTEGER DEFAULT 0, date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+    'CREATE TABLE IF NOT EXISTS ip_attempts (id INTEGER PRIMARY KEY AUTOINCREMENT, ip_address TEXT NOT NULL, user_id INTEGER, attempt_type TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+    'CREATE INDEX IF NOT EXISTS idx_ip_attempts ON ip_attempts(ip_address, timestamp)',
+    'CREATE TABLE IF NOT EXISTS banned_ips (id INTEGER PRIMARY KEY AUTOINCREMENT, ip_address TEXT UNIQUE NOT NULL, banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, ban_reason TEXT, ban_duration INTEGER DEFAULT 72, banned_by INTEGER, expires_at TIMESTAMP)',
+    'CREATE TABLE IF NOT EXISTS secret_links (id INTEGER PRIMARY KEY AUTOINCREMENT, secret TEXT UNIQUE NOT NULL, user_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, expires_at TIMESTAMP NOT NULL, used BOOLEAN DEFAULT 0, used_at TIMESTAMP)',
+    'CREATE INDEX IF NOT EXISTS idx_secret ON secret_links(secret)',
+    'CREATE TABLE IF NOT EXISTS device_fingerprints (id INTEGER PRIMARY KEY AUTOINCREMENT, fingerprint_hash TEXT NOT NULL, user_id INTEGER NOT NULL, canvas_hash TEXT, webgl_hash TEXT, audio_hash TEXT, device_info TEXT, ip_address TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users(telegram_id))',
+    'CREATE INDEX IF NOT EXISTS idx_fingerprint ON device_fingerprints(fingerprint_hash)',
+    'CREATE TABLE IF NOT EXISTS hosted_bots (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_token TEXT UNIQUE NOT NULL, bot_username TEXT UNIQUE NOT NULL, bot_name TEXT, owner_id INTEGER NOT NULL, plan_type TEXT DEFAULT "free", is_active BOOLEAN DEFAULT 1, expires_at TIMESTAMP, max_users INTEGER DEFAULT 2000, current_users INTEGER DEFAULT 0, total_points_given INTEGER DEFAULT 0, config TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_activity TIMESTAMP, FOREIGN KEY (owner_id) REFERENCES users(telegram_id))',
+    'CREATE INDEX IF NOT EXISTS idx_bot_owner ON hosted_bots(owner_id)',
+    'CREATE TABLE IF NOT EXISTS upgrade_requests (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, bot_id INTEGER NOT NULL, requested_plan TEXT NOT NULL, payment_method TEXT, payment_amount REAL, status TEXT DEFAULT "pending", request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed_date TIMESTAMP, processed_by INTEGER, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))',
+    'CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, link TEXT, points INTEGER NOT NULL, is_active BOOLEAN DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, max_completions INTEGER DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS user_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, task_id INTEGER NOT NULL, completion_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(user_id, task_id))',
+    'CREATE TABLE IF NOT EXISTS withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, asset_type TEXT NOT NULL, amount REAL NOT NULL, wallet_address TEXT, status TEXT DEFAULT "pending", request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed_date TIMESTAMP, processed_by INTEGER, notes TEXT)',
+    'CREATE TABLE IF NOT EXISTS points_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action_type TEXT NOT NULL, points INTEGER NOT NULL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+    'CREATE TABLE IF NOT EXISTS user_settings (user_id INTEGER PRIMARY KEY, notifications_enabled BOOLEAN DEFAULT 1, language TEXT DEFAULT "ar", theme TEXT DEFAULT "default")',
+    'CREATE TABLE IF NOT EXISTS hosted_bot_users (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_telegram_id INTEGER NOT NULL, username TEXT, full_name TEXT, referral_code TEXT, referred_by INTEGER, points INTEGER DEFAULT 0, ton_balance REAL DEFAULT 0, stars_balance INTEGER DEFAULT 0, wallet_address TEXT, joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_activity TIMESTAMP, last_daily_bonus TIMESTAMP, daily_streak_count INTEGER DEFAULT 0, total_referrals INTEGER DEFAULT 0, total_tasks_completed INTEGER DEFAULT 0, total_earned_points INTEGER DEFAULT 0, fingerprint_hash TEXT, ip_address TEXT, is_banned BOOLEAN DEFAULT 0, fingerprint_verified BOOLEAN DEFAULT 0, UNIQUE(bot_id, user_telegram_id), FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))',
+    'CREATE TABLE IF NOT EXISTS hosted_bot_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, name TEXT NOT NULL, description TEXT, link TEXT, points INTEGER NOT NULL, is_active BOOLEAN DEFAULT 1, max_completions INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))',
+    'CREATE TABLE IF NOT EXISTS hosted_bot_user_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, task_id INTEGER NOT NULL, completion_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(bot_id, user_id, task_id), FOREIGN KEY (bot_id) REFERENCES hosted_bots(id), FOREIGN KEY (task_id) REFERENCES hosted_bot_tasks(id))',
+    'CREATE TABLE IF NOT EXISTS hosted_bot_points_history (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, action_type TEXT NOT NULL, points INTEGER NOT NULL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))',
+    'CREATE TABLE IF NOT EXISTS hosted_bot_withdrawals (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, asset_type TEXT NOT NULL, amount REAL NOT NULL, wallet_address TEXT, status TEXT DEFAULT "pending", request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, processed_date TIMESTAMP, processed_by INTEGER, notes TEXT, FOREIGN KEY (bot_id) REFERENCES hosted_bots(id))',
+    'CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL, description TEXT, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_by INTEGER)',
+    'CREATE TABLE IF NOT EXISTS plan_settings (plan_id TEXT NOT NULL, setting_key TEXT NOT NULL, setting_value TEXT NOT NULL, PRIMARY KEY (plan_id, setting_key))',
+]
+
+HOT_PATH_INDEXES = [
+    # hosted_bot_users(bot_id, user_telegram_id) is already covered by its UNIQUE constraint.
+    'CREATE INDEX IF NOT EXISTS idx_hbu_bot_referral_code ON hosted_bot_users(bot_id, referral_code)',
+    'CREATE INDEX IF NOT EXISTS idx_referrals_referrer_valid ON referrals(referrer_id, is_valid)',
+    'CREATE INDEX IF NOT EXISTS idx_points_history_user_created ON points_history(user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_withdrawals_status_date ON withdrawals(status, request_date)',
+    'CREATE INDEX IF NOT EXISTS idx_users_ip ON users(ip_address)',
+    'CREATE INDEX IF NOT EXISTS idx_users_registration_date ON users(registration_date)',
+    'CREATE INDEX IF NOT EXISTS idx_users_banned ON users(is_banned, registration_date)',
+    'CREATE INDEX IF NOT EXISTS idx_hbw_bot_status ON hosted_bot_withdrawals(bot_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_hbt_bot ON hosted_bot_tasks(bot_id, is_active)',
+    'CREATE INDEX IF NOT EXISTS idx_hbph_bot_user_created ON hosted_bot_points_history(bot_id, user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_fingerprints_user ON device_fingerprints(user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_secret_links_user ON secret_links(user_id, used)',
+]
+
+
+def _bump(pairs: str) -> str:
+    """UPDATE adding each ``name: expression`` delta to its system counter."""
+    items = [p.split(':', 1) for p in pairs.split(';')]
+    cases = ' '.join(f"WHEN '{n.strip()}' THEN {e.strip()}" for n, e in items)
+    names = ', '.join(f"'{n.strip()}'" for n, _ in items)
+    return f'UPDATE system_counters SET value = value + (CASE name {cases} ELSE 0 END) WHERE name IN ({names});'
+
+
+def _daily(name: str, expr: str = '1') -> str:
+    return (f"INSERT INTO daily_counters (day, name, value) VALUES (date('now', 'localtime'), '{name}', {expr}) "
+            'ON CONFLICT(day, name) DO UPDATE SET value = value + excluded.value;')
+
+
+COUNTER_NAMES = ['users', 'hosted_bots', 'active_bots', 'valid_referrals', 'total_points', 'total_ton', 'total_stars', 'pending_withdrawals']
+
+# Triggers keep the counters in the same transaction as the row change that moves them.
+SYSTEM_COUNTERS = [
+    'CREATE TABLE IF NOT EXISTS system_counters (name TEXT PRIMARY KEY, value NUMERIC NOT NULL DEFAULT 0)',
+    'CREATE TABLE IF NOT EXISTS daily_counters (day TEXT NOT NULL, name TEXT NOT NULL, value NUMERIC NOT NULL DEFAULT 0, PRIMARY KEY (day, name))',
+    'INSERT OR IGNORE INTO system_counters (name, value) VALUES ' + ', '.join(f"('{n}', 0)" for n in COUNTER_NAMES),
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_users_ins AFTER INSERT ON users BEGIN '
+    + _bump('users: 1; total_points: IFNULL(NEW.points, 0); total_ton: IFNULL(NEW.ton_balance, 0); total_stars: IFNULL(NEW.stars_balance, 0)')
+    + _daily('new_users') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_users_del AFTER DELETE ON users BEGIN '
+    + _bump('users: -1; total_points: -IFNULL(OLD.points, 0); total_ton: -IFNULL(OLD.ton_balance, 0); total_stars: -IFNULL(OLD.stars_balance, 0)') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_users_upd AFTER UPDATE OF points, ton_balance, stars_balance ON users '
+    'WHEN NEW.points IS NOT OLD.points OR NEW.ton_balance IS NOT OLD.ton_balance OR NEW.stars_balance IS NOT OLD.stars_balance BEGIN '
+    + _bump('total_points: IFNULL(NEW.points, 0) - IFNULL(OLD.points, 0); total_ton: IFNULL(NEW.ton_balance, 0) - IFNULL(OLD.ton_balance, 0); '
+            'total_stars: IFNULL(NEW.stars_balance, 0) - IFNULL(OLD.stars_balance, 0)') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_referrals_ins AFTER INSERT ON referrals WHEN NEW.is_valid = 1 BEGIN '
+    + _bump('valid_referrals: 1') + _daily('valid_referrals') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_referrals_upd AFTER UPDATE OF is_valid ON referrals WHEN NEW.is_valid IS NOT OLD.is_valid BEGIN '
+    + _bump('valid_referrals: (NEW.is_valid = 1) - (OLD.is_valid = 1)') + _daily('valid_referrals', '(NEW.is_valid = 1) - (OLD.is_valid = 1)') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_referrals_del AFTER DELETE ON referrals WHEN OLD.is_valid = 1 BEGIN '
+    + _bump('valid_referrals: -1') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_withdrawals_ins AFTER INSERT ON withdrawals BEGIN '
+    + _bump("pending_withdrawals: NEW.status = 'pending'") + _daily('withdrawals') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_withdrawals_upd AFTER UPDATE OF status ON withdrawals WHEN NEW.status IS NOT OLD.status BEGIN '
+    + _bump("pending_withdrawals: (NEW.status = 'pending') - (OLD.status = 'pending')") + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_withdrawals_del AFTER DELETE ON withdrawals BEGIN '
+    + _bump("pending_withdrawals: -(OLD.status = 'pending')") + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_bots_ins AFTER INSERT ON hosted_bots BEGIN '
+    + _bump('hosted_bots: 1; active_bots: NEW.is_active = 1') + _daily('bots_created') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_bots_upd AFTER UPDATE OF is_active ON hosted_bots WHEN NEW.is_active IS NOT OLD.is_active BEGIN '
+    + _bump('active_bots: (NEW.is_active = 1) - (OLD.is_active = 1)') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_bots_del AFTER DELETE ON hosted_bots BEGIN '
+    + _bump('hosted_bots: -1; active_bots: -(OLD.is_active = 1)') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_points_ins AFTER INSERT ON points_history WHEN NEW.points > 0 BEGIN '
+    + _daily('points_awarded', 'NEW.points') + ' END',
+]
+
+# Exact values of every system counter, used for the initial backfill and for reconciliation.
+COUNTER_QUERIES = {
+    'users': 'SELECT COUNT(*) FROM users',
+    'hosted_bots': 'SELECT COUNT(*) FROM hosted_bots',
+    'active_bots': 'SELECT COUNT(*) FROM hosted_bots WHERE is_active = 1',
+    'valid_referrals': 'SELECT COUNT(*) FROM referrals WHERE is_valid = 1',
+    'total_points': 'SELECT IFNULL(SUM(points), 0) FROM users',
+    'total_ton': 'SELECT IFNULL(SUM(ton_balance), 0) FROM users',
+    'total_stars': 'SELECT IFNULL(SUM(stars_balance), 0) FROM users',
+    'pending_withdrawals': "SELECT COUNT(*) FROM withdrawals WHERE status = 'pending'",
+    'task_completions': 'SELECT COUNT(*) FROM user_tasks',
+}
+
+
+def _backfill_counters(conn: sqlite3.Connection):
+    for name, sql in COUNTER_QUERIES.items():
+        conn.execute('UPDATE system_counters SET value = ? WHERE name = ?', (conn.execute(sql).fetchone()[0], name))
+    for name, sql in (
+        ('new_users', "SELECT date(registration_date, 'localtime'), COUNT(*) FROM users GROUP BY 1"),
+        ('bots_created', "SELECT date(created_at, 'localtime'), COUNT(*) FROM hosted_bots GROUP BY 1"),
+        ('withdrawals', "SELECT date(request_date, 'localtime'), COUNT(*) FROM withdrawals GROUP BY 1"),
+        ('points_awarded', "SELECT date(created_at, 'localtime'), SUM(points) FROM points_history WHERE points > 0 GROUP BY 1"),
+    ):
+        conn.executemany('INSERT OR REPLACE INTO daily_counters (day, name, value) VALUES (?, ?, ?)',
+                         [(day, name, value) for day, value in conn.execute(sql) if day])
+
+
+# Completed main-bot tasks, shown on every statistics screen; counted by trigger instead of COUNT(*).
+TASK_COMPLETIONS_COUNTER = [
+    "INSERT OR IGNORE INTO system_counters (name, value) VALUES ('task_completions', 0)",
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_user_tasks_ins AFTER INSERT ON user_tasks BEGIN ' + _bump('task_completions: 1') + ' END',
+    'CREATE TRIGGER IF NOT EXISTS trg_counters_user_tasks_del AFTER DELETE ON user_tasks BEGIN ' + _bump('task_completions: -1') + ' END',
+    "UPDATE system_counters SET value = (SELECT COUNT(*) FROM user_tasks) WHERE name = 'task_completions'",
+]
+
+# Hosted bot users switch their own streak reminders off; user_settings belongs to the main bot.
+HOSTED_NOTIFICATIONS = [
+    'ALTER TABLE hosted_bot_users ADD COLUMN notifications_enabled BOOLEAN DEFAULT 1',
+]
+
+
+LEDGER_PARTITIONS = [
+    'CREATE TABLE IF NOT EXISTS ledger_partitions (table_name TEXT PRIMARY KEY, source TEXT NOT NULL, month TEXT NOT NULL, rows INTEGER NOT NULL DEFAULT 0, archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+    'CREATE INDEX IF NOT EXISTS idx_ledger_partitions_source ON ledger_partitions(source, month)',
+    # Per-user monthly totals of archived entries; bot_id 0 is the main bot.
+    'CREATE TABLE IF NOT EXISTS ledger_snapshots (bot_id INTEGER NOT NULL, user_id INTEGER NOT NULL, month TEXT NOT NULL, earned INTEGER NOT NULL DEFAULT 0, spent INTEGER NOT NULL DEFAULT 0, entries INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (bot_id, user_id, month))',
+    'CREATE INDEX IF NOT EXISTS idx_points_history_created ON points_history(created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_hbph_created ON hosted_bot_points_history(created_at)',
+]
+
+# Expiry columns the janitor deletes by, one index range per chunk.
+JANITOR_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_ip_attempts_timestamp ON ip_attempts(timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_secret_links_expires ON secret_links(expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_banned_ips_expires ON banned_ips(expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_fingerprints_hash_user ON device_fingerprints(fingerprint_hash, user_id)',
+]
+
+# Leaderboards read their top rows, sample and count of non-banned users off these.
+LEADERBOARD_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_users_top_earned ON users(is_banned, total_earned_points)',
+    'CREATE INDEX IF NOT EXISTS idx_users_top_referrals ON users(is_banned, total_referrals)',
+    'CREATE INDEX IF NOT EXISTS idx_hbu_top_earned ON hosted_bot_users(bot_id, is_banned, total_earned_points)',
+    'CREATE INDEX IF NOT EXISTS idx_hbu_top_referrals ON hosted_bot_users(bot_id, is_banned, total_referrals)',
+]
+
+# The reminder scheduler reloads every unbroken daily streak at startup by claim time.
+REMINDER_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_users_last_daily ON users(last_daily_bonus)',
+    'CREATE INDEX IF NOT EXISTS idx_hbu_last_daily ON hosted_bot_users(bot_id, last_daily_bonus)',
+]
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "baseline schema", BASELINE),
+    (2, "hot-path indexes", HOT_PATH_INDEXES),
+    (3, "system counters and daily rollups", SYSTEM_COUNTERS + [_backfill_counters]),
+    (4, "monthly ledger partitions and snapshots", LEDGER_PARTITIONS),
+    (5, "janitor expiry indexes", JANITOR_INDEXES),
+    (6, "leaderboard indexes", LEADERBOARD_INDEXES),
+    (7, "daily streak reminder indexes", REMINDER_INDEXES),
+    (8, "task completions counter", TASK_COMPLETIONS_COUNTER),
+    (9, "hosted bot reminder opt-out", HOSTED_NOTIFICATIONS),
+]
+
+# Per-bot tables that move into each hosted bot's own file in tenant storage mode.
+TENANT_TABLES = ['hosted_bot_users', 'hosted_bot_tasks', 'hosted_bot_user_tasks', 'hosted_bot_points_history', 'hosted_bot_withdrawals']
+
+
+def _tenant_steps(steps: List[str]) -> List[str]:
+    return [sql for sql in steps if re.search(r'(?:TABLE IF NOT EXISTS|\bON) (\w+)', sql).group(1) in TENANT_TABLES]
+
+
+# Same DDL as the shared database, so queries and row copies work unchanged in either mode.
+TENANT_MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "hosted bot tenant tables", _tenant_steps(BASELINE) + _tenant_steps(HOT_PATH_INDEXES) + _tenant_steps(LEDGER_PARTITIONS)),
+    (2, "leaderboard indexes", _tenant_steps(LEADERBOARD_INDEXES)),
+    (3, "daily streak reminder indexes", _tenant_steps(REMINDER_INDEXES)),
+    # A tenant's archived ledger months and snapshots stay in its own file, next to its live rows.
+    (4, "ledger partitions and snapshots", [sql for sql in LEDGER_PARTITIONS if 'ledger_' in sql]),
+    (5, "hosted bot reminder opt-out", HOSTED_NOTIFICATIONS),
+]
+
+# Tables that grow with users/activity; a full scan of any of these fails the plan check.
+LARGE_TABLES = {
+    'users', 'referrals', 'points_history', 'withdrawals', 'user_tasks', 'ip_attempts',
+    'device_fingerprints', 'secret_links', 'hosted_bot_users', 'hosted_bot_points_history',
+    'hosted_bot_withdrawals', 'hosted_bot_user_tasks',
+}
+
+# Queries that have to read every row: the counter backfill and reconciliation, admin
+# free-text search, the one-off load of the in-memory device index at startup, and the
+# offline tools (tenant split, table export). Archive partitions are created at runtime
+# with their own (user, created_at) index, so they cannot be planned here.
+ALLOWED_SCANS = {
+    *COUNTER_QUERIES.values(),
+    "UPDATE system_counters SET value = (SELECT COUNT(*) FROM user_tasks) WHERE name = 'task_completions'",
+    "SELECT date(registration_date, 'localtime'), COUNT(*) FROM users GROUP BY 1",
+    "SELECT date(request_date, 'localtime'), COUNT(*) FROM withdrawals GROUP BY 1",
+    "SELECT date(created_at, 'localtime'), SUM(points) FROM points_history WHERE points > 0 GROUP BY 1",
+    'SELECT telegram_id, username, full_name, referral_code, referred_by, captcha_passed, subscribed, registration_date, is_banned, points, ton_balance, stars_balance, wallet_address, last_daily_bonus, daily_streak_count, fingerprint_verified, is_admin, total_referrals, total_tasks_completed, total_earned_points FROM users WHERE username LIKE ? OR full_name LIKE ?',
+    'SELECT fingerprint_hash, user_id, canvas_hash, webgl_hash, audio_hash, device_info FROM device_fingerprints ORDER BY id',
+    "SELECT * FROM {partition_name(source, m['month'])} WHERE {where} ORDER BY created_at DESC LIMIT ?",
+    'SELECT DISTINCT bot_id FROM {t}',
+    'INSERT OR IGNORE INTO main.{t} SELECT * FROM shared.{t} WHERE bot_id = ?',
+    'SELECT COUNT(*) FROM shared.{t} WHERE bot_id = ?',
+    'SELECT COUNT(*) FROM main.{t} WHERE bot_id = ?',
+    'DELETE FROM {t} WHERE bot_id = ?',
+    'CREATE TABLE IF NOT EXISTS main.{name} AS SELECT * FROM shared.{name} WHERE 0',
+    'SELECT 1 FROM main.{name} WHERE bot_id = ? LIMIT 1',
+    'INSERT INTO main.{name} SELECT * FROM shared.{name} WHERE bot_id = ?',
+    'SELECT COUNT(*) FROM main.{name}',
+    'DELETE FROM {name} WHERE bot_id = ?',
+    'SELECT rowid, * FROM {table} WHERE rowid > ?',
+}
+
+# f-string queries, checked through the statements they expand to. An f-string query
+# missing from here and from ALLOWED_SCANS cannot be planned and fails the check.
+FSTRING_QUERIES = {
+    'UPDATE system_counters SET value = value + (CASE name {cases} ELSE 0 END) WHERE name IN ({names});': [
+        "UPDATE system_counters SET value = value + (CASE name WHEN 'users' THEN 1 ELSE 0 END) WHERE name IN ('users');",
+    ],
+    'SELECT * FROM {source} WHERE created_at < ? ORDER BY created_at, id LIMIT ?': [
+        'SELECT * FROM points_history WHERE created_at < ? ORDER BY created_at, id LIMIT ?',
+        'SELECT * FROM hosted_bot_points_history WHERE created_at < ? ORDER BY created_at, id LIMIT ?',
+    ],
+    'DELETE FROM {source} WHERE id = ?': [
+        'DELETE FROM points_history WHERE id = ?',
+        'DELETE FROM hosted_bot_points_history WHERE id = ?',
+    ],
+    'SELECT * FROM {source} WHERE {where} ORDER BY created_at DESC LIMIT ?': [
+        'SELECT * FROM points_history WHERE user_id = ? ORDER BY created_at DESC LIMIT ?',
+        'SELECT * FROM hosted_bot_points_history WHERE bot_id = ? AND user_id = ? ORDER BY created_at DESC LIMIT ?',
+    ],
+    'SELECT IFNULL(SUM(CASE WHEN points >= 0 THEN points END), 0) AS earned, IFNULL(SUM(CASE WHEN points < 0 THEN points END), 0) AS spent, COUNT(*) AS entries FROM {source} WHERE {where}': [
+        'SELECT IFNULL(SUM(CASE WHEN points >= 0 THEN points END), 0) AS earned, IFNULL(SUM(CASE WHEN points < 0 THEN points END), 0) AS spent, COUNT(*) AS entries FROM points_history WHERE user_id = ?',
+        'SELECT IFNULL(SUM(CASE WHEN points >= 0 THEN points END), 0) AS earned, IFNULL(SUM(CASE WHEN points < 0 THEN points END), 0) AS spent, COUNT(*) AS entries FROM hosted_bot_points_history WHERE bot_id = ? AND user_id = ?',
+    ],
+    "SELECT user_id FROM user_settings WHERE notifications_enabled = 0 AND user_id IN ({', '.join('?' * len(user_ids))})": [
+        'SELECT user_id FROM user_settings WHERE notifications_enabled = 0 AND user_id IN (?, ?, ?)',
+    ],
+    "SELECT user_telegram_id FROM hosted_bot_users WHERE bot_id = ? AND notifications_enabled = 0 AND user_telegram_id IN ({', '.join('?' * len(user_ids))})": [
+        'SELECT user_telegram_id FROM hosted_bot_users WHERE bot_id = ? AND notifications_enabled = 0 AND user_telegram_id IN (?, ?, ?)',
+    ],
+}
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection, migrations=MIGRATIONS) -> List[int]:
+    """Apply every pending migration and return the versions applied."""
+    conn.isolation_level = None
+    version, applied = current_version(conn), []
+    for number, description, steps in migrations:
+        if number <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (number, description))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        applied.append(number)
+    return applied
+
+
+def _source(node: ast.JoinedStr) -> str:
+    """An f-string as written, its replacement fields kept as ``{expression}``."""
+    return ''.join(v.value if isinstance(v, ast.Constant) else '{' + ast.unparse(v.value) + '}' for v in node.values)
+
+
+def collect_queries(root: Path) -> List[Tuple[str, int, str]]:
+    """SELECT/UPDATE/DELETE statements in the package, as (file, line, sql); f-strings keep their ``{fields}``."""
+    found = []
+    for path in sorted(root.glob('*.py')):
+        tree = ast.parse(path.read_text(encoding='utf-8'))
+        fragments = {id(v) for n in ast.walk(tree) if isinstance(n, ast.JoinedStr) for v in n.values}
+        for node in ast.walk(tree):
+            if id(node) in fragments:
+                continue
+            if isinstance(node, ast.JoinedStr):
+                text = _source(node)
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                text = node.value
+            else:
+                continue
+            sql = ' '.join(text.split())
+            if re.match(r'(SELECT|UPDATE|DELETE)\s', sql, re.I) and re.search(r'\b(FROM|SET)\b', sql, re.I):
+                found.append((path.name, node.lineno, sql))
+    return found
+
+
+def full_scans(conn: sqlite3.Connection, sql: str) -> List[str]:
+    """Large tables that ``sql`` reads in full, by table or by index (``SCAN t USING [COVERING] INDEX``)."""
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, [None] * sql.count('?')).fetchall()
+    scans = []
+    for row in plan:
+        m = re.match(r'SCAN (\w+)(.*)', row[-1])
+        if m and m.group(1) in LARGE_TABLES:
+            scans.append(m.group(1))
+    return scans
+
+
+def check_query_plans(conn: sqlite3.Connection, root: Path, allow=ALLOWED_SCANS, expand=FSTRING_QUERIES) -> List[str]:
+    problems = []
+    for name, line, template in collect_queries(root):
+        if template in allow:
+            continue
+        for sql in expand.get(template, [template]):
+            try:
+                scans = full_scans(conn, sql)
+            except sqlite3.Error as e:
+                problems.append(f'{name}:{line}: cannot plan ({e}): {sql}')
+                continue
+            if scans:
+                problems.append(f'{name}:{line}: full scan of {", ".join(scans)}: {sql}')
+    return problems
+
+
+if __name__ == '__main__':
+    from .config import DATABASE_PATH
+    conn = sqlite3.connect(DATABASE_PATH)
+    print(f'schema: applied {migrate(conn) or "nothing"}, now at v{current_version(conn)}')
+    conn.close()
+    # Plans are checked on an empty copy of the schema, not on the live database.
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    problems = check_query_plans(conn, Path(__file__).parent)
+    for p in problems:
+        print(p)
+    conn.close()
+    sys.exit(1 if problems else 0)
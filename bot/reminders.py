@@ -0,0 +1,199 @@
+"""Reminders sent before a daily bonus streak breaks.
+
+A streak is lost when the next claim comes more than ``DAILY_STREAK_RESET``
+after the last one, so each user with a running streak gets a reminder due
+``REMINDER_LEAD_HOURS`` before that moment. The due times sit in a min-heap
+keyed by (scope, user) (scope 0 is the main bot, otherwise the hosted bot id);
+the daily bonus handlers call ``schedule`` after every claim, which replaces
+the user's previous entry, so the scheduler never queries users periodically.
+Replaced entries stay in the heap and are skipped when popped.
+
+The worker sleeps until the earliest due time, then sends what is due in
+batches of ``REMINDER_BATCH``: users who turned reminders off (in
+``user_settings`` for the main bot, ``hosted_bot_users`` for a hosted bot) are
+skipped, and sends are spaced to ``REMINDER_RATE_PER_SECOND`` (a flood-wait
+from Telegram pauses the whole queue). A hosted bot that is not running yet
+(startup is staggered) gets its reminders re-queued every
+``RETRY_SECONDS`` until the streak would break.
+
+On startup the heap is rebuilt from the ``last_daily_bonus`` indexes. Reminders
+that fell due before the restart are not rebuilt: the user may already have
+had them, and sending again on every deploy is worse than missing one.
+"""
+import asyncio
+import heapq
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from .config import logger, REMINDER_LEAD_HOURS, REMINDER_BATCH, REMINDER_RATE_PER_SECOND
+from .balances import DAILY_STREAK_RESET
+from .repository import Users, HostedUsers, HostedBots, UserSettings
+
+Key = Tuple[int, int]
+
+RETRY_SECONDS = 60
+
+
+class Reminders:
+    # (due, scope, user_id, streak); an entry is live only while ``due[key]`` still matches it.
+    heap: List[Tuple[float, int, int, int]] = []
+    due: Dict[Key, float] = {}
+    stats = {'scheduled': 0, 'sent': 0, 'muted': 0, 'failed': 0}
+    main_bot: Optional[Bot] = None
+    _wake = asyncio.Event()
+
+    @staticmethod
+    def _due_time(claimed_at: datetime) -> float:
+        return (claimed_at + DAILY_STREAK_RESET).timestamp() - REMINDER_LEAD_HOURS * 3600
+
+    @staticmethod
+    def schedule(scope: int, user_id: int, claimed_at: datetime, streak: int):
+        """(Re)arm ``user_id``'s reminder after a claim; a streak of 0 has nothing to lose."""
+        key = (scope, user_id)
+        if streak <= 0:
+            Reminders.due.pop(key, None)
+            return
+        due = Reminders._due_time(claimed_at)
+        Reminders.due[key] = due
+        heapq.heappush(Reminders.heap, (due, scope, user_id, streak))
+        Reminders.stats['scheduled'] += 1
+        if Reminders.heap[0][0] == due:
+            Reminders._wake.set()
+
+    @staticmethod
+    def cancel(scope: int, user_id: int):
+        Reminders.due.pop((scope, user_id), None)
+
+    @staticmethod
+    async def load() -> int:
+        """Rebuild the heap from every streak that has not broken yet."""
+        Reminders.heap, Reminders.due = [], {}
+        now = time.time()
+        since = (datetime.now() - DAILY_STREAK_RESET).isoformat()
+
+        def restore(scope, r):
+            claimed_at = datetime.fromisoformat(r.last_daily_bonus)
+            if Reminders._due_time(claimed_at) > now:
+                Reminders.schedule(scope, r.user_id, claimed_at, r.daily_streak_count)
+
+        for r in await Users.streaks(since):
+            restore(0, r)
+        for bot in await HostedBots.active():
+            for r in await HostedUsers.streaks(bot.id, since):
+                restore(bot.id, r)
+        logger.info(f"Reminders loaded: {len(Reminders.due)} streaks")
+        return len(Reminders.due)
+
+    @staticmethod
+    def _pop_due(now: float, limit: int) -> List[Tuple[int, int, int, float]]:
+        batch = []
+        while Reminders.heap and Reminders.heap[0][0] <= now and len(batch) < limit:
+            due, scope, user_id, streak = heapq.heappop(Reminders.heap)
+            if Reminders.due.get((scope, user_id)) != due:
+                continue
+            del Reminders.due[(scope, user_id)]
+            batch.append((scope, user_id, streak, due))
+        return batch
+
+    @staticmethod
+    def _retry(scope: int, user_id: int, streak: int, due: float):
+        """Try again in ``RETRY_SECONDS`` unless the streak breaks first."""
+        at = time.time() + RETRY_SECONDS
+        if at >= due + REMINDER_LEAD_HOURS * 3600:
+            Reminders.stats['failed'] += 1
+            return
+        Reminders.due[(scope, user_id)] = at
+        heapq.heappush(Reminders.heap, (at, scope, user_id, streak))
+
+    @staticmethod
+    async def _muted(batch) -> set:
+        """(scope, user_id) pairs in ``batch`` whose reminders are turned off for that bot."""
+        by_scope: Dict[int, List[int]] = {}
+        for scope, user_id, _, _ in batch:
+            by_scope.setdefault(scope, []).append(user_id)
+        muted = set()
+        for scope, user_ids in by_scope.items():
+            users = await (UserSettings.muted(user_ids) if scope == 0 else HostedUsers.muted(scope, user_ids))
+            muted.update((scope, u) for u in users)
+        return muted
+
+    @staticmethod
+    def _bot(scope: int) -> Optional[Bot]:
+        if scope == 0:
+            return Reminders.main_bot
+        from .hosting import HostedBotSystem
+        running = HostedBotSystem.running_bots.get(scope)
+        return running['bot'] if running else None
+
+    @staticmethod
+    async def _send(scope: int, user_id: int, streak: int) -> bool:
+        bot = Reminders._bot(scope)
+        if bot is None:
+            return False
+        builder = InlineKeyboardBuilder()
+        builder.button(text='🎁 استلم المكافأة', callback_data='daily_bonus' if scope == 0 else 'hosted_daily')
+        await bot.send_message(user_id, f"⏰ تتابعك اليومي ({streak} أيام) سينقطع خلال {REMINDER_LEAD_HOURS:g} ساعات!\n\nاستلم مكافأتك اليومية الآن للحفاظ عليه.", reply_markup=builder.as_markup())
+        return True
+
+    @staticmethod
+    async def send_due(now: Optional[float] = None) -> int:
+        """Send every reminder due by ``now``; returns the number delivered."""
+        sent, gap = 0, 1 / max(0.1, REMINDER_RATE_PER_SECOND)
+        while True:
+            batch = Reminders._pop_due(now or time.time(), REMINDER_BATCH)
+            if not batch:
+                return sent
+            muted = await Reminders._muted(batch)
+            for i, (scope, user_id, streak, due) in enumerate(batch):
+                if (scope, user_id) in muted:
+                    Reminders.stats['muted'] += 1
+                    continue
+                try:
+                    if await Reminders._send(scope, user_id, streak):
+                        sent += 1
+                        Reminders.stats['sent'] += 1
+                    else:
+                        Reminders._retry(scope, user_id, streak, due)
+                        continue
+                except TelegramRetryAfter as e:
+                    # Put back this and the rest of the batch; they go out after the flood wait.
+                    for s, u, k, d in batch[i:]:
+                        Reminders.due[(s, u)] = d
+                        heapq.heappush(Reminders.heap, (d, s, u, k))
+                    await asyncio.sleep(e.retry_after)
+                    break
+                except (TelegramForbiddenError, TelegramBadRequest):
+                    Reminders.stats['failed'] += 1
+                except Exception as e:
+                    Reminders.stats['failed'] += 1
+                    logger.error(f"Reminder to {user_id} (scope {scope}) failed: {e}")
+                await asyncio.sleep(gap)
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        return {**Reminders.stats, 'pending': len(Reminders.due)}
+
+    @staticmethod
+    async def run(bot: Bot):
+        Reminders.main_bot = bot
+        try:
+            await Reminders.load()
+        except Exception as e:
+            logger.error(f"Reminder load failed: {e}")
+        while True:
+            Reminders._wake.clear()
+            timeout = max(0.0, Reminders.heap[0][0] - time.time()) if Reminders.heap else 3600.0
+            try:
+                await asyncio.wait_for(Reminders._wake.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            try:
+                sent = await Reminders.send_due()
+                if sent:
+                    logger.info(f"Sent {sent} streak reminders")
+            except Exception as e:
+                logger.error(f"Reminder batch failed: {e}")
@@ -0,0 +1,735 @@
+"""Typed data access for the handlers.
+
+Every query selects only the columns its row type declares, and rows are built
+straight into ``__slots__`` dataclasses by the cursor's row factory, so a read
+allocates one small object instead of an ``aiosqlite.Row`` that carries every
+column of the table (fingerprint blobs, IPs...). SQL strings are module
+constants, which keeps them hot in each long-lived connection's statement
+cache. Models support ``row['col']`` so templates written against ``Row``
+keep working.
+
+Writes go through ``execute``/``write`` on the owning pool and therefore join
+the caller's ``transaction()`` on that pool when there is one. Hosted bot rows
+live in ``TenantStore.pool(bot_id)``: the main pool in shared mode, the bot's
+own file in tenant mode. Counting and lookup methods used by report screens
+take an optional ``pool`` so they can read from a ``ReadOnlyPool`` snapshot.
+``Users.get`` and ``HostedUsers.get`` on the default pool are served from
+``UserCache``; every method that writes a user row invalidates it.
+
+``python -m bot.repository`` runs an allocation micro-benchmark.
+"""
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Set
+from .database import db
+from .tenants import TenantStore
+from .usercache import UserCache
+from .leaderboard import Leaderboards
+
+
+class _Model:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def keys(self):
+        return [f.name for f in fields(self)]
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        return cls(*row)
+
+
+@dataclass(slots=True)
+class User(_Model):
+    telegram_id: int
+    username: Optional[str]
+    full_name: Optional[str]
+    referral_code: Optional[str]
+    referred_by: Optional[int]
+    captcha_passed: int
+    subscribed: int
+    registration_date: str
+    is_banned: int
+    points: int
+    ton_balance: float
+    stars_balance: int
+    wallet_address: Optional[str]
+    last_daily_bonus: Optional[str]
+    daily_streak_count: int
+    fingerprint_verified: int
+    is_admin: int
+    total_referrals: int
+    total_tasks_completed: int
+    total_earned_points: int
+
+
+@dataclass(slots=True)
+class Balance(_Model):
+    telegram_id: int
+    full_name: Optional[str]
+    points: int
+    ton_balance: float
+    stars_balance: int
+    wallet_address: Optional[str]
+
+
+@dataclass(slots=True)
+class ReferralInfo(_Model):
+    referral_code: Optional[str]
+    total_referrals: int
+
+
+@dataclass(slots=True)
+class Referral(_Model):
+    id: int
+    referrer_id: int
+
+
+@dataclass(slots=True)
+class Task(_Model):
+    id: int
+    name: str
+    description: Optional[str]
+    link: Optional[str]
+    points: int
+    is_active: int
+    max_completions: int
+
+
+@dataclass(slots=True)
+class Withdrawal(_Model):
+    id: int
+    user_id: int
+    asset_type: str
+    amount: float
+    wallet_address: Optional[str]
+    status: str
+    request_date: str
+    bot_id: int = 0
+    full_name: Optional[str] = None
+    username: Optional[str] = None
+
+
+@dataclass(slots=True)
+class HostedBot(_Model):
+    id: int
+    bot_token: str
+    bot_username: str
+    bot_name: Optional[str]
+    owner_id: int
+    plan_type: str
+    is_active: int
+    expires_at: Optional[str]
+    max_users: int
+    current_users: int
+    total_points_given: int
+    created_at: str
+    owner_name: Optional[str] = None
+
+
+@dataclass(slots=True)
+class StartableBot(_Model):
+    id: int
+    bot_token: str
+    bot_username: str
+    owner_id: int
+    last_activity: Optional[str]
+
+
+@dataclass(slots=True)
+class HostedUser(_Model):
+    user_telegram_id: int
+    username: Optional[str]
+    full_name: Optional[str]
+    referral_code: Optional[str]
+    referred_by: Optional[int]
+    points: int
+    ton_balance: float
+    stars_balance: int
+    wallet_address: Optional[str]
+    joined_at: str
+    last_daily_bonus: Optional[str]
+    daily_streak_count: int
+    total_referrals: int
+    total_tasks_completed: int
+    total_earned_points: int
+    is_banned: int
+    fingerprint_verified: int
+    notifications_enabled: int
+
+
+@dataclass(slots=True)
+class Streak(_Model):
+    user_id: int
+    last_daily_bonus: str
+    daily_streak_count: int
+
+
+async def _one(model, sql: str, params=(), pool=db):
+    async with pool.read() as conn:
+        async with conn.execute(sql, params) as cur:
+            cur.row_factory = model.from_row
+            return await cur.fetchone()
+
+
+async def _all(model, sql: str, params=(), pool=db) -> list:
+    async with pool.read() as conn:
+        async with conn.execute(sql, params) as cur:
+            cur.row_factory = model.from_row
+            return await cur.fetchall()
+
+
+async def _column(sql: str, params=(), pool=db) -> list:
+    async with pool.read() as conn:
+        async with conn.execute(sql, params) as cur:
+            cur.row_factory = _first
+            return await cur.fetchall()
+
+
+def _first(cursor, row):
+    return row[0]
+
+
+async def _returning(pool, sql: str, params=()):
+    """Run a one-row ``... RETURNING`` write and return that row (``None`` if nothing matched)."""
+    async def apply(conn):
+        async with conn.execute(sql, params) as cur:
+            return await cur.fetchone()
+    return await pool.write(apply)
+
+
+_USER = 'SELECT telegram_id, username, full_name, referral_code, referred_by, captcha_passed, subscribed, registration_date, is_banned, points, ton_balance, stars_balance, wallet_address, last_daily_bonus, daily_streak_count, fingerprint_verified, is_admin, total_referrals, total_tasks_completed, total_earned_points FROM users WHERE telegram_id = ?'
+_HOSTED_USER = 'SELECT user_telegram_id, username, full_name, referral_code, referred_by, points, ton_balance, stars_balance, wallet_address, joined_at, last_daily_bonus, daily_streak_count, total_referrals, total_tasks_completed, total_earned_points, is_banned, fingerprint_verified, notifications_enabled FROM hosted_bot_users WHERE bot_id = ? AND user_telegram_id = ?'
+
+# Balance column per withdrawable asset.
+_CREDIT_USER = {
+    'TON': 'UPDATE users SET ton_balance = ton_balance + ? WHERE telegram_id = ?',
+    'STARS': 'UPDATE users SET stars_balance = stars_balance + ? WHERE telegram_id = ?',
+}
+_DEBIT_HOSTED = {
+    'TON': 'UPDATE hosted_bot_users SET ton_balance = ton_balance - ? WHERE bot_id = ? AND user_telegram_id = ?',
+    'STARS': 'UPDATE hosted_bot_users SET stars_balance = stars_balance - ? WHERE bot_id = ? AND user_telegram_id = ?',
+}
+_CREDIT_HOSTED = {
+    'TON': 'UPDATE hosted_bot_users SET ton_balance = ton_balance + ? WHERE bot_id = ? AND user_telegram_id = ?',
+    'STARS': 'UPDATE hosted_bot_users SET stars_balance = stars_balance + ? WHERE bot_id = ? AND user_telegram_id = ?',
+}
+
+
+def _asset_amount(asset: str, amount):
+    return amount if asset == 'TON' else int(amount)
+
+
+class Users:
+    @staticmethod
+    async def get(telegram_id: int, pool=db) -> Optional[User]:
+        if pool is not db:
+            return await _one(User, _USER, (telegram_id,), pool)
+        return await UserCache.get(0, telegram_id, lambda: _one(User, _USER, (telegram_id,)))
+
+    @staticmethod
+    async def search(text: str, pool=db) -> Optional[User]:
+        return await _one(User, 'SELECT telegram_id, username, full_name, referral_code, referred_by, captcha_passed, subscribed, registration_date, is_banned, points, ton_balance, stars_balance, wallet_address, last_daily_bonus, daily_streak_count, fingerprint_verified, is_admin, total_referrals, total_tasks_completed, total_earned_points FROM users WHERE username LIKE ? OR full_name LIKE ?', (f'%{text}%', f'%{text}%'), pool)
+
+    @staticmethod
+    async def balance(telegram_id: int) -> Optional[Balance]:
+        return await _one(Balance, 'SELECT telegram_id, full_name, points, ton_balance, stars_balance, wallet_address FROM users WHERE telegram_id = ?', (telegram_id,))
+
+    @staticmethod
+    async def referral_info(telegram_id: int) -> Optional[ReferralInfo]:
+        return await _one(ReferralInfo, 'SELECT referral_code, total_referrals FROM users WHERE telegram_id = ?', (telegram_id,))
+
+    @staticmethod
+    async def id_by_referral_code(code: str) -> Optional[int]:
+        return await db.fetchval('SELECT telegram_id FROM users WHERE referral_code = ?', (code,))
+
+    @staticmethod
+    async def referred_by(telegram_id: int) -> Optional[int]:
+        return await db.fetchval('SELECT referred_by FROM users WHERE telegram_id = ?', (telegram_id,))
+
+    @staticmethod
+    async def is_admin(telegram_id: int) -> bool:
+        return await db.fetchval('SELECT is_admin FROM users WHERE telegram_id = ?', (telegram_id,), 0) == 1
+
+    @staticmethod
+    async def is_fingerprint_verified(telegram_id: int) -> bool:
+        return await db.fetchval('SELECT fingerprint_verified FROM users WHERE telegram_id = ?', (telegram_id,), 0) == 1
+
+    @staticmethod
+    async def active_ids() -> List[int]:
+        return await _column('SELECT telegram_id FROM users WHERE is_banned = 0')
+
+    @staticmethod
+    async def streaks(since: str) -> List[Streak]:
+        """Running daily streaks claimed after ``since`` (banned users excluded)."""
+        return await _all(Streak, 'SELECT telegram_id, last_daily_bonus, daily_streak_count FROM users WHERE last_daily_bonus > ? AND daily_streak_count > 0 AND +is_banned = 0', (since,))
+
+    @staticmethod
+    async def banned(limit: int = 20) -> List[User]:
+        return await _all(User, 'SELECT telegram_id, username, full_name, referral_code, referred_by, captcha_passed, subscribed, registration_date, is_banned, points, ton_balance, stars_balance, wallet_address, last_daily_bonus, daily_streak_count, fingerprint_verified, is_admin, total_referrals, total_tasks_completed, total_earned_points FROM users WHERE is_banned = 1 ORDER BY registration_date DESC LIMIT ?', (limit,))
+
+    @staticmethod
+    async def create(telegram_id: int, username, full_name, referral_code: str, referred_by: Optional[int]):
+        await db.execute('INSERT INTO users (telegram_id, username, full_name, referral_code, referred_by) VALUES (?, ?, ?, ?, ?)', (telegram_id, username, full_name, referral_code, referred_by))
+        UserCache.invalidate(0, telegram_id, db)
+
+    @staticmethod
+    async def set_admin(telegram_id: int):
+        await db.execute('UPDATE users SET is_admin = 1 WHERE telegram_id = ?', (telegram_id,))
+        UserCache.invalidate(0, telegram_id, db)
+
+    @staticmethod
+    async def set_captcha_passed(telegram_id: int):
+        await db.execute('UPDATE users SET captcha_passed = 1 WHERE telegram_id = ?', (telegram_id,))
+        UserCache.invalidate(0, telegram_id, db)
+
+    @staticmethod
+    async def set_subscribed(telegram_id: int):
+        await db.execute('UPDATE users SET subscribed = 1 WHERE telegram_id = ?', (telegram_id,))
+        UserCache.invalidate(0, telegram_id, db)
+
+    @staticmethod
+    async def set_banned(telegram_id: int, banned: bool):
+        await db.execute('UPDATE users SET is_banned = ? WHERE telegram_id = ?', (1 if banned else 0, telegram_id))
+        UserCache.invalidate(0, telegram_id, db)
+        if banned:
+            Leaderboards.forget(0, telegram_id)
+
+    @staticmethod
+    async def set_wallet(telegram_id: int, address: str):
+        await db.execute('UPDATE users SET wallet_address = ? WHERE telegram_id = ?', (address, telegram_id))
+        UserCache.invalidate(0, telegram_id, db)
+
+    @staticmethod
+    async def add_referral(telegram_id: int, points: int):
+        row = await _returning(db, 'UPDATE users SET points = points + ?, total_referrals = total_referrals + 1 WHERE telegram_id = ? RETURNING total_referrals', (points, telegram_id))
+        UserCache.invalidate(0, telegram_id, db)
+        if row:
+            Leaderboards.record(0, 'referrals', telegram_id, row[0], db)
+
+    @staticmethod
+    async def credit(telegram_id: int, asset: str, amount):
+        await db.execute(_CREDIT_USER[asset], (_asset_amount(asset, amount), telegram_id))
+        UserCache.invalidate(0, telegram_id, db)
+
+
+class UserSettings:
+    @staticmethod
+    async def notifications_enabled(user_id: int) -> bool:
+        return await db.fetchval('SELECT notifications_enabled FROM user_settings WHERE user_id = ?', (user_id,), 1) == 1
+
+    @staticmethod
+    async def set_notifications(user_id: int, enabled: bool):
+        await db.execute('INSERT INTO user_settings (user_id, notifications_enabled) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET notifications_enabled = excluded.notifications_enabled', (user_id, 1 if enabled else 0))
+
+    @staticmethod
+    async def muted(user_ids: List[int]) -> Set[int]:
+        """Those of ``user_ids`` who turned notifications off."""
+        if not user_ids:
+            return set()
+        return set(await _column(f"SELECT user_id FROM user_settings WHERE notifications_enabled = 0 AND user_id IN ({', '.join('?' * len(user_ids))})", tuple(user_ids)))
+
+
+class Referrals:
+    @staticmethod
+    async def create(referrer_id: int, referred_id: int, points: int):
+        await db.execute('INSERT INTO referrals (referrer_id, referred_id, is_valid, points) VALUES (?, ?, 0, ?)', (referrer_id, referred_id, points))
+
+    @staticmethod
+    async def pending_for(referred_id: int) -> Optional[Referral]:
+        return await _one(Referral, 'SELECT id, referrer_id FROM referrals WHERE referred_id = ? AND is_valid = 0', (referred_id,))
+
+    @staticmethod
+    async def validate(referral_id: int, points: int):
+        await db.execute('UPDATE referrals SET is_valid = 1, points = ? WHERE id = ?', (points, referral_id))
+
+    @staticmethod
+    async def count_valid(referrer_id: int, pool=db) -> int:
+        return await pool.fetchval('SELECT COUNT(*) FROM referrals WHERE referrer_id = ? AND is_valid = 1', (referrer_id,), 0)
+
+
+class Tasks:
+    @staticmethod
+    async def get(task_id: int) -> Optional[Task]:
+        return await _one(Task, 'SELECT id, name, description, link, points, is_active, max_completions FROM tasks WHERE id = ?', (task_id,))
+
+    @staticmethod
+    async def active() -> List[Task]:
+        return await _all(Task, 'SELECT id, name, description, link, points, is_active, max_completions FROM tasks WHERE is_active = 1 ORDER BY points DESC')
+
+    @staticmethod
+    async def all() -> List[Task]:
+        return await _all(Task, 'SELECT id, name, description, link, points, is_active, max_completions FROM tasks ORDER BY is_active DESC, points DESC')
+
+    @staticmethod
+    async def count_active() -> int:
+        return await db.fetchval('SELECT COUNT(*) FROM tasks WHERE is_active = 1', (), 0)
+
+    @staticmethod
+    async def completed_ids(user_id: int) -> Set[int]:
+        return set(await _column('SELECT task_id FROM user_tasks WHERE user_id = ?', (user_id,)))
+
+    @staticmethod
+    async def count_completed(user_id: int, pool=db) -> int:
+        return await pool.fetchval('SELECT COUNT(*) FROM user_tasks WHERE user_id = ?', (user_id,), 0)
+
+    @staticmethod
+    async def count_completions(pool=db) -> int:
+        return await pool.fetchval("SELECT value FROM system_counters WHERE name = 'task_completions'", (), 0)
+
+    @staticmethod
+    async def create(name: str, points: int, link: str, max_completions: int):
+        await db.execute('INSERT INTO tasks (name, points, link, max_completions, is_active) VALUES (?, ?, ?, ?, 1)', (name, points, link, max_completions))
+
+    @staticmethod
+    async def set_active(task_id: int, active: bool):
+        await db.execute('UPDATE tasks SET is_active = ? WHERE id = ?', (1 if active else 0, task_id))
+
+    @staticmethod
+    async def delete(task_id: int):
+        await db.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+
+
+class Withdrawals:
+    @staticmethod
+    async def get(withdrawal_id: int) -> Optional[Withdrawal]:
+        return await _one(Withdrawal, 'SELECT id, user_id, asset_type, amount, wallet_address, status, request_date FROM withdrawals WHERE id = ?', (withdrawal_id,))
+
+    @staticmethod
+    async def pending(limit: int = 10) -> List[Withdrawal]:
+        return await _all(Withdrawal, "SELECT w.id, w.user_id, w.asset_type, w.amount, w.wallet_address, w.status, w.request_date, 0, u.full_name, u.username FROM withdrawals w JOIN users u ON w.user_id = u.telegram_id WHERE w.status = 'pending' ORDER BY w.request_date DESC LIMIT ?", (limit,))
+
+    @staticmethod
+    async def approve(withdrawal_id: int, processed_at: str, processed_by: int):
+        await db.execute("UPDATE withdrawals SET status = 'approved', processed_date = ?, processed_by = ? WHERE id = ?", (processed_at, processed_by, withdrawal_id))
+
+    @staticmethod
+    async def reject(withdrawal_id: int, reason: str, processed_at: str, processed_by: int):
+        await db.execute("UPDATE withdrawals SET status = 'rejected', notes = ?, processed_date = ?, processed_by = ? WHERE id = ?", (reason, processed_at, processed_by, withdrawal_id))
+
+
+class HostedBots:
+    @staticmethod
+    async def get_owned(bot_id: int, owner_id: int) -> Optional[HostedBot]:
+        return await _one(HostedBot, 'SELECT id, bot_token, bot_username, bot_name, owner_id, plan_type, is_active, expires_at, max_users, current_users, total_points_given, created_at FROM hosted_bots WHERE id = ? AND owner_id = ?', (bot_id, owner_id))
+
+    @staticmethod
+    async def by_owner(owner_id: int) -> List[HostedBot]:
+        return await _all(HostedBot, 'SELECT id, bot_token, bot_username, bot_name, owner_id, plan_type, is_active, expires_at, max_users, current_users, total_points_given, created_at FROM hosted_bots WHERE owner_id = ? ORDER BY created_at DESC', (owner_id,))
+
+    @staticmethod
+    async def latest(limit: int = 10, pool=db) -> List[HostedBot]:
+        return await _all(HostedBot, 'SELECT hb.id, hb.bot_token, hb.bot_username, hb.bot_name, hb.owner_id, hb.plan_type, hb.is_active, hb.expires_at, hb.max_users, hb.current_users, hb.total_points_given, hb.created_at, u.full_name FROM hosted_bots hb JOIN users u ON hb.owner_id = u.telegram_id ORDER BY hb.created_at DESC LIMIT ?', (limit,), pool)
+
+    @staticmethod
+    async def active() -> List[HostedBot]:
+        return await _all(HostedBot, 'SELECT id, bot_token, bot_username, bot_name, owner_id, plan_type, is_active, expires_at, max_users, current_users, total_points_given, created_at FROM hosted_bots WHERE is_active = 1')
+
+    @staticmethod
+    async def ids() -> List[int]:
+        return await _column('SELECT id FROM hosted_bots')
+
+    @staticmethod
+    async def startable() -> List[StartableBot]:
+        return await _all(StartableBot, 'SELECT id, bot_token, bot_username, owner_id, last_activity FROM hosted_bots WHERE is_active = 1')
+
+    @staticmethod
+    async def exists(token: str, username: str) -> bool:
+        return await db.fetchval('SELECT 1 FROM hosted_bots WHERE bot_token = ? OR bot_username = ?', (token, username)) is not None
+
+    @staticmethod
+    async def token(bot_id: int) -> Optional[str]:
+        return await db.fetchval('SELECT bot_token FROM hosted_bots WHERE id = ?', (bot_id,))
+
+    @staticmethod
+    async def is_active(bot_id: int) -> bool:
+        return await db.fetchval('SELECT is_active FROM hosted_bots WHERE id = ?', (bot_id,), 0) == 1
+
+    @staticmethod
+    async def config(bot_id: int) -> Optional[str]:
+        return await db.fetchval('SELECT config FROM hosted_bots WHERE id = ?', (bot_id,))
+
+    @staticmethod
+    async def has_capacity(bot_id: int) -> bool:
+        return await db.fetchval('SELECT current_users < max_users FROM hosted_bots WHERE id = ?', (bot_id,), 0) == 1
+
+    @staticmethod
+    async def create(token: str, username: str, name: str, owner_id: int, max_users: int, config: str) -> int:
+        cur = await db.execute("INSERT INTO hosted_bots (bot_token, bot_username, bot_name, owner_id, plan_type, max_users, config) VALUES (?, ?, ?, ?, 'free', ?, ?)", (token, username, name, owner_id, max_users, config))
+        return cur.lastrowid
+
+    @staticmethod
+    async def update_token(bot_id: int, token: str, username: str, name: str):
+        await db.execute('UPDATE hosted_bots SET bot_token = ?, bot_username = ?, bot_name = ?, is_active = 1 WHERE id = ?', (token, username, name, bot_id))
+
+    @staticmethod
+    async def mark_running(bot_id: int, at: str):
+        await db.execute('UPDATE hosted_bots SET is_active = 1, last_activity = COALESCE(last_activity, ?) WHERE id = ?', (at, bot_id))
+
+    @staticmethod
+    async def touch(activity: Dict[int, str]):
+        """Store the time of each bot's latest update, ``{bot_id: iso time}``, in one write."""
+        async def apply(conn):
+            await conn.executemany('UPDATE hosted_bots SET last_activity = ? WHERE id = ?', [(at, bot_id) for bot_id, at in activity.items()])
+        if activity:
+            await db.write(apply)
+
+    @staticmethod
+    async def mark_stopped(bot_id: int):
+        await db.execute('UPDATE hosted_bots SET is_active = 0 WHERE id = ?', (bot_id,))
+
+    @staticmethod
+    async def set_config(bot_id: int, config: str):
+        await db.execute('UPDATE hosted_bots SET config = ? WHERE id = ?', (config, bot_id))
+
+    @staticmethod
+    async def delete(bot_id: int, with_users: bool = False):
+        tenant = with_users and TenantStore.pool(bot_id) is not db
+        async def apply(conn):
+            if with_users and not tenant:
+                await conn.execute('DELETE FROM hosted_bot_users WHERE bot_id = ?', (bot_id,))
+            await conn.execute('DELETE FROM hosted_bots WHERE id = ?', (bot_id,))
+        await db.write(apply)
+        UserCache.drop_bot(bot_id)
+        Leaderboards.drop_scope(bot_id)
+        if tenant:
+            await TenantStore.drop(bot_id)
+
+
+class HostedUsers:
+    @staticmethod
+    async def get(bot_id: int, user_id: int, pool=None) -> Optional[HostedUser]:
+        if pool is not None:
+            return await _one(HostedUser, _HOSTED_USER, (bot_id, user_id), pool)
+        return await UserCache.get(bot_id, user_id, lambda: _one(HostedUser, _HOSTED_USER, (bot_id, user_id), TenantStore.pool(bot_id)))
+
+    @staticmethod
+    async def id_by_referral_code(bot_id: int, code: str) -> Optional[int]:
+        return await TenantStore.pool(bot_id).fetchval('SELECT user_telegram_id FROM hosted_bot_users WHERE bot_id = ? AND referral_code = ?', (bot_id, code))
+
+    @staticmethod
+    async def ids(bot_id: int) -> List[int]:
+        return await _column('SELECT user_telegram_id FROM hosted_bot_users WHERE bot_id = ?', (bot_id,), TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def streaks(bot_id: int, since: str) -> List[Streak]:
+        return await _all(Streak, 'SELECT user_telegram_id, last_daily_bonus, daily_streak_count FROM hosted_bot_users WHERE bot_id = ? AND last_daily_bonus > ? AND daily_streak_count > 0 AND is_banned = 0', (bot_id, since), TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def count(bot_id: int, pool=None) -> int:
+        return await (pool or TenantStore.pool(bot_id)).fetchval('SELECT COUNT(*) FROM hosted_bot_users WHERE bot_id = ?', (bot_id,), 0)
+
+    @staticmethod
+    async def total_points(bot_id: int, pool=None) -> int:
+        return await (pool or TenantStore.pool(bot_id)).fetchval('SELECT SUM(points) FROM hosted_bot_users WHERE bot_id = ?', (bot_id,), 0)
+
+    @staticmethod
+    async def count_referred_by(bot_id: int, user_id: int, pool=None) -> int:
+        return await (pool or TenantStore.pool(bot_id)).fetchval('SELECT COUNT(*) FROM hosted_bot_users WHERE bot_id = ? AND referred_by = ?', (bot_id, user_id), 0)
+
+    @staticmethod
+    async def count_referred(bot_id: int, pool=None) -> int:
+        return await (pool or TenantStore.pool(bot_id)).fetchval('SELECT COUNT(*) FROM hosted_bot_users WHERE bot_id = ? AND referred_by IS NOT NULL', (bot_id,), 0)
+
+    @staticmethod
+    async def create(bot_id: int, user_id: int, username, full_name, referral_code: str, referred_by: Optional[int], joined_at: str):
+        """Insert the user and bump the catalog's ``current_users``.
+
+        One transaction in shared mode; in tenant mode the catalog row lives in
+        the main database, so the bump is a separate commit made only once the
+        tenant insert has succeeded.
+        """
+        tenant = TenantStore.pool(bot_id)
+        bump = ('UPDATE hosted_bots SET current_users = current_users + 1, last_activity = ? WHERE id = ?', (joined_at, bot_id))
+        async with tenant.transaction():
+            await tenant.execute('INSERT INTO hosted_bot_users (bot_id, user_telegram_id, username, full_name, referral_code, referred_by, joined_at, last_activity, points) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)', (bot_id, user_id, username, full_name, referral_code, referred_by, joined_at, joined_at))
+            if tenant is db:
+                await db.execute(*bump)
+        if tenant is not db:
+            await db.execute(*bump)
+        UserCache.invalidate(bot_id, user_id, tenant)
+
+    @staticmethod
+    async def add_points(bot_id: int, user_id: int, points: int, action: str, description: Optional[str] = None):
+        """Credit earned points and record them in the bot's ledger in one write."""
+        async def apply(conn):
+            async with conn.execute('UPDATE hosted_bot_users SET points = points + ?, total_earned_points = total_earned_points + ? WHERE bot_id = ? AND user_telegram_id = ? RETURNING total_earned_points', (points, points, bot_id, user_id)) as cur:
+                row = await cur.fetchone()
+            await conn.execute('INSERT INTO hosted_bot_points_history (bot_id, user_id, action_type, points, description) VALUES (?, ?, ?, ?, ?)', (bot_id, user_id, action, points, description))
+            return row
+        pool = TenantStore.pool(bot_id)
+        row = await pool.write(apply)
+        UserCache.invalidate(bot_id, user_id, pool)
+        if row:
+            Leaderboards.record(bot_id, 'earned', user_id, row[0], pool)
+
+    @staticmethod
+    async def set_notifications(bot_id: int, user_id: int, enabled: bool):
+        pool = TenantStore.pool(bot_id)
+        await pool.execute('UPDATE hosted_bot_users SET notifications_enabled = ? WHERE bot_id = ? AND user_telegram_id = ?', (1 if enabled else 0, bot_id, user_id))
+        UserCache.invalidate(bot_id, user_id, pool)
+
+    @staticmethod
+    async def muted(bot_id: int, user_ids: List[int]) -> Set[int]:
+        """Those of ``user_ids`` who turned this bot's reminders off."""
+        if not user_ids:
+            return set()
+        return set(await _column(f"SELECT user_telegram_id FROM hosted_bot_users WHERE bot_id = ? AND notifications_enabled = 0 AND user_telegram_id IN ({', '.join('?' * len(user_ids))})", (bot_id, *user_ids), TenantStore.pool(bot_id)))
+
+    @staticmethod
+    async def log_points(bot_id: int, user_id: int, action: str, points: int, description: Optional[str] = None):
+        await TenantStore.pool(bot_id).execute('INSERT INTO hosted_bot_points_history (bot_id, user_id, action_type, points, description) VALUES (?, ?, ?, ?, ?)', (bot_id, user_id, action, points, description))
+
+    @staticmethod
+    async def add_referral(bot_id: int, user_id: int):
+        pool = TenantStore.pool(bot_id)
+        row = await _returning(pool, 'UPDATE hosted_bot_users SET total_referrals = total_referrals + 1 WHERE bot_id = ? AND user_telegram_id = ? RETURNING total_referrals', (bot_id, user_id))
+        UserCache.invalidate(bot_id, user_id, pool)
+        if row:
+            Leaderboards.record(bot_id, 'referrals', user_id, row[0], pool)
+
+    @staticmethod
+    async def set_wallet(bot_id: int, user_id: int, address: str):
+        await TenantStore.pool(bot_id).execute('UPDATE hosted_bot_users SET wallet_address = ? WHERE bot_id = ? AND user_telegram_id = ?', (address, bot_id, user_id))
+        UserCache.invalidate(bot_id, user_id, TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def credit_daily_bonus(bot_id: int, user_id: int, bonus: int, streak: int, claimed_at: str):
+        pool = TenantStore.pool(bot_id)
+        row = await _returning(pool, 'UPDATE hosted_bot_users SET points = points + ?, last_daily_bonus = ?, daily_streak_count = ?, total_earned_points = total_earned_points + ? WHERE bot_id = ? AND user_telegram_id = ? RETURNING total_earned_points', (bonus, claimed_at, streak, bonus, bot_id, user_id))
+        UserCache.invalidate(bot_id, user_id, pool)
+        if row:
+            Leaderboards.record(bot_id, 'earned', user_id, row[0], pool)
+
+    @staticmethod
+    async def convert(bot_id: int, user_id: int, points: int, ton: float = 0, stars: int = 0):
+        await TenantStore.pool(bot_id).execute('UPDATE hosted_bot_users SET points = points - ?, ton_balance = ton_balance + ?, stars_balance = stars_balance + ? WHERE bot_id = ? AND user_telegram_id = ?', (points, ton, stars, bot_id, user_id))
+        UserCache.invalidate(bot_id, user_id, TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def debit(bot_id: int, user_id: int, asset: str, amount):
+        await TenantStore.pool(bot_id).execute(_DEBIT_HOSTED[asset], (_asset_amount(asset, amount), bot_id, user_id))
+        UserCache.invalidate(bot_id, user_id, TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def credit(bot_id: int, user_id: int, asset: str, amount):
+        await TenantStore.pool(bot_id).execute(_CREDIT_HOSTED[asset], (_asset_amount(asset, amount), bot_id, user_id))
+        UserCache.invalidate(bot_id, user_id, TenantStore.pool(bot_id))
+
+
+class HostedTasks:
+    @staticmethod
+    async def get(bot_id: int, task_id: int) -> Optional[Task]:
+        return await _one(Task, 'SELECT id, name, description, link, points, is_active, max_completions FROM hosted_bot_tasks WHERE id = ? AND bot_id = ?', (task_id, bot_id), TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def active(bot_id: int) -> List[Task]:
+        return await _all(Task, 'SELECT id, name, description, link, points, is_active, max_completions FROM hosted_bot_tasks WHERE bot_id = ? AND is_active = 1', (bot_id,), TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def all(bot_id: int) -> List[Task]:
+        return await _all(Task, 'SELECT id, name, description, link, points, is_active, max_completions FROM hosted_bot_tasks WHERE bot_id = ?', (bot_id,), TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def completed_ids(bot_id: int, user_id: int) -> Set[int]:
+        return set(await _column('SELECT task_id FROM hosted_bot_user_tasks WHERE bot_id = ? AND user_id = ?', (bot_id, user_id), TenantStore.pool(bot_id)))
+
+    @staticmethod
+    async def has_completed(bot_id: int, user_id: int, task_id: int) -> bool:
+        return await TenantStore.pool(bot_id).fetchval('SELECT 1 FROM hosted_bot_user_tasks WHERE bot_id = ? AND user_id = ? AND task_id = ?', (bot_id, user_id, task_id)) is not None
+
+    @staticmethod
+    async def count_completed(bot_id: int, user_id: int, pool=None) -> int:
+        return await (pool or TenantStore.pool(bot_id)).fetchval('SELECT COUNT(*) FROM hosted_bot_user_tasks WHERE bot_id = ? AND user_id = ?', (bot_id, user_id), 0)
+
+    @staticmethod
+    async def count_completions(bot_id: int, pool=None) -> int:
+        return await (pool or TenantStore.pool(bot_id)).fetchval('SELECT COUNT(*) FROM hosted_bot_user_tasks WHERE bot_id = ?', (bot_id,), 0)
+
+    @staticmethod
+    async def complete(bot_id: int, user_id: int, task_id: int):
+        await TenantStore.pool(bot_id).execute('INSERT INTO hosted_bot_user_tasks (bot_id, user_id, task_id) VALUES (?, ?, ?)', (bot_id, user_id, task_id))
+
+    @staticmethod
+    async def create(bot_id: int, name: str, points: int, link: str, max_completions: int):
+        await TenantStore.pool(bot_id).execute('INSERT INTO hosted_bot_tasks (bot_id, name, points, link, max_completions, is_active) VALUES (?, ?, ?, ?, ?, 1)', (bot_id, name, points, link, max_completions))
+
+    @staticmethod
+    async def delete(bot_id: int, task_id: int):
+        await TenantStore.pool(bot_id).execute('DELETE FROM hosted_bot_tasks WHERE id = ? AND bot_id = ?', (task_id, bot_id))
+
+
+class HostedWithdrawals:
+    @staticmethod
+    async def get(bot_id: int, withdrawal_id: int) -> Optional[Withdrawal]:
+        return await _one(Withdrawal, 'SELECT id, user_id, asset_type, amount, wallet_address, status, request_date, bot_id FROM hosted_bot_withdrawals WHERE id = ? AND bot_id = ?', (withdrawal_id, bot_id), TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def pending(bot_id: int) -> List[Withdrawal]:
+        return await _all(Withdrawal, "SELECT w.id, w.user_id, w.asset_type, w.amount, w.wallet_address, w.status, w.request_date, w.bot_id, u.full_name FROM hosted_bot_withdrawals w JOIN hosted_bot_users u ON w.user_id = u.user_telegram_id AND w.bot_id = u.bot_id WHERE w.bot_id = ? AND w.status = 'pending'", (bot_id,), TenantStore.pool(bot_id))
+
+    @staticmethod
+    async def count_pending(bot_id: int, pool=None) -> int:
+        return await (pool or TenantStore.pool(bot_id)).fetchval("SELECT COUNT(*) FROM hosted_bot_withdrawals WHERE bot_id = ? AND status = 'pending'", (bot_id,), 0)
+
+    @staticmethod
+    async def create(bot_id: int, user_id: int, asset: str, amount, wallet_address: Optional[str]) -> int:
+        cur = await TenantStore.pool(bot_id).execute("INSERT INTO hosted_bot_withdrawals (bot_id, user_id, asset_type, amount, wallet_address, status) VALUES (?, ?, ?, ?, ?, 'pending')", (bot_id, user_id, asset, amount, wallet_address))
+        return cur.lastrowid
+
+    @staticmethod
+    async def approve(bot_id: int, withdrawal_id: int, processed_at: str):
+        await TenantStore.pool(bot_id).execute("UPDATE hosted_bot_withdrawals SET status = 'approved', processed_date = ? WHERE id = ? AND bot_id = ?", (processed_at, withdrawal_id, bot_id))
+
+    @staticmethod
+    async def reject(bot_id: int, withdrawal_id: int, reason: str, processed_at: str, processed_by: Optional[int] = None):
+        await TenantStore.pool(bot_id).execute("UPDATE hosted_bot_withdrawals SET status = 'rejected', notes = ?, processed_date = ?, processed_by = ? WHERE id = ? AND bot_id = ?", (reason, processed_at, processed_by, withdrawal_id, bot_id))
+
+
+def _benchmark(rows: int = 5000, rounds: int = 20):
+    """Retained bytes per fetched row and lookup throughput, ``SELECT *`` rows vs projected slotted models."""
+    import sqlite3
+    import time
+    import tracemalloc
+    from .migrations import migrate
+
+    def connect(cached_statements=256):
+        conn = sqlite3.connect(':memory:', cached_statements=cached_statements)
+        migrate(conn)
+        conn.executemany('INSERT INTO users (telegram_id, username, full_name, referral_code, points, fingerprint_components, ip_address) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [(i, f'user{i}', f'User {i}', f'ref{i}', i, '{"canvas": "%s"}' % ('x' * 512), '10.0.0.1') for i in range(rows)])
+        return conn
+
+    def measure(conn, sql, factory):
+        conn.row_factory = factory
+        tracemalloc.start()
+        kept = [conn.execute(sql, (i,)).fetchone() for i in range(rows)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for i in range(rows):
+                conn.execute(sql, (i,)).fetchone()
+        return size / rows, rows * rounds / (time.perf_counter() - start)
+
+    balance_sql = 'SELECT telegram_id, full_name, points, ton_balance, stars_balance, wallet_address FROM users WHERE telegram_id = ?'
+    cases = [('SELECT * -> sqlite3.Row', 'SELECT * FROM users WHERE telegram_id = ?', sqlite3.Row),
+             ('projected -> User', 'SELECT telegram_id, username, full_name, referral_code, referred_by, captcha_passed, subscribed, registration_date, is_banned, points, ton_balance, stars_balance, wallet_address, last_daily_bonus, daily_streak_count, fingerprint_verified, is_admin, total_referrals, total_tasks_completed, total_earned_points FROM users WHERE telegram_id = ?', User.from_row),
+             ('projected -> Balance', balance_sql, Balance.from_row)]
+    conn = connect()
+    print(f'{rows} rows x {rounds} rounds')
+    for label, sql, factory in cases:
+        per_row, qps = measure(conn, sql, factory)
+        print(f'{label:<28} {per_row:8.0f} B/row retained {qps:10.0f} lookups/s')
+    conn.close()
+    for cached in (0, 256):
+        conn = connect(cached)
+        _, qps = measure(conn, balance_sql, Balance.from_row)
+        print(f'{"statement cache = " + str(cached):<28} {"":8} {"":15} {qps:10.0f} lookups/s')
+        conn.close()
+
+
+if __name__ == '__main__':
+    _benchmark()
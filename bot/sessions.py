@@ -0,0 +1,162 @@
+"""One HTTP session for every ``Bot`` in the process.
+
+aiogram gives each ``Bot`` its own ``AiohttpSession``: a connector, a TLS
+context and keep-alive sockets of its own, all talking to the same Bot API
+host. ``new_bot`` builds bots on one shared session instead (the token is
+part of each request URL, not of the session), so the main bot, the hosted
+bots and the throwaway bots used to check a token reuse one bounded pool of
+keep-alive connections and one DNS cache. ``close`` on the shared session is
+a no-op, so existing ``bot.session.close()`` calls and ``start_polling`` do
+not tear it down for the others; ``Sessions.shutdown`` closes it on exit.
+
+A request middleware times every call per bot (long-polling ``getUpdates``
+is counted but left out of the latency figures). ``HTTP_LIMIT_PER_HOST``
+bounds the open connections; a polling bot holds one for each long poll, so
+the default is unbounded unless webhooks are enabled.
+
+``python -m bot.sessions [N]`` compares memory and open sockets of N bots
+with separate sessions against N bots sharing one, on a local fake Bot API.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
+from aiogram.methods import GetUpdates
+from .config import TELEGRAM_API_URL, HTTP_POOL_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_KEEPALIVE_SECONDS, HTTP_DNS_CACHE_SECONDS
+
+
+class SharedSession(AiohttpSession):
+    """``AiohttpSession`` that outlives the bots using it: ``close`` does nothing, ``shutdown`` closes it."""
+
+    def __init__(self, api: TelegramAPIServer = PRODUCTION, limit: int = HTTP_POOL_LIMIT, limit_per_host: int = HTTP_LIMIT_PER_HOST):
+        super().__init__(api=api, limit=limit)
+        self._connector_init.update(limit_per_host=limit_per_host, keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+                                    ttl_dns_cache=HTTP_DNS_CACHE_SECONDS, use_dns_cache=True)
+
+    async def close(self):
+        pass
+
+    async def shutdown(self):
+        await super().close()
+
+    def sockets(self) -> Dict[str, int]:
+        """Connections the pool holds: in use and idle keep-alive."""
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        if connector is None:
+            return {'in_use': 0, 'idle': 0}
+        return {'in_use': len(getattr(connector, '_acquired', ())), 'idle': sum(len(c) for c in getattr(connector, '_conns', {}).values())}
+
+
+class _Timer(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = await make_request(bot, method)
+            failed = False
+            return response
+        finally:
+            Sessions._record(bot.id, time.perf_counter() - start, failed, isinstance(method, GetUpdates))
+
+
+class Sessions:
+    shared: Optional[SharedSession] = None
+    # Telegram bot id -> [requests, seconds, slowest, errors, long polls].
+    latency: Dict[int, List[float]] = {}
+
+    @staticmethod
+    def session() -> SharedSession:
+        if Sessions.shared is None:
+            api = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION
+            Sessions.shared = SharedSession(api)
+            Sessions.shared.middleware(_Timer())
+        return Sessions.shared
+
+    @staticmethod
+    def _record(bot_id: int, seconds: float, failed: bool, long_poll: bool):
+        entry = Sessions.latency.setdefault(bot_id, [0, 0.0, 0.0, 0, 0])
+        if long_poll:
+            entry[4] += 1
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+        entry[3] += failed
+
+    @staticmethod
+    def bot_stats(bot_id: int) -> Dict[str, float]:
+        n, total, slowest, errors, polls = Sessions.latency.get(bot_id, (0, 0.0, 0.0, 0, 0))
+        return {'requests': n, 'avg_ms': round(1000 * total / n, 1) if n else 0.0, 'max_ms': round(1000 * slowest, 1), 'errors': errors, 'polls': polls}
+
+    @staticmethod
+    def get_stats() -> Dict[str, float]:
+        n = sum(e[0] for e in Sessions.latency.values())
+        total = sum(e[1] for e in Sessions.latency.values())
+        slowest = max(Sessions.latency, key=lambda b: Sessions.latency[b][1] / max(1, Sessions.latency[b][0]), default=None)
+        sockets = Sessions.shared.sockets() if Sessions.shared is not None else {'in_use': 0, 'idle': 0}
+        return {**sockets, 'bots': len(Sessions.latency), 'requests': n, 'avg_ms': round(1000 * total / n, 1) if n else 0.0,
+                'errors': sum(e[3] for e in Sessions.latency.values()), 'slowest_bot': slowest,
+                'slowest_ms': Sessions.bot_stats(slowest)['avg_ms'] if slowest is not None else 0.0}
+
+    @staticmethod
+    async def shutdown():
+        if Sessions.shared is not None:
+            await Sessions.shared.shutdown()
+            Sessions.shared = None
+
+
+def new_bot(token: str, **kwargs) -> Bot:
+    """A ``Bot`` on the shared session."""
+    return Bot(token=token, session=Sessions.session(), **kwargs)
+
+
+async def _compare(n: int):
+    import gc
+    import os
+    import tracemalloc
+    from aiohttp import web
+
+    async def fake_api(request):
+        bot_id = int(request.match_info['token'].split(':')[0])
+        return web.json_response({'ok': True, 'result': {'id': bot_id, 'is_bot': True, 'first_name': 'b', 'username': f'b{bot_id}'}})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', fake_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 18083).start()
+    api = TelegramAPIServer.from_base('http://127.0.0.1:18083')
+
+    def rss() -> int:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    async def run(label: str, make):
+        gc.collect()
+        tracemalloc.start()
+        before, rss_before = tracemalloc.get_traced_memory()[0], rss()
+        start = time.perf_counter()
+        bots = [make(f"{i + 1}:test") for i in range(n)]
+        await asyncio.gather(*(b.get_me() for b in bots))
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        used, rss_used = tracemalloc.get_traced_memory()[0] - before, rss() - rss_before
+        tracemalloc.stop()
+        sessions = {id(b.session): b.session for b in bots}.values()
+        sockets = sum(sum(len(c) for c in s._session.connector._conns.values()) for s in sessions)
+        print(f"{label}: {n} bots, {len(sessions)} sessions, {sockets} keep-alive sockets, {used / 1024 / 1024:.1f} MiB Python heap, {rss_used / 1024 / 1024:.1f} MiB RSS, get_me x{n} in {elapsed:.2f}s")
+        await asyncio.gather(*(AiohttpSession.close(s) for s in sessions))
+
+    # Shared first: RSS only grows, so the second run would reuse pages the first one freed.
+    shared = SharedSession(api, limit=100, limit_per_host=32)
+    await run('shared session', lambda token: Bot(token=token, session=shared))
+    await run('separate sessions', lambda token: Bot(token=token, session=AiohttpSession(api=api)))
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(_compare(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -31,6 +31,11 @@ class SettingsStates(StatesGroup):
     set_max_users_per_ip = State()
     set_ban_duration = State()
     set_max_attempts = State()
+    set_max_users_subnet24 = State()
+    set_max_users_subnet16 = State()
+    set_max_users_subnet64 = State()
+    set_max_bans_subnet = State()
+    set_device_similarity = State()
     set_secret_expiry = State()
     set_free_max_users = State()
     set_premium_max_users = State()
@@ -0,0 +1,180 @@
+"""Per-tenant storage for hosted bots.
+
+With ``HOSTED_DB_MODE=tenant`` every hosted bot keeps its users, tasks, points
+ledger and withdrawals in its own file, ``TENANT_DB_DIR/bot_<id>.db``, so a busy
+bot only contends with itself. A tenant's pool is created on first access,
+opened lazily (applying ``TENANT_MIGRATIONS``) and closed again after
+``TENANT_DB_IDLE_SECONDS`` without use. ``hosted_bots`` stays in the main
+database and serves as the catalog for cross-tenant views (owner bot lists,
+the admin bot list, user counts), which never open a tenant file.
+
+In the default ``shared`` mode ``TenantStore.pool`` returns the main pool, so
+callers are written once for both layouts; ``TenantStore.analytics`` likewise
+returns the read-only reporting pool of whichever file holds the bot.
+
+``python -m bot.tenants split [--purge]`` copies the hosted rows of an existing
+shared database into per-bot files.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+from typing import Dict
+from .config import logger, DATABASE_PATH, DB_COMMIT_INTERVAL_MS, DB_MAX_BATCH, HOSTED_DB_MODE, TENANT_DB_DIR, TENANT_DB_IDLE_SECONDS
+from .database import db, analytics, DatabasePool, ReadOnlyPool
+from .migrations import migrate, TENANT_MIGRATIONS, TENANT_TABLES
+
+
+def tenant_path(bot_id: int, root: str = TENANT_DB_DIR) -> str:
+    return os.path.join(root, f"bot_{int(bot_id)}.db")
+
+
+def _tenant_schema(conn: sqlite3.Connection):
+    migrate(conn, TENANT_MIGRATIONS)
+
+
+class TenantStore:
+    pools: Dict[int, DatabasePool] = {}
+    readonly: Dict[int, ReadOnlyPool] = {}
+
+    @staticmethod
+    def pool(bot_id: int) -> DatabasePool:
+        """Pool holding ``bot_id``'s hosted tables (the main pool in shared mode)."""
+        if HOSTED_DB_MODE != "tenant":
+            return db
+        pool = TenantStore.pools.get(bot_id)
+        if pool is None:
+            os.makedirs(TENANT_DB_DIR, exist_ok=True)
+            pool = TenantStore.pools[bot_id] = DatabasePool(
+                tenant_path(bot_id), 1, DB_COMMIT_INTERVAL_MS / 1000, DB_MAX_BATCH, schema=_tenant_schema)
+        return pool
+
+    @staticmethod
+    def analytics(bot_id: int) -> ReadOnlyPool:
+        """Read-only reporting pool over ``bot_id``'s file (the main one in shared mode)."""
+        if HOSTED_DB_MODE != "tenant":
+            return analytics
+        pool = TenantStore.readonly.get(bot_id)
+        if pool is None:
+            pool = TenantStore.readonly[bot_id] = ReadOnlyPool(TenantStore.pool(bot_id), 1)
+        return pool
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        return {"known": len(TenantStore.pools), "open": sum(p.is_open for p in TenantStore.pools.values())}
+
+    @staticmethod
+    async def close_idle(idle: float = TENANT_DB_IDLE_SECONDS) -> int:
+        closed = 0
+        for pool in list(TenantStore.readonly.values()):
+            await pool.close_if_idle(idle)
+        for pool in list(TenantStore.pools.values()):
+            closed += await pool.close_if_idle(idle)
+        return closed
+
+    @staticmethod
+    async def run_idle_closer(idle: float = TENANT_DB_IDLE_SECONDS):
+        if HOSTED_DB_MODE != "tenant":
+            return
+        while True:
+            await asyncio.sleep(max(5.0, idle / 4))
+            try:
+                closed = await TenantStore.close_idle(idle)
+                if closed:
+                    logger.info(f"Closed {closed} idle tenant database(s); {TenantStore.get_stats()['open']} still open")
+            except Exception as e:
+                logger.error(f"Tenant idle close failed: {e}")
+
+    @staticmethod
+    async def drop(bot_id: int):
+        """Close and delete ``bot_id``'s tenant file (used when the bot is deleted)."""
+        reports = TenantStore.readonly.pop(bot_id, None)
+        if reports is not None:
+            await reports.close()
+        pool = TenantStore.pools.pop(bot_id, None)
+        if pool is not None:
+            await pool.close()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(tenant_path(bot_id) + suffix)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    async def close_all():
+        for pool in TenantStore.readonly.values():
+            await pool.close()
+        for pool in TenantStore.pools.values():
+            await pool.close()
+
+
+def split(source: str = DATABASE_PATH, root: str = TENANT_DB_DIR, purge: bool = False) -> Dict[int, Dict[str, int]]:
+    """Copy each hosted bot's rows from the shared database into its tenant file.
+
+    Re-running is safe: rows already copied are skipped by primary key. The
+    bot's ledger snapshots and archived months go along, so its archive stays
+    next to its live ledger. With ``purge`` the copied rows are deleted from the
+    shared database once every table of that bot has been verified.
+    """
+    os.makedirs(root, exist_ok=True)
+    src = sqlite3.connect(source, isolation_level=None)
+    src.execute("PRAGMA busy_timeout = 5000")
+    bot_ids = sorted({r[0] for t in TENANT_TABLES for r in src.execute(f"SELECT DISTINCT bot_id FROM {t}")})
+    partitions = src.execute("SELECT table_name, month FROM ledger_partitions WHERE source = 'hosted_bot_points_history' ORDER BY month").fetchall()
+    report = {}
+    for bot_id in bot_ids:
+        conn = sqlite3.connect(tenant_path(bot_id, root))
+        migrate(conn, TENANT_MIGRATIONS)
+        conn.execute("ATTACH DATABASE ? AS shared", (source,))
+        counts = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for t in TENANT_TABLES:
+                conn.execute(f"INSERT OR IGNORE INTO main.{t} SELECT * FROM shared.{t} WHERE bot_id = ?", (bot_id,))
+                expected = conn.execute(f"SELECT COUNT(*) FROM shared.{t} WHERE bot_id = ?", (bot_id,)).fetchone()[0]
+                copied = conn.execute(f"SELECT COUNT(*) FROM main.{t} WHERE bot_id = ?", (bot_id,)).fetchone()[0]
+                if copied < expected:
+                    raise RuntimeError(f"bot {bot_id}: {t} copied {copied} of {expected} rows")
+                counts[t] = expected
+            conn.execute("INSERT OR IGNORE INTO main.ledger_snapshots SELECT * FROM shared.ledger_snapshots WHERE bot_id = ?", (bot_id,))
+            for name, month in partitions:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS main.{name} AS SELECT * FROM shared.{name} WHERE 0")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS main.idx_{name}_user ON {name}(bot_id, user_id, created_at)")
+                if not conn.execute(f"SELECT 1 FROM main.{name} WHERE bot_id = ? LIMIT 1", (bot_id,)).fetchone():
+                    conn.execute(f"INSERT INTO main.{name} SELECT * FROM shared.{name} WHERE bot_id = ?", (bot_id,))
+                rows = conn.execute(f"SELECT COUNT(*) FROM main.{name}").fetchone()[0]
+                conn.execute("INSERT INTO main.ledger_partitions (table_name, source, month, rows) VALUES (?, 'hosted_bot_points_history', ?, ?) "
+                             "ON CONFLICT(table_name) DO UPDATE SET rows = excluded.rows", (name, month, rows))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("DETACH DATABASE shared")
+            conn.close()
+        if purge:
+            src.execute("BEGIN IMMEDIATE")
+            for t in TENANT_TABLES:
+                src.execute(f"DELETE FROM {t} WHERE bot_id = ?", (bot_id,))
+            src.execute("DELETE FROM ledger_snapshots WHERE bot_id = ?", (bot_id,))
+            for name, _ in partitions:
+                src.execute(f"DELETE FROM {name} WHERE bot_id = ?", (bot_id,))
+            src.execute("COMMIT")
+        report[bot_id] = counts
+    src.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bot.tenants", description="Hosted bot tenant databases")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("split", help="copy hosted rows from the shared database into per-bot files (stop the bot first)")
+    p.add_argument("--source", default=DATABASE_PATH)
+    p.add_argument("--dir", default=TENANT_DB_DIR)
+    p.add_argument("--purge", action="store_true", help="remove the copied rows from the shared database")
+    args = parser.parse_args()
+    report = split(args.source, args.dir, args.purge)
+    for bot_id, counts in report.items():
+        print(f"bot {bot_id}: " + ", ".join(f"{t}={n}" for t, n in counts.items()))
+    print(f"{len(report)} tenant file(s) in {args.dir}" + (" (rows purged from shared database)" if args.purge else ""))
+    print("Set HOSTED_DB_MODE=tenant before restarting the bot.")
@@ -0,0 +1,269 @@
+"""Bulk export and import of the bot's tables as JSONL or CSV.
+
+``python -m bot.tools export`` streams each table through one cursor in rowid
+order, ``fetchmany`` batch by batch, so memory stays flat whatever the table
+size; ``python -m bot.tools import`` reads a file record by record and inserts
+it with ``executemany`` in one transaction per batch. ``--bot-id`` restricts
+either direction to one hosted bot (``hosted_bots.id`` / ``bot_id``) and, in
+``HOSTED_DB_MODE=tenant``, reads or writes that bot's tenant file.
+
+Both commands keep a checkpoint file (last exported rowid and output offset,
+or records imported) updated after every committed batch; re-running the same
+command continues from it, ``--restart`` starts over. In CSV an empty field is
+NULL.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from glob import glob
+from typing import Dict, Iterator, List, Optional, Tuple
+from .config import DATABASE_PATH, HOSTED_DB_MODE, TENANT_DB_DIR
+from .migrations import migrate, TENANT_MIGRATIONS, TENANT_TABLES
+from .tenants import tenant_path
+
+DEFAULT_TABLES = ['users', 'referrals', 'points_history', 'withdrawals', 'hosted_bots'] + TENANT_TABLES
+BATCH = 1000
+PROGRESS_SECONDS = 5.0
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+    if not cols:
+        raise SystemExit(f"unknown table: {table}")
+    return cols
+
+
+def _bot_column(table: str) -> str:
+    return 'id' if table == 'hosted_bots' else 'bot_id'
+
+
+def _sources(table: str, bot_id: Optional[int], database: str) -> List[Tuple[str, str]]:
+    """(label, file) pairs holding ``table``: the main database, or tenant files in tenant mode."""
+    if HOSTED_DB_MODE != 'tenant' or table not in TENANT_TABLES:
+        return [('main', database)]
+    if bot_id is not None:
+        path = tenant_path(bot_id)
+        return [(f"bot {bot_id}", path)] if os.path.exists(path) else []
+    found = []
+    for path in glob(os.path.join(TENANT_DB_DIR, 'bot_*.db')):
+        name = os.path.basename(path)[4:-3]
+        if name.isdigit():
+            found.append((int(name), path))
+    return [(f"bot {b}", path) for b, path in sorted(found)]
+
+
+class Checkpoint:
+    """JSON file of per-key progress, replaced atomically on every save."""
+
+    def __init__(self, path: str, restart: bool = False):
+        self.path = path
+        self.state: Dict[str, dict] = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        elif os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def get(self, key: str) -> dict:
+        return self.state.get(key, {})
+
+    def save(self, key: str, **progress):
+        self.state[key] = progress
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+class Meter:
+    """Row counter that prints rows/sec every ``PROGRESS_SECONDS`` and at the end."""
+
+    def __init__(self, label: str):
+        self.label, self.rows = label, 0
+        self.start = self.last = time.perf_counter()
+
+    def add(self, n: int):
+        self.rows += n
+        now = time.perf_counter()
+        if now - self.last >= PROGRESS_SECONDS:
+            self.last = now
+            print(f"  {self.label}: {self.rows} rows, {self.rows / (now - self.start):.0f} rows/s", file=sys.stderr)
+
+    def done(self, note: str = '') -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return f"{self.label}: {self.rows} rows in {elapsed:.2f}s ({self.rows / elapsed:.0f} rows/s){note}"
+
+
+def _encode(fmt: str, cols: List[str], rows) -> bytes:
+    if fmt == 'jsonl':
+        return ''.join(json.dumps(dict(zip(cols, r)), ensure_ascii=False) + '\n' for r in rows).encode('utf-8')
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode('utf-8')
+
+
+def export_table(table: str, out_dir: str, fmt: str, bot_id: Optional[int], checkpoint: Checkpoint,
+                 database: str = DATABASE_PATH, batch: int = BATCH) -> List[str]:
+    reports = []
+    suffix = f".bot{bot_id}" if bot_id is not None else ''
+    out_name = f"{table}{suffix}.{fmt}"
+    out_path = os.path.join(out_dir, out_name)
+    for label, path in _sources(table, bot_id, database):
+        key = f"{out_name} [{label}]"
+        conn = _connect(path)
+        cols = _columns(conn, table)
+        progress = checkpoint.get(key)
+        if progress.get('done'):
+            reports.append(f"{key}: already exported")
+            conn.close()
+            continue
+        # Tenant files of one table share an output file: resume at the saved
+        # offset, or append after the sources already finished.
+        offset = progress.get('offset')
+        if offset is None:
+            offset = max((p.get('end', 0) for k, p in checkpoint.state.items() if k.startswith(out_name + ' [')), default=0)
+        last_rowid = progress.get('rowid', 0)
+        sql = f"SELECT rowid, * FROM {table} WHERE rowid > ?"
+        params: tuple = (last_rowid,)
+        if bot_id is not None:
+            if _bot_column(table) not in cols:
+                raise SystemExit(f"{table} has no bot column; drop --bot-id for it")
+            sql += f" AND {_bot_column(table)} = ?"
+            params += (bot_id,)
+        meter = Meter(key)
+        with open(out_path, 'r+b' if os.path.exists(out_path) else 'w+b') as out:
+            out.truncate(offset)
+            out.seek(offset)
+            if offset == 0 and fmt == 'csv':
+                out.write(_encode(fmt, cols, [cols]))
+            cur = conn.execute(sql + " ORDER BY rowid", params)
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    break
+                out.write(_encode(fmt, cols, [r[1:] for r in rows]))
+                out.flush()
+                last_rowid = rows[-1][0]
+                meter.add(len(rows))
+                checkpoint.save(key, rowid=last_rowid, offset=out.tell())
+            checkpoint.save(key, rowid=last_rowid, offset=out.tell(), end=out.tell(), done=True)
+        conn.close()
+        reports.append(meter.done(f" -> {out_path}"))
+    return reports
+
+
+def _records(path: str, fmt: str) -> Iterator[dict]:
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield {k: (v if v != '' else None) for k, v in row.items()}
+
+
+def import_table(table: str, path: str, fmt: str, bot_id: Optional[int], checkpoint: Checkpoint,
+                 database: str = DATABASE_PATH, batch: int = BATCH, on_conflict: str = 'ignore') -> str:
+    if HOSTED_DB_MODE == 'tenant' and table in TENANT_TABLES:
+        if bot_id is None:
+            raise SystemExit(f"{table} lives in tenant files; pass --bot-id")
+        conn = _connect(tenant_path(bot_id))
+        migrate(conn, TENANT_MIGRATIONS)
+    else:
+        conn = _connect(database)
+    cols = _columns(conn, table)
+    if bot_id is not None and _bot_column(table) not in cols:
+        raise SystemExit(f"{table} has no bot column; drop --bot-id for it")
+    key = f"{table}<{os.path.abspath(path)}"
+    skip = checkpoint.get(key).get('records', 0)
+    verb = {'ignore': 'INSERT OR IGNORE', 'replace': 'INSERT OR REPLACE', 'abort': 'INSERT'}[on_conflict]
+    meter, sql, fields, pending, consumed = Meter(table), None, None, [], 0
+
+    def flush():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if pending:
+                conn.executemany(sql, pending)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        meter.add(len(pending))
+        checkpoint.save(key, records=consumed)
+        pending.clear()
+
+    for record in _records(path, fmt):
+        consumed += 1
+        if consumed <= skip:
+            continue
+        if fields is None:
+            fields = [c for c in record if c in cols]
+            unknown = [c for c in record if c not in cols]
+            if unknown:
+                print(f"  {table}: ignoring unknown columns {', '.join(unknown)}", file=sys.stderr)
+            sql = f"{verb} INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})"
+        if bot_id is not None and str(record.get(_bot_column(table))) != str(bot_id):
+            continue
+        pending.append(tuple(record.get(c) for c in fields))
+        if len(pending) >= batch:
+            flush()
+    if sql is not None:
+        flush()
+    conn.close()
+    return meter.done(f" <- {path}" + (f" (resumed after {skip} records)" if skip else ''))
+
+
+def _format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lstrip('.').lower()
+    if ext not in ('jsonl', 'csv'):
+        raise SystemExit(f"cannot tell the format of {path}; pass --format")
+    return ext
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="python -m bot.tools", description="Stream tables to and from JSONL/CSV")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--database", default=DATABASE_PATH)
+    common.add_argument("--batch", type=int, default=BATCH, help="rows per fetch / per import transaction")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", parents=[common], help="write tables to OUT_DIR/<table>[.bot<id>].<format>")
+    p.add_argument("tables", nargs="*", help=f"default: {' '.join(DEFAULT_TABLES)} (hosted tables only with --bot-id)")
+    p.add_argument("--out", required=True, dest="out_dir")
+    p.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    p.add_argument("--bot-id", type=int)
+    p.add_argument("--checkpoint", help="default: OUT_DIR/.export-checkpoint.json")
+    p.add_argument("--restart", action="store_true", help="ignore the checkpoint and export from scratch")
+    p = sub.add_parser("import", parents=[common], help="insert the records of FILE into TABLE")
+    p.add_argument("table")
+    p.add_argument("file")
+    p.add_argument("--format", choices=("jsonl", "csv"))
+    p.add_argument("--bot-id", type=int, help="only rows of this hosted bot")
+    p.add_argument("--on-conflict", choices=("ignore", "replace", "abort"), default="ignore")
+    p.add_argument("--checkpoint", help="default: FILE.checkpoint.json")
+    p.add_argument("--restart", action="store_true", help="ignore the checkpoint and import from the first record")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        os.makedirs(args.out_dir, exist_ok=True)
+        checkpoint = Checkpoint(args.checkpoint or os.path.join(args.out_dir, ".export-checkpoint.json"), args.restart)
+        tables = args.tables or ([t for t in DEFAULT_TABLES if t == 'hosted_bots' or t in TENANT_TABLES] if args.bot_id is not None else DEFAULT_TABLES)
+        for table in tables:
+            for line in export_table(table, args.out_dir, args.format, args.bot_id, checkpoint, args.database, args.batch):
+                print(line)
+    else:
+        checkpoint = Checkpoint(args.checkpoint or args.file + ".checkpoint.json", args.restart)
+        print(import_table(args.table, args.file, _format(args.file, args.format), args.bot_id, checkpoint, args.database, args.batch, args.on_conflict))
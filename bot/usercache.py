@@ -0,0 +1,82 @@
+"""Small in-process cache of user rows, keyed by (bot id, user id).
+
+``Users.get`` and ``HostedUsers.get`` go through it (main bot rows use bot id
+0), so the row ``UserLoaderMiddleware`` loads for an update is usually served
+from memory and the handler's later lookups cost nothing. Entries live
+``USER_CACHE_TTL_SECONDS`` and the least recently used are evicted past
+``USER_CACHE_SIZE``.
+
+Every write path that touches a user row calls ``invalidate``. Inside a
+``transaction()`` the entry is dropped again once the batch commits, and a load
+that was already running when the row changed is not stored, so a reader never
+re-caches the value from before the write. The TTL only bounds staleness from
+writers outside this process (``bot.tools import``, manual SQL). Cached rows
+are shared: treat them as read-only and use ``dataclasses.replace`` for a
+local copy.
+"""
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Set, Tuple
+from .config import USER_CACHE_TTL_SECONDS, USER_CACHE_SIZE
+
+Key = Tuple[int, int]
+
+
+class UserCache:
+    entries: 'OrderedDict[Key, tuple]' = OrderedDict()
+    stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+    # Keys with a load in flight, and those invalidated while loading.
+    _loading: Dict[Key, int] = {}
+    _stale: Set[Key] = set()
+
+    @staticmethod
+    async def get(bot_id: int, user_id: int, load: Callable[[], Awaitable]):
+        """The cached row, or ``await load()`` stored for next time (``None`` is not cached)."""
+        key = (bot_id, user_id)
+        entry = UserCache.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            UserCache.entries.move_to_end(key)
+            UserCache.stats['hits'] += 1
+            return entry[1]
+        UserCache.stats['misses'] += 1
+        UserCache._loading[key] = UserCache._loading.get(key, 0) + 1
+        try:
+            row = await load()
+        finally:
+            left = UserCache._loading.pop(key) - 1
+            stale = key in UserCache._stale
+            if left:
+                UserCache._loading[key] = left
+            else:
+                UserCache._stale.discard(key)
+        if row is not None and not stale and USER_CACHE_TTL_SECONDS > 0:
+            UserCache.entries[key] = (time.monotonic() + USER_CACHE_TTL_SECONDS, row)
+            UserCache.entries.move_to_end(key)
+            while len(UserCache.entries) > USER_CACHE_SIZE:
+                UserCache.entries.popitem(last=False)
+        return row
+
+    @staticmethod
+    def _drop(key: Key):
+        UserCache.entries.pop(key, None)
+        if key in UserCache._loading:
+            UserCache._stale.add(key)
+
+    @staticmethod
+    def invalidate(bot_id: int, user_id: int, pool=None):
+        """Forget the row now and, when called inside ``pool``'s write batch, again after it commits."""
+        key = (bot_id, user_id)
+        UserCache.stats['invalidations'] += 1
+        UserCache._drop(key)
+        if pool is not None:
+            pool.after_commit(lambda: UserCache._drop(key))
+
+    @staticmethod
+    def drop_bot(bot_id: int):
+        for key in [k for k in UserCache.entries if k[0] == bot_id]:
+            UserCache._drop(key)
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        lookups = UserCache.stats['hits'] + UserCache.stats['misses']
+        return {**UserCache.stats, 'size': len(UserCache.entries), 'hit_rate': round(100 * UserCache.stats['hits'] / lookups) if lookups else 0}
@@ -5,6 +5,8 @@ from aiohttp import web
 from datetime import datetime
 from .config import VERIFICATION_SERVER_PORT, FINGERPRINT_WEB_URL, logger
 from .database import SecretLinkSystem, SmartIPBan, FingerprintSystem, PointsSystem, SettingsManager
+from .repository import Users
+from .webhooks import Webhooks
 
 async def handle_fingerprint_verification(request):
     # ✅ إضافة دعم CORS للمواقع الخارجية مثل GitHub Pages
@@ -25,9 +27,18 @@ async def handle_fingerprint_verification(request):
         if not all([user_id, fp, sec]):
             return web.json_response({"success": False, "message": "بيانات ناقصة"}, status=400, headers=headers)
 
+        # initData is signed by Telegram with the bot token, so the user id comes from Telegram, not the URL.
+        init_data = data.get("init_data")
+        if init_data or await SettingsManager.get_bool_setting("REQUIRE_WEBAPP_AUTH", True):
+            expiry = await SettingsManager.get_int_setting("SECRET_LINK_EXPIRY_MINUTES", 5)
+            if SecretLinkSystem.verify_init_data(init_data, max(expiry, 1) * 60) != user_id:
+                return web.json_response({"success": False, "message": "⚠️ افتح صفحة التحقق من داخل تيليجرام"}, status=403, headers=headers)
+
         v_l, l_m = await SecretLinkSystem.verify_link(sec, user_id)
         if not v_l:
             return web.json_response({"success": False, "message": f"⚠️ {l_m}"}, headers=headers)
+        if await Users.is_fingerprint_verified(user_id):
+            return web.json_response({"success": True, "message": "✅ تم التحقق مسبقاً", "welcome_bonus": 0}, headers=headers)
 
         ip_c = await SmartIPBan.check_ip(ip, user_id)
         if ip_c["banned"]:
@@ -40,8 +51,11 @@ async def handle_fingerprint_verification(request):
         except:
             pass
 
-        dup = await FingerprintSystem.check_duplicate(fp, user_id)
-        if dup["duplicate"]:
+        dup = await FingerprintSystem.check_duplicate(fp, user_id, comp)
+        similar_pct = await SettingsManager.get_int_setting("DEVICE_SIMILARITY_PERCENT", 0)
+        if dup["duplicate"] or (similar_pct > 0 and dup["similarity"] * 100 >= similar_pct):
+            if not dup["duplicate"]:
+                logger.info(f"Near-duplicate device for {user_id}: {dup['similarity']:.0%} like {dup['similar_user']}")
             return web.json_response({"success": False, "message": "⚠️ جهاز مسجل مسبقاً"}, headers=headers)
 
         await FingerprintSystem.save_fingerprint(user_id, fp, comp, ip)
@@ -63,6 +77,7 @@ async def start_verification_server():
     app.router.add_route('*', '/verify-fingerprint', handle_fingerprint_verification)
     app.router.add_get('/index.html', serve_fingerprint_html)
     app.router.add_get('/', serve_fingerprint_html)
+    Webhooks.setup(app)
     if not os.path.exists('stickers'): os.makedirs('stickers')
     app.router.add_static('/stickers/', path='stickers', name='stickers')
     runner = web.AppRunner(app); await runner.setup(); await web.TCPSite(runner, '0.0.0.0', VERIFICATION_SERVER_PORT).start()
@@ -0,0 +1,172 @@
+"""Webhook delivery for the main bot and every hosted bot through one aiohttp app.
+
+With ``WEBHOOK_BASE_URL`` set, each bot is registered with Telegram at
+``WEBHOOK_BASE_URL/webhook/<bot_id>`` (the main bot is id 0) when it starts
+or its token changes, instead of running its own ``getUpdates`` loop.
+Telegram sends every update with the bot's secret token, an HMAC of the bot
+id, so a request can only reach the dispatcher it was signed for. The route
+lives on the verification server, answers 200 at once and feeds the update to
+the bot's Dispatcher in a background task, as polling does.
+
+If ``setWebhook`` fails for a bot, that bot alone falls back to polling.
+
+``python -m bot.webhooks`` runs a self-check against a local fake Bot API.
+"""
+import asyncio
+import hashlib
+import hmac
+from typing import Dict, Set, Tuple
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from .config import logger, BOT_TOKEN, WEBHOOK_BASE_URL, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class Webhooks:
+    # bot_id -> (bot, dispatcher) of every bot receiving updates by webhook.
+    targets: Dict[int, Tuple[Bot, Dispatcher]] = {}
+    _tasks: Set[asyncio.Task] = set()
+    _key = hmac.new(b'webhook', (WEBHOOK_SECRET or BOT_TOKEN or '').encode(), hashlib.sha256).digest()
+    stats = {'updates': 0, 'rejected': 0, 'fallbacks': 0}
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(WEBHOOK_BASE_URL)
+
+    @staticmethod
+    def url(bot_id: int) -> str:
+        return f"{WEBHOOK_BASE_URL.rstrip('/')}/webhook/{bot_id}"
+
+    @staticmethod
+    def secret(bot_id: int) -> str:
+        return hmac.new(Webhooks._key, str(bot_id).encode(), hashlib.sha256).hexdigest()
+
+    @staticmethod
+    async def attach(bot_id: int, bot: Bot, dp: Dispatcher) -> bool:
+        """Point the bot's webhook here; ``False`` means the caller should poll instead."""
+        if not Webhooks.enabled():
+            return False
+        try:
+            await bot.set_webhook(Webhooks.url(bot_id), secret_token=Webhooks.secret(bot_id), max_connections=WEBHOOK_MAX_CONNECTIONS,
+                                  allowed_updates=dp.resolve_used_update_types())
+        except Exception as e:
+            logger.warning(f"Webhook for bot {bot_id} failed, polling instead: {e}")
+            Webhooks.stats['fallbacks'] += 1
+            return False
+        Webhooks.targets[bot_id] = (bot, dp)
+        return True
+
+    @staticmethod
+    async def detach(bot_id: int, delete: bool = True):
+        """Stop routing updates to the bot; ``delete`` also removes the webhook at Telegram."""
+        target = Webhooks.targets.pop(bot_id, None)
+        if target is not None and delete:
+            try:
+                await target[0].delete_webhook()
+            except Exception as e:
+                logger.warning(f"Could not delete webhook of bot {bot_id}: {e}")
+
+    @staticmethod
+    async def poll(bot: Bot, dp: Dispatcher, **kwargs):
+        """``start_polling``, after clearing a webhook left from webhook mode (getUpdates refuses to run while one is set)."""
+        if Webhooks.enabled():
+            try:
+                await bot.delete_webhook()
+            except Exception as e:
+                logger.warning(f"Could not delete webhook before polling: {e}")
+        await dp.start_polling(bot, **kwargs)
+
+    @staticmethod
+    async def handle(request: web.Request) -> web.Response:
+        try:
+            bot_id = int(request.match_info['bot_id'])
+        except ValueError:
+            return web.Response(status=404)
+        target = Webhooks.targets.get(bot_id)
+        if target is None:
+            return web.Response(status=404)
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), Webhooks.secret(bot_id)):
+            Webhooks.stats['rejected'] += 1
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        bot, dp = target
+        task = asyncio.create_task(dp.feed_raw_update(bot, update))
+        Webhooks._tasks.add(task)
+        task.add_done_callback(Webhooks._done)
+        Webhooks.stats['updates'] += 1
+        return web.Response()
+
+    @staticmethod
+    def _done(task: asyncio.Task):
+        Webhooks._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Webhook update failed: {task.exception()}")
+
+    @staticmethod
+    def setup(app: web.Application):
+        app.router.add_post('/webhook/{bot_id}', Webhooks.handle)
+
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        return {**Webhooks.stats, 'bots': len(Webhooks.targets), 'in_flight': len(Webhooks._tasks)}
+
+
+async def _self_check():
+    """Fake Bot API + webhook app on localhost: registration, routing and secret checks."""
+    from aiohttp import ClientSession
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    calls = []
+
+    async def fake_api(request):
+        data = dict(await request.post())
+        calls.append((request.match_info['token'], request.match_info['method'], data))
+        return web.json_response({'ok': True, 'result': True})
+
+    api = web.Application()
+    api.router.add_post('/bot{token}/{method}', fake_api)
+    hooks = web.Application()
+    Webhooks.setup(hooks)
+    runners = [web.AppRunner(api), web.AppRunner(hooks)]
+    for r in runners:
+        await r.setup()
+    await web.TCPSite(runners[0], '127.0.0.1', 18081).start()
+    await web.TCPSite(runners[1], '127.0.0.1', 18082).start()
+
+    seen = []
+    bots = {}
+    for bot_id in (0, 7):
+        bot = Bot(token=f"{100 + bot_id}:test", session=AiohttpSession(api=TelegramAPIServer.from_base('http://127.0.0.1:18081')))
+        dp = Dispatcher()
+        dp.message.register(lambda message, _id=bot_id: seen.append((_id, message.text)))
+        assert await Webhooks.attach(bot_id, bot, dp)
+        bots[bot_id] = bot
+    assert [c[1] for c in calls] == ['setWebhook', 'setWebhook']
+    assert calls[1][2]['url'].endswith('/webhook/7') and calls[1][2]['secret_token'] == Webhooks.secret(7)
+
+    update = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 5, 'type': 'private'}, 'text': 'hi'}}
+    async with ClientSession() as http:
+        async def post(bot_id, secret):
+            async with http.post(f'http://127.0.0.1:18082/webhook/{bot_id}', json=update, headers={SECRET_HEADER: secret}) as r:
+                return r.status
+        statuses = [await post(7, Webhooks.secret(7)), await post(7, Webhooks.secret(0)), await post(3, Webhooks.secret(3)), await post(0, Webhooks.secret(0))]
+    await asyncio.sleep(0.1)
+    await Webhooks.detach(7)
+    print(f"statuses {statuses}, dispatched {seen}, api calls {[c[1] for c in calls]}, stats {Webhooks.get_stats()}")
+    assert statuses == [200, 401, 404, 200] and sorted(seen) == [(0, 'hi'), (7, 'hi')] and calls[-1][1] == 'deleteWebhook'
+    for bot in bots.values():
+        await bot.session.close()
+    for r in runners:
+        await r.cleanup()
+    print("ok")
+
+
+if __name__ == '__main__':
+    if not WEBHOOK_BASE_URL:
+        WEBHOOK_BASE_URL = 'http://127.0.0.1:18082'
+    asyncio.run(_self_check())
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# bot.config exits without a token and admin id; keep the default database out of the working tree.
+os.environ.setdefault('BOT_TOKEN', '1:test')
+os.environ.setdefault('ADMIN_ID', '1')
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='bot-tests-'), 'bot.db'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
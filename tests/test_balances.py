@@ -0,0 +1,70 @@
+"""1,000 parallel requests of each balance operation against one user on a scratch database."""
+import asyncio
+
+from bot.balances import Balances
+from bot.database import DatabasePool
+from bot.migrations import migrate
+
+CLAIMS = 1000
+START_POINTS, START_TON, START_STARS = 5000, 250, 1000
+
+
+def _run(tmp_path, scenario):
+    async def main():
+        pool = DatabasePool(str(tmp_path / 'balances.db'), 4, 0.005, 256, schema=migrate)
+        await pool.execute("INSERT INTO users (telegram_id, username, full_name, referral_code, points, ton_balance, stars_balance, wallet_address) VALUES (1, 'u', 'U', 'r', ?, ?, ?, 'EQ')",
+                           (START_POINTS, START_TON, START_STARS))
+        await pool.execute("INSERT INTO tasks (name, points, is_active) VALUES ('t', 5, 1)")
+        try:
+            await scenario(pool)
+            # Every change to points went through the ledger.
+            points = await pool.fetchval('SELECT points FROM users WHERE telegram_id = 1')
+            ledger = await pool.fetchval('SELECT SUM(points) FROM points_history WHERE user_id = 1', default=0)
+            assert points >= 0 and START_POINTS + ledger == points
+        finally:
+            await pool.close()
+    asyncio.run(main())
+
+
+async def _accepted(op) -> int:
+    return sum(r.ok for r in await asyncio.gather(*(op() for _ in range(CLAIMS))))
+
+
+def test_daily_bonus_is_claimed_once(tmp_path):
+    async def scenario(pool):
+        assert await _accepted(lambda: Balances.claim_daily(1, 10, 5, 100, 7, pool=pool)) == 1
+        assert await pool.fetchval("SELECT COUNT(*) FROM points_history WHERE action_type = 'daily_bonus'") == 1
+    _run(tmp_path, scenario)
+
+
+def test_task_is_completed_once(tmp_path):
+    async def scenario(pool):
+        assert await _accepted(lambda: Balances.complete_task(1, 1, 5, 't', 50, pool=pool)) == 1
+        assert await pool.fetchval('SELECT COUNT(*) FROM user_tasks WHERE user_id = 1') == 1
+        # The only active task is done, so the all-tasks bonus is paid exactly once too.
+        assert await pool.fetchval('SELECT points FROM users WHERE telegram_id = 1') == START_POINTS + 5 + 50
+    _run(tmp_path, scenario)
+
+
+def test_ton_withdrawals_never_overdraw(tmp_path):
+    async def scenario(pool):
+        assert await _accepted(lambda: Balances.withdraw(1, 'TON', 1.0, pool=pool)) == START_TON
+        assert await pool.fetchval('SELECT ton_balance FROM users WHERE telegram_id = 1') == 0
+        assert await pool.fetchval("SELECT COUNT(*) FROM withdrawals WHERE asset_type = 'TON' AND status = 'pending'") == START_TON
+    _run(tmp_path, scenario)
+
+
+def test_stars_withdrawals_never_overdraw(tmp_path):
+    async def scenario(pool):
+        assert await _accepted(lambda: Balances.withdraw(1, 'STARS', 100, pool=pool)) == START_STARS // 100
+        assert await pool.fetchval('SELECT stars_balance FROM users WHERE telegram_id = 1') == 0
+    _run(tmp_path, scenario)
+
+
+def test_conversions_never_overspend_points(tmp_path):
+    async def scenario(pool):
+        ok = await _accepted(lambda: Balances.convert(1, 10, ton=0.01, pool=pool))
+        assert ok == min(CLAIMS, START_POINTS // 10)
+        row = await pool.fetchone('SELECT points, ton_balance FROM users WHERE telegram_id = 1')
+        assert row['points'] == START_POINTS - 10 * ok and abs(row['ton_balance'] - (START_TON + ok * 0.01)) < 1e-6
+    _run(tmp_path, scenario)
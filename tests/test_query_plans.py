@@ -0,0 +1,34 @@
+import sqlite3
+from pathlib import Path
+
+import bot
+from bot.migrations import check_query_plans, full_scans, migrate
+
+
+def _schema(tmp_path) -> sqlite3.Connection:
+    conn = sqlite3.connect(tmp_path / 'plans.db')
+    migrate(conn)
+    return conn
+
+
+def test_no_query_reads_a_large_table_in_full(tmp_path):
+    conn = _schema(tmp_path)
+    assert check_query_plans(conn, Path(bot.__file__).parent) == []
+
+
+def test_index_scan_counts_as_full_scan(tmp_path):
+    conn = _schema(tmp_path)
+    assert full_scans(conn, 'SELECT COUNT(*) FROM user_tasks') == ['user_tasks']
+    assert full_scans(conn, 'SELECT COUNT(*) FROM referrals WHERE is_valid = 1') == ['referrals']
+    assert full_scans(conn, 'SELECT COUNT(*) FROM user_tasks WHERE user_id = ?') == []
+
+
+def test_unlisted_fstring_query_is_reported(tmp_path):
+    conn = _schema(tmp_path)
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'queries.py').write_text('def q(table):\n    return f"SELECT points FROM {table} WHERE user_id = ?"\n', encoding='utf-8')
+    problems = check_query_plans(conn, src)
+    assert len(problems) == 1 and 'cannot plan' in problems[0]
+    assert check_query_plans(conn, src, expand={'SELECT points FROM {table} WHERE user_id = ?': ['SELECT points FROM points_history']}) == [
+        'queries.py:2: full scan of points_history: SELECT points FROM points_history']